@@ -0,0 +1,137 @@
+"""
+Zalo OA Finance Workflow - Dashboard Aggregates
+Bộ đếm thống kê cập nhật tăng dần theo từng thay đổi của lead/hồ sơ,
+để dashboard đọc O(1) thay vì quét toàn bộ dữ liệu mỗi lần polling
+"""
+
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+RECENT_LEADS = 5
+# Giữ dư để xóa vài lead gần nhất không phải nạp lại ngay
+RECENT_BUFFER = RECENT_LEADS * 4
+
+
+def _day(record):
+    return (record.get('created_at') or '')[:10]
+
+
+class DashboardAggregates:
+    """
+    Thống kê dashboard: số lead theo trạng thái, theo ngày tạo, top-K lead mới nhất,
+    số hồ sơ theo trạng thái và số hội thoại
+    """
+
+    def __init__(self, refill_recent):
+        # refill_recent(n) -> n lead mới nhất, dùng khi top-K bị xóa hụt
+        self._refill_recent = refill_recent
+        self._lock = threading.Lock()
+        self.lead_total = 0
+        self.lead_by_status = Counter()
+        self.leads_by_day = Counter()
+        self.document_total = 0
+        self.document_by_status = Counter()
+        self.conversation_total = 0
+        self._recent = []
+        self._recent_complete = True
+
+    def rebuild(self, leads, documents, conversation_total):
+        with self._lock:
+            self.lead_total = 0
+            self.lead_by_status = Counter()
+            self.leads_by_day = Counter()
+            self.document_total = 0
+            self.document_by_status = Counter()
+            self._recent = []
+            self._recent_complete = True
+            for lead in leads:
+                self._add_lead(lead)
+            for document in documents:
+                self._add_document(document)
+            self.conversation_total = conversation_total
+
+    def snapshot(self, day):
+        """Số liệu hiện tại cho dashboard, day dạng YYYY-MM-DD"""
+        with self._lock:
+            return {
+                'total_leads': self.lead_total,
+                'new_leads': self.leads_by_day.get(day, 0),
+                'lead_by_status': dict(self.lead_by_status),
+                'total_documents': self.document_total,
+                'pending_documents': self.document_by_status.get('pending', 0),
+                'total_conversations': self.conversation_total
+            }
+
+    # ----- leads -----
+
+    def lead_changed(self, before, after):
+        """before/after là bản chụp lead trước và sau thay đổi (None khi tạo mới/xóa)"""
+        with self._lock:
+            if before is not None:
+                self._remove_lead(before)
+            if after is not None:
+                self._add_lead(after)
+
+    def _add_lead(self, lead):
+        self.lead_total += 1
+        self.lead_by_status[lead.get('status', 'unknown')] += 1
+        self.leads_by_day[_day(lead)] += 1
+        position = (lead.get('created_at') or '', lead['id'])
+        if len(self._recent) < RECENT_BUFFER or position > self._recent[0]:
+            insort(self._recent, position)
+            if len(self._recent) > RECENT_BUFFER:
+                del self._recent[0]
+                self._recent_complete = False
+
+    def _remove_lead(self, lead):
+        self.lead_total -= 1
+        status = lead.get('status', 'unknown')
+        self.lead_by_status[status] -= 1
+        if self.lead_by_status[status] <= 0:
+            del self.lead_by_status[status]
+        day = _day(lead)
+        self.leads_by_day[day] -= 1
+        if self.leads_by_day[day] <= 0:
+            del self.leads_by_day[day]
+        position = (lead.get('created_at') or '', lead['id'])
+        i = bisect_left(self._recent, position)
+        if i < len(self._recent) and self._recent[i] == position:
+            del self._recent[i]
+
+    def recent_lead_ids(self):
+        """ID của RECENT_LEADS lead mới nhất"""
+        with self._lock:
+            if len(self._recent) < min(RECENT_LEADS, self.lead_total) and not self._recent_complete:
+                self._recent = sorted(
+                    (lead.get('created_at') or '', lead['id'])
+                    for lead in self._refill_recent(RECENT_BUFFER)
+                )
+                self._recent_complete = len(self._recent) >= self.lead_total
+            return [lead_id for _, lead_id in reversed(self._recent[-RECENT_LEADS:])]
+
+    # ----- documents -----
+
+    def document_changed(self, before, after):
+        with self._lock:
+            if before is not None:
+                self._remove_document(before)
+            if after is not None:
+                self._add_document(after)
+
+    def _add_document(self, document):
+        self.document_total += 1
+        self.document_by_status[document.get('status', 'pending')] += 1
+
+    def _remove_document(self, document):
+        self.document_total -= 1
+        status = document.get('status', 'pending')
+        self.document_by_status[status] -= 1
+        if self.document_by_status[status] <= 0:
+            del self.document_by_status[status]
+
+    # ----- conversations -----
+
+    def conversation_started(self, count=1):
+        with self._lock:
+            self.conversation_total += count
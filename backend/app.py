@@ -3,58 +3,211 @@ Zalo OA Finance Workflow - Backend API Server
 Giả lập Zalo OA API + Quản lý Workflow Tư Vấn Tài Chính
 """
 
+import io
 import os
 import json
 import uuid
+import time
+import random
 import hashlib
+import threading
 from datetime import datetime, timedelta
 from functools import wraps
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import jwt
 from dotenv import load_dotenv
 
+from storage import open_storage, decode_cursor
+from search import LeadSearchIndex
+from aggregates import DashboardAggregates
+from chatbot import IntentMatcher, IntentScorer
+from ingest import WebhookQueue, QueueFull, DedupCache
+from realtime import LeadUpdateCoalescer, lead_room, user_room, role_room
+from auth import Principal, TokenCache, PasswordHasher, HasherBusy, role_permissions
+from metrics import LatencyHistogram
+from zalo_client import ZaloClient, AsyncZaloClient, TokenManager, ZaloAPIError, DEFAULT_OAUTH_URL
+import zalo_stub
+from broadcast import BroadcastEngine, BroadcastScheduler, validate_audience, parse_scheduled_time
+from email_client import EmailSender, EmailError
+import smtp_stub
+from ocr import OCRService, start_pool
+from uploads import UploadStore, UploadError
+from lead_import import LeadImporter, LeadImportError
+from notifications import (
+    NotificationDispatcher, CHANNELS, compile_templates, lead_variables, bulk_targets, render_jobs
+)
+
 load_dotenv()
 
 app = Flask(__name__, static_folder='../frontend', static_url_path='')
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=['X-Next-Cursor', 'Upload-Offset'])
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 
 # Configuration
 SECRET_KEY = os.getenv('SECRET_KEY', 'zalo-oa-finance-secret-key-2025')
 ZALO_OA_ID = os.getenv('ZALO_OA_ID', 'demo_oa_id_12345')
 ZALO_ACCESS_TOKEN = os.getenv('ZALO_ACCESS_TOKEN', 'demo_access_token')
+# Base URL của Zalo OA API (https://openapi.zalo.me/v3.0/oa), 'stub' = stub giả lập chạy trong tiến trình
+ZALO_API_URL = os.getenv('ZALO_API_URL', 'stub')
+ZALO_OAUTH_URL = os.getenv('ZALO_OAUTH_URL', DEFAULT_OAUTH_URL)
+ZALO_REFRESH_TOKEN = os.getenv('ZALO_REFRESH_TOKEN', '')
+ZALO_APP_ID = os.getenv('ZALO_APP_ID', '')
+ZALO_APP_SECRET = os.getenv('ZALO_APP_SECRET', '')
+# Client Zalo OA: pool kết nối (client đồng bộ), timeout (giây), thử lại với backoff
+ZALO_POOL_SIZE = int(os.getenv('ZALO_POOL_SIZE', '10'))
+ZALO_TIMEOUT = float(os.getenv('ZALO_TIMEOUT', '10'))
+ZALO_MAX_RETRIES = int(os.getenv('ZALO_MAX_RETRIES', '3'))
+ZALO_BACKOFF_BASE = float(os.getenv('ZALO_BACKOFF_BASE', '0.2'))
+ZALO_BACKOFF_CAP = float(os.getenv('ZALO_BACKOFF_CAP', '5'))
+# memory:// (mặc định, mất dữ liệu khi restart) hoặc sqlite:///database/app.db
+DATABASE_URL = os.getenv('DATABASE_URL', 'memory://')
+# exact: chỉ khớp chuỗi con | fuzzy: thêm chấm điểm n-gram không dấu
+CHATBOT_MATCH_MODE = os.getenv('CHATBOT_MATCH_MODE', 'fuzzy')
+CHATBOT_FUZZY_THRESHOLD = float(os.getenv('CHATBOT_FUZZY_THRESHOLD', '0.6'))
+# Webhook ingestion queue: reject (503) | drop_oldest | block
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '10000'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+WEBHOOK_OVERFLOW = os.getenv('WEBHOOK_OVERFLOW', 'reject')
+WEBHOOK_BLOCK_TIMEOUT = float(os.getenv('WEBHOOK_BLOCK_TIMEOUT', '2'))
+WEBHOOK_BATCH_MAX = int(os.getenv('WEBHOOK_BATCH_MAX', '100000'))
+# Chống xử lý trùng khi Zalo gửi lại sự kiện
+WEBHOOK_DEDUP_SIZE = int(os.getenv('WEBHOOK_DEDUP_SIZE', '100000'))
+WEBHOOK_DEDUP_TTL = float(os.getenv('WEBHOOK_DEDUP_TTL', '600'))
+# Cửa sổ gộp lead_updated (ms)
+LEAD_UPDATE_COALESCE_MS = int(os.getenv('LEAD_UPDATE_COALESCE_MS', '200'))
+# Hội thoại không hoạt động quá CONVERSATION_IDLE_SECONDS được chuyển xuống archive
+# trên đĩa (chỉ với memory://, để trống CONVERSATION_ARCHIVE_DIR để tắt)
+CONVERSATION_ARCHIVE_DIR = os.getenv('CONVERSATION_ARCHIVE_DIR', 'database/archive')
+CONVERSATION_IDLE_SECONDS = int(os.getenv('CONVERSATION_IDLE_SECONDS', str(3 * 24 * 3600)))
+ARCHIVE_SWEEP_SECONDS = int(os.getenv('ARCHIVE_SWEEP_SECONDS', '300'))
+# Số token đã xác thực được giữ trong cache
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+# Băm mật khẩu bcrypt trong pool riêng: số worker, số việc chờ tối đa, thời gian chờ (giây)
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', '64'))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '5'))
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+# Gửi broadcast: số request đồng thời, số người nhận mỗi lô, quota OA (tin/giây, 0 = không giới hạn)
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '50'))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '500'))
+BROADCAST_RATE_LIMIT = float(os.getenv('BROADCAST_RATE_LIMIT', '0'))
+# OCR hồ sơ: engine (demo | tesseract), số tiến trình (mặc định = số core), job chờ tối đa, timeout (giây)
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'demo')
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '0')) or os.cpu_count() or 1
+OCR_QUEUE_SIZE = int(os.getenv('OCR_QUEUE_SIZE', '1000'))
+OCR_TIMEOUT = float(os.getenv('OCR_TIMEOUT', '120'))
+OCR_LANG = os.getenv('OCR_LANG', 'vie')
+# Engine demo: thời gian CPU giả lập cho mỗi hồ sơ (ms)
+OCR_DEMO_WORK_MS = float(os.getenv('OCR_DEMO_WORK_MS', '0'))
+# Tiền xử lý ảnh trước OCR (thu nhỏ, xám, chỉnh nghiêng, cắt thẻ, nhị phân hóa), cạnh dài tối đa (px)
+OCR_PREPROCESS = os.getenv('OCR_PREPROCESS', 'true').lower() == 'true'
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', '1200'))
+# Upload file hồ sơ theo từng phần: thư mục lưu, kích thước file / mỗi phần tối đa (byte),
+# phiên upload dở dang bị xóa sau UPLOAD_EXPIRE_SECONDS
+UPLOAD_DIR = os.path.abspath(os.getenv('UPLOAD_DIR', 'database/uploads'))
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+UPLOAD_EXPIRE_SECONDS = int(os.getenv('UPLOAD_EXPIRE_SECONDS', str(24 * 3600)))
+# Nhập lead từ CSV/XLSX: thư mục file tạm, kích thước file tối đa (byte), số dòng mỗi khối, số file chờ tối đa
+IMPORT_DIR = os.path.abspath(os.getenv('IMPORT_DIR', 'database/imports'))
+IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', str(200 * 1024 * 1024)))
+IMPORT_CHUNK_ROWS = int(os.getenv('IMPORT_CHUNK_ROWS', '5000'))
+IMPORT_QUEUE_SIZE = int(os.getenv('IMPORT_QUEUE_SIZE', '20'))
+# Tên doanh nghiệp, hotline điền vào mẫu thông báo
+BUSINESS_NAME = os.getenv('BUSINESS_NAME', 'Tư Vấn Tài Chính Demo')
+BUSINESS_HOTLINE = os.getenv('BUSINESS_HOTLINE', '1900 1234')
+# Gửi thông báo hàng loạt: worker mỗi kênh, việc chờ tối đa mỗi kênh, người nhận tối đa mỗi lần gửi
+NOTIFICATION_WORKERS = int(os.getenv('NOTIFICATION_WORKERS', '8'))
+NOTIFICATION_QUEUE_SIZE = int(os.getenv('NOTIFICATION_QUEUE_SIZE', '200000'))
+NOTIFICATION_BULK_MAX = int(os.getenv('NOTIFICATION_BULK_MAX', '50000'))
+# SMTP cho kênh email, 'stub' = SMTP giả lập chạy trong tiến trình
+SMTP_HOST = os.getenv('SMTP_HOST', 'stub')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+SMTP_USER = os.getenv('SMTP_USER', '')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
+SMTP_SENDER = os.getenv('SMTP_SENDER', 'no-reply@demo.vn')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'false').lower() == 'true'
+# WAL + snapshot cho memory:// (để trống JOURNAL_DIR thì mất dữ liệu khi restart)
+JOURNAL_DIR = os.getenv('JOURNAL_DIR', '')
+JOURNAL_FSYNC = os.getenv('JOURNAL_FSYNC', 'false').lower() == 'true'
+SNAPSHOT_INTERVAL_SECONDS = int(os.getenv('SNAPSHOT_INTERVAL_SECONDS', '600'))
+SNAPSHOT_WAL_BYTES = int(os.getenv('SNAPSHOT_WAL_BYTES', str(64 * 1024 * 1024)))
 
-# In-memory database simulation
-DATABASE = {
-    'users': {},
-    'leads': {},
-    'conversations': {},
-    'documents': {},
-    'notifications': {},
-    'workflow_status': {},
-    'chatbot_intents': {},
-    'broadcast_messages': [],
-    'analytics': {
-        'total_leads': 0,
-        'messages_sent': 0,
-        'documents_processed': 0,
-        'active_conversations': 0
-    }
-}
+# Fork tiến trình OCR trước khi nạp dữ liệu và trước mọi thread nền (storage, hàng đợi, scheduler)
+ocr_pool = start_pool(OCR_WORKERS)
+
+_restore_started = time.perf_counter()
+db = open_storage(
+    DATABASE_URL,
+    archive_dir=CONVERSATION_ARCHIVE_DIR or None,
+    journal_dir=JOURNAL_DIR or None,
+    journal_fsync=JOURNAL_FSYNC
+)
+if getattr(db, 'journal', None) is not None:
+    print(f'Restored {db.name} storage from {JOURNAL_DIR} in {time.perf_counter() - _restore_started:.2f}s')
+
+# Pagination
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_SEARCH_RESULTS = 100
+# Trường lọc lead (đều có index)
+LEAD_FILTER_FIELDS = ('status', 'assigned_to', 'source', 'product_interest', 'labels')
+# Trường lọc lead nhận nhiều giá trị (lead phải có đủ các giá trị)
+LEAD_LIST_FILTER_FIELDS = ('labels',)
+# Trường lọc hồ sơ (đều có index)
+DOCUMENT_FILTER_FIELDS = ('lead_id', 'status', 'type')
+
+# Search index over lead name/phone/id
+lead_index = LeadSearchIndex()
+
+# Dashboard counters, kept up to date by every lead/document mutation
+dashboard = DashboardAggregates(refill_recent=lambda n: db.page('leads', n)[0])
+
+# Rebuild in-memory indexes from storage on startup
+_leads = db.values('leads')
+lead_index.rebuild(_leads)
+dashboard.rebuild(_leads, db.values('documents'), db.count('conversations'))
+del _leads
+
+def snapshot_scheduler():
+    """Chụp snapshot khi WAL đủ lớn hoặc đủ lâu kể từ lần trước"""
+    last = time.monotonic()
+    while True:
+        time.sleep(5)
+        written = db.journal.bytes_written
+        if written >= SNAPSHOT_WAL_BYTES or (written and time.monotonic() - last >= SNAPSHOT_INTERVAL_SECONDS):
+            try:
+                db.snapshot()
+            except Exception as e:
+                print(f'Snapshot error: {e}')
+            last = time.monotonic()
+
+if getattr(db, 'journal', None) is not None:
+    threading.Thread(target=snapshot_scheduler, name='snapshot-scheduler', daemon=True).start()
+
+password_hasher = PasswordHasher(
+    workers=PASSWORD_HASH_WORKERS,
+    queue_size=PASSWORD_HASH_QUEUE,
+    timeout=PASSWORD_HASH_TIMEOUT,
+    rounds=BCRYPT_ROUNDS
+)
+# Thời gian xử lý /api/auth/login (gồm cả chờ pool băm mật khẩu)
+login_latency = LatencyHistogram()
 
 # Default admin user
-DATABASE['users']['admin'] = {
-    'id': 'admin',
-    'username': 'admin',
-    'password': hashlib.sha256('admin123'.encode()).hexdigest(),
-    'role': 'quan_tri_vien',
-    'name': 'Quản Trị Viên',
-    'email': 'admin@demo.vn',
-    'created_at': datetime.now().isoformat()
-}
+if db.get('users', 'admin') is None:
+    db.put('users', 'admin', {
+        'id': 'admin',
+        'username': 'admin',
+        'password': password_hasher.hash('admin123'),
+        'role': 'quan_tri_vien',
+        'name': 'Quản Trị Viên',
+        'email': 'admin@demo.vn',
+        'created_at': datetime.now().isoformat()
+    })
 
 # Predefined roles
 ROLES = {
@@ -80,6 +233,15 @@ ROLES = {
     }
 }
 
+# Tập quyền của từng vai trò, tính một lần cho principal trong cache token
+ROLE_PERMISSIONS = role_permissions(ROLES)
+
+# Socket.IO routing: roles that see every lead event, roles that pick up
+# unassigned new leads, and roles that handle incoming chat
+LEAD_SUPERVISOR_ROLES = [r for r, p in ROLE_PERMISSIONS.items() if 'all' in p]
+LEAD_INTAKE_ROLES = [r for r, p in ROLE_PERMISSIONS.items() if {'all', 'view_leads'} & p]
+CHAT_ROLES = [r for r, p in ROLE_PERMISSIONS.items() if {'all', 'reply_chat'} & p]
+
 # Chatbot intents for financial consultation
 CHATBOT_INTENTS = {
     'chao_hoi': {
@@ -123,7 +285,10 @@ CHATBOT_INTENTS = {
     }
 }
 
-DATABASE['chatbot_intents'] = CHATBOT_INTENTS
+# All intent patterns compiled once into a single-pass matcher
+intent_matcher = IntentMatcher(CHATBOT_INTENTS)
+# Character n-gram vectors of the same patterns for accent-insensitive scoring
+intent_scorer = IntentScorer(CHATBOT_INTENTS)
 
 # JWT Token helper
 def generate_token(user_id):
@@ -133,6 +298,25 @@ def generate_token(user_id):
     }
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
+token_cache = TokenCache(max_size=AUTH_CACHE_SIZE)
+
+def authenticate(token):
+    """
+    Principal của JWT: lấy từ cache, hoặc giải mã + tra user rồi ghi cache tới exp.
+    None nếu user không tồn tại; jwt.InvalidTokenError nếu token sai/hết hạn.
+    """
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
+    data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+    generation = token_cache.generation(data['user_id'])
+    user = db.get('users', data['user_id'])
+    if user is None:
+        return None
+    principal = Principal(user, ROLE_PERMISSIONS.get(user.get('role'), frozenset()))
+    token_cache.put(token, principal, data.get('exp'), generation)
+    return principal
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -140,8 +324,7 @@ def token_required(f):
         if not token:
             return jsonify({'error': 'Token không hợp lệ'}), 401
         try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            current_user = DATABASE['users'].get(data['user_id'])
+            current_user = authenticate(token)
             if not current_user:
                 return jsonify({'error': 'User không tồn tại'}), 401
         except jwt.ExpiredSignatureError:
@@ -151,22 +334,99 @@ def token_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
+def user_from_token(token):
+    """User ứng với JWT hợp lệ, None nếu token sai/hết hạn"""
+    try:
+        return authenticate(token or '')
+    except jwt.InvalidTokenError:
+        return None
+
+def lead_rooms(*leads):
+    """Room nhận event của lead: room của lead, người phụ trách, vai trò giám sát"""
+    rooms = {role_room(role) for role in LEAD_SUPERVISOR_ROLES}
+    for lead in leads:
+        rooms.add(lead_room(lead['id']))
+        if lead.get('assigned_to'):
+            rooms.add(user_room(lead['assigned_to']))
+    return sorted(rooms)
+
+def emit_lead_updated(payload, rooms):
+    socketio.emit('lead_updated', payload, to=rooms, namespace='/dashboard')
+
+lead_updates = LeadUpdateCoalescer(emit_lead_updated, window=LEAD_UPDATE_COALESCE_MS / 1000)
+
+def paginated_response(collection, filter_fields, list_fields=(), filters=None):
+    """
+    Trả về một trang (limit/after) đã lọc theo index, cursor trang sau nằm ở header X-Next-Cursor;
+    filters = điều kiện cố định (vd. lead_id lấy từ URL) cộng thêm điều kiện từ query string
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+    except ValueError:
+        return jsonify({'error': 'Tham số phân trang không hợp lệ'}), 400
+    
+    filters = dict(filters or {})
+    for field in filter_fields:
+        value = request.args.get(field)
+        if value:
+            filters[field] = value.split(',') if field in list_fields else value
+    
+    records, next_cursor = db.page(collection, limit, after=after, filters=filters)
+    response = jsonify(records)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+def valid_filters(filters, fields, list_fields=()):
+    """Điều kiện lọc từ JSON body: chỉ trường trong `fields`, giá trị là chuỗi (list chuỗi với list_fields)"""
+    if not isinstance(filters, dict):
+        return False
+    for field, value in filters.items():
+        if field not in fields:
+            return False
+        if field in list_fields and isinstance(value, list):
+            if not all(isinstance(v, str) for v in value):
+                return False
+        elif not isinstance(value, str):
+            return False
+    return True
+
 # ======================= AUTH ENDPOINTS =======================
 
+@app.errorhandler(HasherBusy)
+def password_hasher_busy(e):
+    """Pool băm mật khẩu quá tải: từ chối nhanh thay vì giữ thread request"""
+    response = jsonify({'error': str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 @app.route('/api/auth/login', methods=['POST'])
 def login():
     """Đăng nhập"""
-    data = request.json
+    started = time.perf_counter()
+    try:
+        return authenticate_login(request.json)
+    finally:
+        login_latency.observe(time.perf_counter() - started)
+
+def authenticate_login(data):
     username = data.get('username')
-    password = data.get('password')
+    password = data.get('password') or ''
     
-    user = DATABASE['users'].get(username)
+    user = db.get('users', username)
     if not user:
         return jsonify({'error': 'Tài khoản không tồn tại'}), 401
     
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    if user['password'] != hashed_password:
+    ok, upgraded = password_hasher.verify(password, user['password'])
+    if not ok:
         return jsonify({'error': 'Mật khẩu không đúng'}), 401
+    if upgraded is not None:
+        # Hash SHA-256 cũ: thay bằng bcrypt ngay khi biết mật khẩu đúng
+        user = dict(user, password=upgraded)
+        db.put('users', username, user)
+        token_cache.invalidate(username)
     
     token = generate_token(username)
     return jsonify({
@@ -190,18 +450,18 @@ def register(current_user):
     data = request.json
     username = data.get('username')
     
-    if username in DATABASE['users']:
+    if db.get('users', username) is not None:
         return jsonify({'error': 'Username đã tồn tại'}), 400
     
-    DATABASE['users'][username] = {
+    db.put('users', username, {
         'id': username,
         'username': username,
-        'password': hashlib.sha256(data.get('password', '123456').encode()).hexdigest(),
+        'password': password_hasher.hash(data.get('password', '123456')),
         'role': data.get('role', 'cskh'),
         'name': data.get('name', ''),
         'email': data.get('email', ''),
         'created_at': datetime.now().isoformat()
-    }
+    })
     
     return jsonify({'message': 'Tạo user thành công', 'user_id': username})
 
@@ -218,14 +478,38 @@ def get_current_user(current_user):
         'role_info': ROLES.get(current_user['role'], {})
     })
 
+@app.route('/api/auth/stats', methods=['GET'])
+@token_required
+def get_auth_stats(current_user):
+    """Thống kê cache token, pool băm mật khẩu và độ trễ đăng nhập (chỉ admin)"""
+    if current_user['role'] != 'quan_tri_vien':
+        return jsonify({'error': 'Không có quyền'}), 403
+    return jsonify({
+        'token_cache': token_cache.stats(),
+        'password_hasher': password_hasher.stats(),
+        'login': login_latency.stats()
+    })
+
 # ======================= LEAD MANAGEMENT =======================
 
 @app.route('/api/leads', methods=['GET'])
 @token_required
 def get_leads(current_user):
-    """Lấy danh sách leads"""
-    leads = list(DATABASE['leads'].values())
-    # Sort by created_at desc
+    """Lấy danh sách leads (phân trang theo created_at giảm dần)"""
+    return paginated_response('leads', LEAD_FILTER_FIELDS, list_fields=LEAD_LIST_FILTER_FIELDS)
+
+@app.route('/api/leads/search', methods=['GET'])
+@token_required
+def search_leads(current_user):
+    """Tìm lead theo tên (không dấu), số điện thoại hoặc ID"""
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), MAX_SEARCH_RESULTS)
+    except ValueError:
+        return jsonify({'error': 'Tham số limit không hợp lệ'}), 400
+    
+    leads = [db.get('leads', lead_id) for lead_id in lead_index.search(query, limit)]
+    leads = [lead for lead in leads if lead is not None]
     leads.sort(key=lambda x: x.get('created_at', ''), reverse=True)
     return jsonify(leads)
 
@@ -241,6 +525,7 @@ def create_lead(current_user):
         'name': data.get('name', ''),
         'phone': data.get('phone', ''),
         'email': data.get('email', ''),
+        'zalo_user_id': data.get('zalo_user_id', ''),
         'source': data.get('source', 'zalo_oa'),
         'product_interest': data.get('product_interest', ''),
         'status': 'tiep_nhan',  # tiep_nhan, dang_xu_ly, cho_bo_sung, hoan_thanh
@@ -252,11 +537,16 @@ def create_lead(current_user):
         'created_by': current_user['id']
     }
     
-    DATABASE['leads'][lead_id] = lead
-    DATABASE['analytics']['total_leads'] += 1
+    db.put('leads', lead_id, lead)
+    db.incr('total_leads')
+    lead_index.add(lead)
+    dashboard.lead_changed(None, lead)
     
-    # Emit realtime update
-    socketio.emit('new_lead', lead, namespace='/dashboard')
+    # Emit realtime update: lead chưa phân công đi tới các vai trò tiếp nhận
+    rooms = lead_rooms(lead)
+    if not lead['assigned_to']:
+        rooms += [role_room(role) for role in LEAD_INTAKE_ROLES]
+    socketio.emit('new_lead', lead, to=rooms, namespace='/dashboard')
     
     return jsonify(lead), 201
 
@@ -264,22 +554,25 @@ def create_lead(current_user):
 @token_required
 def update_lead(current_user, lead_id):
     """Cập nhật lead"""
-    if lead_id not in DATABASE['leads']:
+    lead = db.get('leads', lead_id)
+    if lead is None:
         return jsonify({'error': 'Lead không tồn tại'}), 404
     
     data = request.json
-    lead = DATABASE['leads'][lead_id]
+    previous = dict(lead)
     
     # Update fields
-    for key in ['name', 'phone', 'email', 'status', 'assigned_to', 'labels', 'notes', 'product_interest']:
+    for key in ['name', 'phone', 'email', 'zalo_user_id', 'status', 'assigned_to', 'labels', 'notes', 'product_interest']:
         if key in data:
             lead[key] = data[key]
     
     lead['updated_at'] = datetime.now().isoformat()
-    DATABASE['leads'][lead_id] = lead
+    db.put('leads', lead_id, lead)
+    lead_index.add(lead)
+    dashboard.lead_changed(previous, lead)
     
-    # Emit realtime update
-    socketio.emit('lead_updated', lead, namespace='/dashboard')
+    # Emit realtime update (gộp theo cửa sổ, chỉ gửi trường thay đổi)
+    lead_updates.lead_updated(previous, lead, lead_rooms(previous, lead))
     
     return jsonify(lead)
 
@@ -290,172 +583,674 @@ def delete_lead(current_user, lead_id):
     if current_user['role'] not in ['quan_tri_vien']:
         return jsonify({'error': 'Không có quyền'}), 403
     
-    if lead_id in DATABASE['leads']:
-        del DATABASE['leads'][lead_id]
+    lead = db.get('leads', lead_id)
+    if lead is not None and db.delete('leads', lead_id):
+        lead_index.remove(lead_id)
+        dashboard.lead_changed(lead, None)
+        lead_updates.discard(lead_id)
         return jsonify({'message': 'Đã xóa lead'})
     
     return jsonify({'error': 'Lead không tồn tại'}), 404
 
+def leads_imported(job, leads):
+    """Sau mỗi khối đã ghi: cập nhật dashboard, phát một event tổng hợp (không phát new_lead từng lead)"""
+    for lead in leads:
+        dashboard.lead_changed(None, lead)
+    rooms = {role_room(role) for role in LEAD_INTAKE_ROLES} | {user_room(job['created_by'])}
+    rooms |= {user_room(lead['assigned_to']) for lead in leads if lead['assigned_to']}
+    socketio.emit('leads_imported', {
+        'import_id': job['id'],
+        'status': job['status'],
+        'batch': job['batches'],
+        'count': len(leads),
+        'rows_processed': job['rows_processed'],
+        'inserted': job['inserted'],
+        'duplicates': job['duplicates'],
+        'invalid': job['invalid'],
+        'progress': job['progress'],
+        'error': job.get('error')
+    }, to=sorted(rooms), namespace='/dashboard')
+
+lead_importer = LeadImporter(
+    db,
+    lead_index,
+    IMPORT_DIR,
+    chunk_rows=IMPORT_CHUNK_ROWS,
+    max_bytes=IMPORT_MAX_BYTES,
+    queue_size=IMPORT_QUEUE_SIZE,
+    on_batch=leads_imported,
+    on_done=lambda job: leads_imported(job, [])
+).start()
+
+@app.route('/api/leads/import', methods=['POST'])
+@token_required
+def import_leads(current_user):
+    """
+    Nhập lead từ CSV/XLSX (file multipart 'file' hoặc body thô kèm ?filename=): trả 202
+    kèm job id; mỗi khối đã ghi phát event leads_imported, theo dõi qua /api/leads/import/<id>
+    """
+    if current_user['role'] not in LEAD_INTAKE_ROLES:
+        return jsonify({'error': 'Không có quyền'}), 403
+    
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    filename = upload.filename if upload else request.args.get('filename', '')
+    options = {field: request.args[field] for field in ('source', 'assigned_to') if request.args.get(field)}
+    try:
+        if request.args.get('chunk_rows'):
+            options['chunk_rows'] = min(max(int(request.args['chunk_rows']), 1), IMPORT_CHUNK_ROWS)
+    except ValueError:
+        return jsonify({'error': 'chunk_rows không hợp lệ'}), 400
+    
+    try:
+        job = lead_importer.submit(stream, filename, current_user['id'],
+                                   fmt=request.args.get('format'), options=options)
+    except LeadImportError as e:
+        return jsonify({'error': str(e)}), e.status
+    except QueueFull:
+        response = jsonify({'error': 'Đang có quá nhiều file chờ nhập, thử lại sau'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    return jsonify(job), 202
+
+@app.route('/api/leads/import/<import_id>', methods=['GET'])
+@token_required
+def get_lead_import(current_user, import_id):
+    """Tiến độ nhập lead: số dòng đã xử lý, đã thêm, trùng, lỗi (kèm số dòng)"""
+    job = db.get('lead_imports', import_id)
+    if job is None:
+        return jsonify({'error': 'Job nhập lead không tồn tại'}), 404
+    return jsonify(job)
+
+@app.route('/api/leads/import/stats', methods=['GET'])
+@token_required
+def get_lead_import_stats(current_user):
+    """Hàng đợi nhập lead và tổng số dòng đã xử lý"""
+    return jsonify(lead_importer.stats())
+
 # ======================= ZALO OA SIMULATOR =======================
 
+if ZALO_API_URL == 'stub':
+    # Demo: stub Zalo OA chạy trong tiến trình, refresh token giả
+    _stub_root = zalo_stub.start_in_thread()
+    ZALO_API_URL = _stub_root + zalo_stub.API_PREFIX
+    ZALO_OAUTH_URL = _stub_root + zalo_stub.OAUTH_PATH
+    ZALO_REFRESH_TOKEN = ZALO_REFRESH_TOKEN or 'demo_refresh_token'
+
+zalo_tokens = TokenManager(
+    ZALO_ACCESS_TOKEN,
+    refresh_token=ZALO_REFRESH_TOKEN or None,
+    app_id=ZALO_APP_ID,
+    app_secret=ZALO_APP_SECRET,
+    oauth_url=ZALO_OAUTH_URL,
+    timeout=ZALO_TIMEOUT
+)
+_zalo_options = dict(
+    api_url=ZALO_API_URL,
+    timeout=ZALO_TIMEOUT,
+    max_retries=ZALO_MAX_RETRIES,
+    backoff_base=ZALO_BACKOFF_BASE,
+    backoff_cap=ZALO_BACKOFF_CAP
+)
+# Thread request Flask dùng client đồng bộ, broadcast dùng client asyncio; chung token + metrics
+zalo_client = ZaloClient(zalo_tokens, pool_size=ZALO_POOL_SIZE, **_zalo_options)
+zalo_async_client = AsyncZaloClient(zalo_tokens, pool_size=BROADCAST_CONCURRENCY, **_zalo_options)
+
 @app.route('/api/zalo/webhook', methods=['POST'])
 def zalo_webhook():
-    """Webhook nhận sự kiện từ Zalo OA (giả lập)"""
-    data = request.json
+    """Webhook nhận sự kiện từ Zalo OA - xác nhận ngay, xử lý ở worker pool"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Payload không hợp lệ'}), 400
+    
     event_type = data.get('event_name', 'user_send_text')
     
     if event_type == 'user_send_text':
-        # Process incoming message
-        user_id = data.get('sender', {}).get('id', str(uuid.uuid4())[:8])
-        message = data.get('message', {}).get('text', '')
-        
-        # Save conversation
-        if user_id not in DATABASE['conversations']:
-            DATABASE['conversations'][user_id] = {
-                'user_id': user_id,
-                'messages': [],
-                'created_at': datetime.now().isoformat()
-            }
-        
-        DATABASE['conversations'][user_id]['messages'].append({
-            'sender': 'user',
-            'text': message,
-            'timestamp': datetime.now().isoformat()
-        })
+        event = parse_text_event(data)
+        result = {'status': 'queued', 'event_id': event['event_id']}
         
-        # Process with chatbot
-        response = process_chatbot_message(message)
+        key = dedup_key(data)
+        if key is not None:
+            original = webhook_dedup.remember(key, result)
+            if original is not None:
+                # Zalo gửi lại: trả response gốc, không xử lý lần nữa
+                return jsonify(original)
         
-        DATABASE['conversations'][user_id]['messages'].append({
-            'sender': 'bot',
-            'text': response['text'],
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        # Emit to dashboard
-        socketio.emit('new_message', {
-            'user_id': user_id,
-            'message': message,
-            'response': response
-        }, namespace='/dashboard')
+        try:
+            webhook_queue.submit(event)
+        except QueueFull:
+            if key is not None:
+                webhook_dedup.forget(key)
+            response = jsonify({'error': 'Hàng đợi webhook đang đầy, vui lòng gửi lại'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
         
-        return jsonify(response)
+        return jsonify(result)
     
     return jsonify({'status': 'ok'})
 
+@app.route('/api/zalo/webhook/stats', methods=['GET'])
+@token_required
+def get_webhook_stats(current_user):
+    """Độ sâu hàng đợi webhook, độ trễ xử lý và cache chống trùng"""
+    stats = webhook_queue.stats()
+    stats['dedup'] = webhook_dedup.stats()
+    return jsonify(stats)
+
+@app.route('/api/zalo/webhook/batch', methods=['POST'])
+@token_required
+def zalo_webhook_batch(current_user):
+    """
+    Nhận nhiều sự kiện một lần (JSON array hoặc NDJSON) cho replay/backfill (chỉ admin,
+    vì thời điểm tin nhắn lấy theo timestamp trong sự kiện): chatbot chạy theo lô,
+    mỗi hội thoại được ghi một lần, trả kết quả từng sự kiện
+    """
+    if current_user['role'] != 'quan_tri_vien':
+        return jsonify({'error': 'Không có quyền'}), 403
+    
+    try:
+        payloads = read_webhook_batch()
+    except OverflowError:
+        return jsonify({'error': f'Tối đa {WEBHOOK_BATCH_MAX} sự kiện mỗi lô'}), 413
+    except ValueError:
+        return jsonify({'error': 'Body phải là JSON array hoặc NDJSON'}), 400
+    
+    results = [None] * len(payloads)
+    events = []
+    duplicates = 0
+    for i, data in enumerate(payloads):
+        if not isinstance(data, dict):
+            results[i] = {'status': 'error', 'error': 'Sự kiện không hợp lệ'}
+        elif data.get('event_name', 'user_send_text') != 'user_send_text':
+            results[i] = {'status': 'ignored'}
+        else:
+            event = parse_text_event(data, use_event_time=True)
+            results[i] = {'status': 'processed', 'event_id': event['event_id'], 'user_id': event['user_id']}
+            key = dedup_key(data)
+            original = webhook_dedup.remember(key, results[i]) if key is not None else None
+            if original is not None:
+                # Trùng với sự kiện đã nhận (kể cả trong chính lô này): dùng kết quả gốc
+                results[i] = original
+                duplicates += 1
+            else:
+                events.append((i, event))
+    
+    responses = process_chatbot_messages([event['text'] for _, event in events]) if events else []
+    
+    # Gom theo sender.id, giữ thứ tự tin nhắn trong từng hội thoại
+    batches = {}
+    for (i, event), response in zip(events, responses):
+        created_at, messages = batches.setdefault(event['user_id'], (event['received_at'], []))
+        # Replay: phản hồi bot lấy thời điểm của sự kiện để lịch sử giữ đúng thứ tự
+        messages.extend(chat_exchange_messages(
+            event['text'], response, event['received_at'], replied_at=event['received_at']
+        ))
+        # Cập nhật tại chỗ: cache chống trùng giữ cùng dict này
+        results[i]['response'] = response
+    
+    if batches:
+        created = db.append_conversations(batches)
+        if created:
+            dashboard.conversation_started(created)
+        # Một event tổng cho cả lô thay vì một new_message cho mỗi tin nhắn
+        socketio.emit('webhook_batch', {
+            'events': len(events),
+            'conversations': len(batches)
+        }, to=[role_room(role) for role in LEAD_SUPERVISOR_ROLES], namespace='/dashboard')
+    
+    return jsonify({
+        'processed': len(events),
+        'duplicates': duplicates,
+        'conversations': len(batches),
+        'results': results
+    })
+
+def read_webhook_batch():
+    """Đọc danh sách sự kiện từ JSON array hoặc NDJSON (đọc từng dòng từ stream)"""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        payloads = []
+        for line in io.BufferedReader(request.stream, 1 << 16):
+            line = line.strip()
+            if not line:
+                continue
+            if len(payloads) >= WEBHOOK_BATCH_MAX:
+                raise OverflowError()
+            try:
+                payloads.append(json.loads(line))
+            except ValueError:
+                # Dòng lỗi chỉ làm hỏng sự kiện đó, không hỏng cả lô
+                payloads.append(None)
+        return payloads
+    
+    payloads = request.get_json(silent=True)
+    if not isinstance(payloads, list):
+        raise ValueError()
+    if len(payloads) > WEBHOOK_BATCH_MAX:
+        raise OverflowError()
+    return payloads
+
+def event_time(data):
+    """Thời điểm gửi theo Zalo (timestamp epoch ms), None nếu thiếu/không hợp lệ"""
+    try:
+        return datetime.fromtimestamp(int(data['timestamp']) / 1000).isoformat()
+    except (KeyError, TypeError, ValueError, OverflowError, OSError):
+        return None
+
+def dedup_key(data):
+    """Key chống trùng: msg_id của Zalo, hoặc hash sender + timestamp + text (None nếu thiếu timestamp)"""
+    message = data.get('message') or {}
+    if message.get('msg_id'):
+        return f"msg:{message['msg_id']}"
+    if data.get('timestamp') is None:
+        return None
+    raw = '\x1f'.join([
+        str((data.get('sender') or {}).get('id') or ''),
+        str(data['timestamp']),
+        str(message.get('text') or '')
+    ])
+    return 'sha1:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def parse_text_event(data, use_event_time=False):
+    """Chuẩn hóa sự kiện user_send_text của Zalo"""
+    message = data.get('message') or {}
+    received_at = (event_time(data) if use_event_time else None) or datetime.now().isoformat()
+    return {
+        'event_id': str(message.get('msg_id') or uuid.uuid4()),
+        'user_id': str((data.get('sender') or {}).get('id') or str(uuid.uuid4())[:8]),
+        'text': str(message.get('text') or ''),
+        'received_at': received_at
+    }
+
+def chat_exchange_messages(text, response, received_at, replied_at=None):
+    """Cặp tin nhắn người dùng + phản hồi bot để lưu vào hội thoại"""
+    bot_message = {
+        'sender': 'bot',
+        'text': response['text'],
+        'timestamp': replied_at or datetime.now().isoformat(),
+        'intent': response['intent'],
+        'confidence': response['confidence']
+    }
+    if response.get('action'):
+        bot_message['action'] = response['action']
+    return [{'sender': 'user', 'text': text, 'timestamp': received_at}, bot_message]
+
+def save_chat_exchange(user_id, text, response, received_at):
+    """Lưu tin nhắn người dùng và phản hồi của bot vào hội thoại"""
+    if db.append_messages(user_id, chat_exchange_messages(text, response, received_at), created_at=received_at):
+        dashboard.conversation_started()
+
+def handle_text_event(event):
+    """Worker: chạy chatbot, lưu hội thoại và emit lên dashboard"""
+    response = process_chatbot_message(event['text'])
+    save_chat_exchange(event['user_id'], event['text'], response, event['received_at'])
+    
+    # Emit to chat agents
+    socketio.emit('new_message', {
+        'user_id': event['user_id'],
+        'message': event['text'],
+        'response': response
+    }, to=[role_room(role) for role in CHAT_ROLES], namespace='/dashboard')
+    
+    return response
+
+webhook_queue = WebhookQueue(
+    handle_text_event,
+    max_size=WEBHOOK_QUEUE_SIZE,
+    workers=WEBHOOK_WORKERS,
+    overflow=WEBHOOK_OVERFLOW,
+    block_timeout=WEBHOOK_BLOCK_TIMEOUT,
+    # Cùng một khách luôn vào cùng một worker: tin nhắn và phản hồi bot giữ đúng thứ tự
+    shard_key=lambda event: event['user_id']
+)
+webhook_queue.start()
+
+webhook_dedup = DedupCache(max_size=WEBHOOK_DEDUP_SIZE, ttl=WEBHOOK_DEDUP_TTL)
+
 @app.route('/api/zalo/send-message', methods=['POST'])
 @token_required
 def send_zalo_message(current_user):
-    """Gửi tin nhắn qua Zalo OA (giả lập)"""
+    """Gửi tin nhắn qua Zalo OA API, thành công thì ghi vào hội thoại"""
     data = request.json
     recipient_id = data.get('recipient_id')
     message = data.get('message')
     
-    if recipient_id not in DATABASE['conversations']:
-        DATABASE['conversations'][recipient_id] = {
-            'user_id': recipient_id,
-            'messages': [],
-            'created_at': datetime.now().isoformat()
-        }
+    try:
+        result = zalo_client.send_text(recipient_id, message)
+    except ZaloAPIError as e:
+        return jsonify({'error': f'Gửi tin thất bại: {e}', 'code': e.code}), 502
     
-    DATABASE['conversations'][recipient_id]['messages'].append({
+    now = datetime.now().isoformat()
+    if db.append_messages(recipient_id, [{
         'sender': 'agent',
         'text': message,
-        'timestamp': datetime.now().isoformat(),
-        'sent_by': current_user['id']
-    })
+        'timestamp': now,
+        'sent_by': current_user['id'],
+        'message_id': result.get('message_id')
+    }], created_at=now):
+        dashboard.conversation_started()
     
-    DATABASE['analytics']['messages_sent'] += 1
+    db.incr('messages_sent')
     
     return jsonify({
         'status': 'sent',
-        'message_id': str(uuid.uuid4())[:8],
-        'timestamp': datetime.now().isoformat()
+        'message_id': result.get('message_id'),
+        'timestamp': now
     })
 
+@app.route('/api/zalo/client/stats', methods=['GET'])
+@token_required
+def get_zalo_client_stats(current_user):
+    """Độ trễ từng endpoint Zalo OA (histogram), số lần thử lại/lỗi, trạng thái token"""
+    stats = zalo_tokens.metrics.stats()
+    stats['api_url'] = ZALO_API_URL
+    stats['token'] = zalo_tokens.stats()
+    return jsonify(stats)
+
 @app.route('/api/zalo/broadcast', methods=['POST'])
 @token_required
 def send_broadcast(current_user):
-    """Gửi tin nhắn broadcast (giả lập)"""
-    if 'send_broadcast' not in ROLES.get(current_user['role'], {}).get('permissions', []) and current_user['role'] != 'quan_tri_vien':
+    """Tạo broadcast; đến giờ gửi thì engine gửi nền, tiến độ qua event broadcast_progress"""
+    if not current_user.can('send_broadcast'):
         return jsonify({'error': 'Không có quyền'}), 403
     
     data = request.json
+    target_audience = data.get('target_audience', 'all')
+    try:
+        validate_audience(target_audience)
+        scheduled_time = parse_scheduled_time(data.get('scheduled_time') or datetime.now().isoformat())
+    except (TypeError, ValueError):
+        return jsonify({'error': 'target_audience hoặc scheduled_time không hợp lệ'}), 400
+    
     broadcast = {
         'id': str(uuid.uuid4())[:8],
         'title': data.get('title', ''),
         'content': data.get('content', ''),
-        'target_audience': data.get('target_audience', 'all'),
-        'scheduled_time': data.get('scheduled_time', datetime.now().isoformat()),
+        'target_audience': target_audience,
+        'scheduled_time': scheduled_time.isoformat(),
         'status': 'scheduled',
         'sent_count': 0,
         'created_by': current_user['id'],
         'created_at': datetime.now().isoformat()
     }
     
-    DATABASE['broadcast_messages'].append(broadcast)
+    db.put('broadcast_messages', broadcast['id'], broadcast)
+    broadcast_scheduler.schedule(broadcast)
     
     return jsonify(broadcast), 201
 
+@app.route('/api/zalo/broadcasts', methods=['GET'])
+@token_required
+def get_broadcasts(current_user):
+    """Danh sách broadcast theo scheduled_time giảm dần (limit/after), lọc theo status/created_by"""
+    return paginated_response('broadcast_messages', ('status', 'created_by'))
+
+@app.route('/api/zalo/broadcast/<broadcast_id>/cancel', methods=['POST'])
+@token_required
+def cancel_broadcast(current_user, broadcast_id):
+    """Hủy broadcast chưa tới giờ gửi"""
+    if not current_user.can('send_broadcast'):
+        return jsonify({'error': 'Không có quyền'}), 403
+    
+    broadcast = db.get('broadcast_messages', broadcast_id)
+    if broadcast is None:
+        return jsonify({'error': 'Broadcast không tồn tại'}), 404
+    if broadcast['status'] != 'scheduled':
+        return jsonify({'error': f"Không thể hủy broadcast đang ở trạng thái {broadcast['status']}"}), 409
+    
+    broadcast = dict(broadcast, status='cancelled', cancelled_at=datetime.now().isoformat())
+    db.put('broadcast_messages', broadcast_id, broadcast)
+    return jsonify(broadcast)
+
+@app.route('/api/zalo/broadcast/<broadcast_id>/reschedule', methods=['POST'])
+@token_required
+def reschedule_broadcast(current_user, broadcast_id):
+    """Đổi giờ gửi của broadcast chưa gửi (kể cả đã hủy)"""
+    if not current_user.can('send_broadcast'):
+        return jsonify({'error': 'Không có quyền'}), 403
+    
+    broadcast = db.get('broadcast_messages', broadcast_id)
+    if broadcast is None:
+        return jsonify({'error': 'Broadcast không tồn tại'}), 404
+    if broadcast['status'] not in ('scheduled', 'cancelled'):
+        return jsonify({'error': f"Không thể đổi lịch broadcast đang ở trạng thái {broadcast['status']}"}), 409
+    try:
+        scheduled_time = parse_scheduled_time((request.json or {}).get('scheduled_time'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'scheduled_time không hợp lệ'}), 400
+    
+    broadcast = dict(broadcast, status='scheduled', scheduled_time=scheduled_time.isoformat())
+    broadcast.pop('cancelled_at', None)
+    db.put('broadcast_messages', broadcast_id, broadcast)
+    broadcast_scheduler.schedule(broadcast)
+    return jsonify(broadcast)
+
+@app.route('/api/zalo/broadcast/stats', methods=['GET'])
+@token_required
+def get_broadcast_stats(current_user):
+    """Cấu hình và bộ đếm của engine gửi broadcast, hàng đợi hẹn giờ"""
+    stats = broadcast_engine.stats()
+    stats['scheduler'] = broadcast_scheduler.stats()
+    return jsonify(stats)
+
+@app.route('/api/zalo/broadcast/<broadcast_id>', methods=['GET'])
+@token_required
+def get_broadcast(current_user, broadcast_id):
+    """Trạng thái broadcast: status, sent_count, failed_count cập nhật theo từng lô"""
+    broadcast = db.get('broadcast_messages', broadcast_id)
+    if broadcast is None:
+        return jsonify({'error': 'Broadcast không tồn tại'}), 404
+    return jsonify(broadcast)
+
+def emit_broadcast_progress(broadcast):
+    rooms = [role_room(role) for role in LEAD_SUPERVISOR_ROLES] + [user_room(broadcast['created_by'])]
+    socketio.emit('broadcast_progress', {
+        field: broadcast.get(field)
+        for field in ('id', 'status', 'recipient_count', 'sent_count', 'failed_count')
+    }, to=rooms, namespace='/dashboard')
+
+broadcast_engine = BroadcastEngine(
+    db,
+    zalo_async_client,
+    concurrency=BROADCAST_CONCURRENCY,
+    batch_size=BROADCAST_BATCH_SIZE,
+    rate_limit=BROADCAST_RATE_LIMIT,
+    on_progress=emit_broadcast_progress
+).start()
+# Nạp lại các broadcast hẹn giờ từ storage (sau restart) rồi chờ tới hạn
+broadcast_scheduler = BroadcastScheduler(db, broadcast_engine).start()
+
 @app.route('/api/zalo/conversations', methods=['GET'])
 @token_required
 def get_conversations(current_user):
-    """Lấy danh sách hội thoại"""
-    return jsonify(list(DATABASE['conversations'].values()))
+    """Inbox: tóm tắt hội thoại theo hoạt động gần nhất (limit/after), không kèm tin nhắn"""
+    return paginated_response('conversations', ())
 
 @app.route('/api/zalo/conversations/<user_id>', methods=['GET'])
 @token_required
 def get_conversation(current_user, user_id):
-    """Lấy chi tiết hội thoại"""
-    if user_id not in DATABASE['conversations']:
+    """Lấy chi tiết hội thoại: trang tin nhắn mới nhất (before/limit), seq cũ hơn ở header X-Next-Cursor"""
+    conversation = db.get('conversations', user_id)
+    if conversation is None:
+        return jsonify({'error': 'Conversation không tồn tại'}), 404
+    
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        before = int(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'error': 'Tham số phân trang không hợp lệ'}), 400
+    
+    messages, next_before = db.messages(user_id, before=before, limit=limit)
+    response = jsonify(dict(conversation, messages=messages, next_before=next_before))
+    if next_before is not None:
+        response.headers['X-Next-Cursor'] = str(next_before)
+    return response
+
+@app.route('/api/zalo/conversations/archive', methods=['POST'])
+@token_required
+def archive_conversations(current_user):
+    """Chuyển ngay hội thoại không hoạt động quá idle_seconds xuống archive (chỉ admin)"""
+    if current_user['role'] != 'quan_tri_vien':
+        return jsonify({'error': 'Không có quyền'}), 403
+    
+    try:
+        idle_seconds = float((request.get_json(silent=True) or {}).get('idle_seconds', CONVERSATION_IDLE_SECONDS))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'idle_seconds không hợp lệ'}), 400
+    
+    archived = archive_idle_conversations(idle_seconds)
+    archive = getattr(db, 'archive', None)
+    return jsonify({
+        'archived': archived,
+        'archive': archive.stats() if archive is not None else None
+    })
+
+def archive_idle_conversations(idle_seconds):
+    cutoff = (datetime.now() - timedelta(seconds=idle_seconds)).isoformat()
+    return db.archive_idle(cutoff)
+
+def archive_sweeper():
+    """Định kỳ chuyển hội thoại nguội xuống archive"""
+    while True:
+        time.sleep(ARCHIVE_SWEEP_SECONDS)
+        try:
+            archive_idle_conversations(CONVERSATION_IDLE_SECONDS)
+        except Exception as e:
+            print(f'Archive sweep error: {e}')
+
+if getattr(db, 'archive', None) is not None:
+    threading.Thread(target=archive_sweeper, name='archive-sweeper', daemon=True).start()
+
+@app.route('/api/zalo/conversations/<user_id>/read', methods=['POST'])
+@token_required
+def mark_conversation_read(current_user, user_id):
+    """Đánh dấu đã đọc hội thoại"""
+    conversation = db.mark_conversation_read(user_id)
+    if conversation is None:
         return jsonify({'error': 'Conversation không tồn tại'}), 404
     
-    return jsonify(DATABASE['conversations'][user_id])
+    return jsonify(conversation)
+
+def chatbot_reply(intent_key, confidence):
+    """Tạo phản hồi chatbot cho intent đã xác định (None = chưa hiểu)"""
+    if intent_key is None:
+        return {
+            'text': 'Cảm ơn bạn đã liên hệ. Tôi chưa hiểu rõ yêu cầu của bạn. Bạn có thể:\n1. Đăng ký tư vấn\n2. Xem sản phẩm\n3. Hỏi về hồ sơ\n4. Gặp nhân viên',
+            'intent': 'unknown',
+            'confidence': confidence
+        }
+    
+    intent_data = CHATBOT_INTENTS[intent_key]
+    result = {
+        'text': random.choice(intent_data['responses']),
+        'intent': intent_key,
+        'confidence': confidence
+    }
+    
+    if intent_data.get('action') == 'transfer_to_agent':
+        result['action'] = 'transfer_to_agent'
+    
+    return result
+
+def process_chatbot_messages(messages):
+    """Xử lý một lô tin nhắn với chatbot AI (chấm điểm vector hóa cả lô)"""
+    if CHATBOT_MATCH_MODE == 'exact':
+        # First declared intent with a matching pattern wins
+        exact = [intent_matcher.best(message.lower()) for message in messages]
+        return [chatbot_reply(key, 0.85 if key else 0.3) for key in exact]
+    
+    scores = intent_scorer.score(messages)
+    fuzzy = intent_scorer.classify(messages, CHATBOT_FUZZY_THRESHOLD, scores)
+    results = []
+    for i, message in enumerate(messages):
+        row = scores[i]
+        matched = intent_matcher.match_all(message.lower())
+        # Exact matches keep declaration priority, but a pattern found only
+        # inside another word ('hi' in 'nhieu') scores low and is skipped
+        intent_key = next(
+            (key for key in matched if row[intent_scorer.index(key)] >= CHATBOT_FUZZY_THRESHOLD),
+            fuzzy[i][0]
+        )
+        
+        if intent_key is not None:
+            confidence = float(row[intent_scorer.index(intent_key)])
+        else:
+            # Unknown: confidence that the message matches no intent
+            confidence = 1.0 - float(row.max())
+        results.append(chatbot_reply(intent_key, round(confidence, 3)))
+    return results
 
 def process_chatbot_message(message):
     """Xử lý tin nhắn với chatbot AI"""
-    message_lower = message.lower()
-    
-    # Find matching intent
-    for intent_key, intent_data in CHATBOT_INTENTS.items():
-        for pattern in intent_data['patterns']:
-            if pattern in message_lower:
-                import random
-                response_text = random.choice(intent_data['responses'])
-                
-                result = {
-                    'text': response_text,
-                    'intent': intent_key,
-                    'confidence': 0.85
-                }
-                
-                if intent_data.get('action') == 'transfer_to_agent':
-                    result['action'] = 'transfer_to_agent'
-                
-                return result
-    
-    # Default response
-    return {
-        'text': 'Cảm ơn bạn đã liên hệ. Tôi chưa hiểu rõ yêu cầu của bạn. Bạn có thể:\n1. Đăng ký tư vấn\n2. Xem sản phẩm\n3. Hỏi về hồ sơ\n4. Gặp nhân viên',
-        'intent': 'unknown',
-        'confidence': 0.3
-    }
+    return process_chatbot_messages([message])[0]
+
+@app.route('/api/chatbot/classify', methods=['POST'])
+@token_required
+def classify_messages(current_user):
+    """Phân loại intent cho nhiều tin nhắn một lần"""
+    messages = (request.json or {}).get('messages', [])
+    if not isinstance(messages, list) or not all(isinstance(m, str) for m in messages):
+        return jsonify({'error': 'messages phải là danh sách chuỗi'}), 400
+    
+    results = process_chatbot_messages(messages) if messages else []
+    return jsonify([
+        {'intent': r['intent'], 'confidence': r['confidence']} for r in results
+    ])
 
 # ======================= DOCUMENT MANAGEMENT =======================
 
 @app.route('/api/documents', methods=['GET'])
 @token_required
 def get_documents(current_user):
-    """Lấy danh sách hồ sơ"""
-    docs = list(DATABASE['documents'].values())
-    docs.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-    return jsonify(docs)
+    """Lấy danh sách hồ sơ (phân trang theo created_at giảm dần), lọc theo lead_id, status, type"""
+    return paginated_response('documents', DOCUMENT_FILTER_FIELDS)
 
-@app.route('/api/documents', methods=['POST'])
+@app.route('/api/leads/<lead_id>/documents', methods=['GET'])
 @token_required
-def upload_document(current_user):
-    """Upload hồ sơ (giả lập)"""
-    data = request.json
+def get_lead_documents(current_user, lead_id):
+    """Hồ sơ của một lead (đọc từ index lead_id, không quét toàn bộ hồ sơ), lọc thêm theo status, type"""
+    if db.get('leads', lead_id) is None:
+        return jsonify({'error': 'Lead không tồn tại'}), 404
+    return paginated_response('documents', ('status', 'type'), filters={'lead_id': lead_id})
+
+def emit_ocr_completed(job, document):
+    rooms = [role_room(role) for role in LEAD_SUPERVISOR_ROLES] + [user_room(job['created_by'])]
+    lead = db.get('leads', document['lead_id']) if document and document.get('lead_id') else None
+    if lead is not None:
+        rooms = sorted(set(rooms) | set(lead_rooms(lead)))
+    socketio.emit('ocr_completed', {
+        'job_id': job['id'],
+        'document_id': job['document_id'],
+        'status': job['status'],
+        'document_status': document.get('status') if document else None,
+        'error': job.get('error')
+    }, to=rooms, namespace='/dashboard')
+
+ocr_service = OCRService(
+    db,
+    engine=OCR_ENGINE,
+    workers=OCR_WORKERS,
+    queue_size=OCR_QUEUE_SIZE,
+    timeout=OCR_TIMEOUT,
+    options={'lang': OCR_LANG} if OCR_ENGINE == 'tesseract' else {'work_ms': OCR_DEMO_WORK_MS},
+    preprocess_options={'max_side': OCR_MAX_SIDE} if OCR_PREPROCESS else None,
+    on_document_change=dashboard.document_changed,
+    on_done=emit_ocr_completed,
+    pool=ocr_pool
+).start()
+
+def submit_ocr(document, current_user):
+    """Tạo job OCR, trả về (job, None) hoặc (None, response 503) khi hàng đợi đầy"""
+    try:
+        return ocr_service.submit(document, current_user['id']), None
+    except QueueFull:
+        response = jsonify({'error': 'Hàng đợi OCR đầy, thử lại sau'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return None, response
+
+def create_document(data, current_user, **file_fields):
+    """Tạo hồ sơ; CCCD được đưa vào hàng đợi OCR ngay (kết quả qua event ocr_completed)"""
     doc_id = str(uuid.uuid4())[:8]
     
     document = {
@@ -470,102 +1265,230 @@ def upload_document(current_user):
         'created_at': datetime.now().isoformat(),
         'created_by': current_user['id']
     }
+    document.update(file_fields)
     
-    DATABASE['documents'][doc_id] = document
-    DATABASE['analytics']['documents_processed'] += 1
+    db.put('documents', doc_id, document)
+    db.incr('documents_processed')
+    dashboard.document_changed(None, document)
     
-    # Simulate OCR processing
     if document['type'] == 'cccd':
-        document['ocr_data'] = {
-            'ho_ten': 'NGUYỄN VĂN A',
-            'so_cccd': '001234567890',
-            'ngay_sinh': '01/01/1990',
-            'gioi_tinh': 'Nam',
-            'dia_chi': '123 Đường ABC, Quận XYZ, TP.HCM'
-        }
-        document['status'] = 'verified'
-    
-    return jsonify(document), 201
+        job, _ = submit_ocr(document, current_user)
+        if job is not None:
+            # Hàng đợi đầy thì hồ sơ giữ trạng thái pending, gửi OCR lại sau
+            document = db.get('documents', doc_id)
+    return document
+
+@app.route('/api/documents', methods=['POST'])
+@token_required
+def upload_document(current_user):
+    """Tạo hồ sơ chỉ với metadata (file gửi qua /api/documents/uploads)"""
+    return jsonify(create_document(request.json, current_user)), 201
+
+upload_store = UploadStore(db, UPLOAD_DIR, max_bytes=UPLOAD_MAX_BYTES, chunk_max=UPLOAD_CHUNK_SIZE)
+
+def upload_response(upload, status=200):
+    body = dict(upload, offset=upload_store.offset(upload), chunk_size=UPLOAD_CHUNK_SIZE)
+    body.pop('file_path', None)
+    if upload.get('document_id'):
+        body['document'] = db.get('documents', upload['document_id'])
+    response = jsonify(body)
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(body['offset'])
+    return response
+
+def upload_error_response(e):
+    response = jsonify({'error': str(e), 'offset': e.offset})
+    response.status_code = e.status
+    if e.offset is not None:
+        response.headers['Upload-Offset'] = str(e.offset)
+    return response
+
+@app.route('/api/documents/uploads', methods=['POST'])
+@token_required
+def create_upload(current_user):
+    """
+    Mở phiên upload file hồ sơ: {filename, file_size, lead_id, type, notes}. Sau đó gửi
+    từng phần bằng PATCH kèm header Upload-Offset; hồ sơ được tạo khi nhận đủ file
+    """
+    data = request.json or {}
+    metadata = {field: data.get(field) for field in ('lead_id', 'type', 'filename', 'notes') if field in data}
+    try:
+        upload = upload_store.create(data.get('file_size'), metadata, current_user['id'])
+    except UploadError as e:
+        return upload_error_response(e)
+    return upload_response(upload, 201)
+
+def upload_owner(upload, current_user):
+    """Chỉ người mở phiên upload (hoặc quản trị viên) được xem và gửi tiếp"""
+    return upload['created_by'] == current_user['id'] or current_user['role'] == 'quan_tri_vien'
+
+@app.route('/api/documents/uploads/<upload_id>', methods=['GET'])
+@token_required
+def get_upload(current_user, upload_id):
+    """Trạng thái upload; Upload-Offset = số byte đã nhận (gửi tiếp từ đây sau khi mất kết nối)"""
+    upload = db.get('uploads', upload_id)
+    if upload is None:
+        return jsonify({'error': 'Phiên upload không tồn tại'}), 404
+    if not upload_owner(upload, current_user):
+        return jsonify({'error': 'Không có quyền'}), 403
+    return upload_response(upload)
+
+@app.route('/api/documents/uploads/<upload_id>', methods=['PATCH'])
+@token_required
+def upload_chunk(current_user, upload_id):
+    """
+    Nhận một phần file tại Upload-Offset, body là byte thô (đọc dạng stream, không
+    nạp cả phần vào bộ nhớ). Trả 200 kèm offset mới, 201 kèm hồ sơ khi nhận đủ file,
+    409 kèm offset đúng nếu lệch
+    """
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Thiếu header Upload-Offset'}), 400
+    upload = db.get('uploads', upload_id)
+    if upload is not None and not upload_owner(upload, current_user):
+        return jsonify({'error': 'Không có quyền'}), 403
+    try:
+        upload, _ = upload_store.write(upload_id, offset, request.stream, request.content_length)
+    except UploadError as e:
+        upload = db.get('uploads', upload_id)
+        if upload is not None and upload.get('document_id'):
+            # Gửi lại phần cuối (mất response lần trước): trả về hồ sơ đã tạo
+            return upload_response(upload)
+        return upload_error_response(e)
+    if upload['status'] != 'complete':
+        return upload_response(upload)
+    
+    data = dict(upload['metadata'], file_size=upload['size'])
+    # Hồ sơ thuộc về người mở phiên upload (quản trị viên có thể gửi phần cuối thay)
+    uploader = db.get('users', upload['created_by']) or {'id': upload['created_by']}
+    document = create_document(data, uploader, sha256=upload['sha256'], file_path=upload['file_path'])
+    return upload_response(upload_store.attach(upload, document['id']), 201)
+
+@app.route('/api/documents/<doc_id>/file', methods=['GET'])
+@token_required
+def download_document(current_user, doc_id):
+    """Tải file hồ sơ; hỗ trợ Range (206) và If-None-Match, file gửi qua wsgi.file_wrapper (sendfile)"""
+    doc = db.get('documents', doc_id)
+    if doc is None or not doc.get('file_path') or not os.path.exists(doc['file_path']):
+        return jsonify({'error': 'Hồ sơ chưa có file'}), 404
+    return send_file(
+        doc['file_path'],
+        download_name=doc.get('filename') or doc_id,
+        etag=doc.get('sha256') or True,
+        conditional=True
+    )
+
+@app.route('/api/documents/<doc_id>/duplicates', methods=['GET'])
+@token_required
+def get_document_duplicates(current_user, doc_id):
+    """Các hồ sơ khác có cùng nội dung file (tra theo index sha256)"""
+    doc = db.get('documents', doc_id)
+    if doc is None:
+        return jsonify({'error': 'Document không tồn tại'}), 404
+    if not doc.get('sha256'):
+        return jsonify([])
+    return jsonify([d for d in db.find('documents', 'sha256', doc['sha256']) if d['id'] != doc_id])
+
+@app.route('/api/documents/uploads/stats', methods=['GET'])
+@token_required
+def get_upload_stats(current_user):
+    """Số phiên đang upload, byte đã nhận và byte tiết kiệm nhờ trùng nội dung"""
+    return jsonify(upload_store.stats())
+
+def upload_sweeper():
+    """Định kỳ xóa phiên upload dở dang quá hạn"""
+    while True:
+        time.sleep(min(UPLOAD_EXPIRE_SECONDS, 3600))
+        try:
+            upload_store.expire(UPLOAD_EXPIRE_SECONDS)
+        except Exception as e:
+            print(f'Upload sweep error: {e}')
+
+threading.Thread(target=upload_sweeper, name='upload-sweeper', daemon=True).start()
 
 @app.route('/api/documents/<doc_id>/ocr', methods=['POST'])
 @token_required
 def process_ocr(current_user, doc_id):
-    """Xử lý OCR cho hồ sơ (giả lập)"""
-    if doc_id not in DATABASE['documents']:
+    """Tạo job OCR cho hồ sơ, trả về job id ngay; theo dõi qua /api/ocr/jobs/<job_id>"""
+    doc = db.get('documents', doc_id)
+    if doc is None:
         return jsonify({'error': 'Document không tồn tại'}), 404
     
-    doc = DATABASE['documents'][doc_id]
-    doc['status'] = 'processing'
-    
-    # Simulate OCR result
-    if doc['type'] == 'cccd':
-        doc['ocr_data'] = {
-            'ho_ten': 'NGUYỄN VĂN DEMO',
-            'so_cccd': '001' + str(uuid.uuid4().int)[:9],
-            'ngay_sinh': '15/06/1985',
-            'gioi_tinh': 'Nam',
-            'dia_chi': '456 Đường Demo, Quận Test, TP.HCM',
-            'ngay_cap': '01/01/2020',
-            'noi_cap': 'Cục QLHC về TTXH'
-        }
-    elif doc['type'] == 'dkkd':
-        doc['ocr_data'] = {
-            'ten_doanh_nghiep': 'CÔNG TY TNHH DEMO',
-            'mst': '0312' + str(uuid.uuid4().int)[:6],
-            'dia_chi': '789 Đường Test, Quận ABC, TP.HCM',
-            'nguoi_dai_dien': 'NGUYỄN VĂN DEMO',
-            'ngay_cap': '01/01/2022'
-        }
-    
-    doc['status'] = 'verified'
-    DATABASE['documents'][doc_id] = doc
-    
-    return jsonify(doc)
+    job, error = submit_ocr(doc, current_user)
+    if error is not None:
+        return error
+    return jsonify(job), 202
+
+@app.route('/api/ocr/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_ocr_job(current_user, job_id):
+    """Trạng thái job OCR: queued, running, done, failed"""
+    job = db.get('ocr_jobs', job_id)
+    if job is None:
+        return jsonify({'error': 'Job OCR không tồn tại'}), 404
+    return jsonify(job)
+
+@app.route('/api/ocr/jobs/<job_id>/result', methods=['GET'])
+@token_required
+def get_ocr_result(current_user, job_id):
+    """Kết quả OCR; 202 nếu job chưa xong, 422 nếu thất bại"""
+    job = db.get('ocr_jobs', job_id)
+    if job is None:
+        return jsonify({'error': 'Job OCR không tồn tại'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'status': job['status'], 'error': job.get('error')}), 422
+    if job['status'] != 'done':
+        return jsonify({'status': job['status']}), 202
+    return jsonify({'status': job['status'], 'document_id': job['document_id'], 'ocr_data': job['result']})
+
+@app.route('/api/ocr/stats', methods=['GET'])
+@token_required
+def get_ocr_stats(current_user):
+    """Hàng đợi, số tiến trình và thời gian OCR mỗi hồ sơ"""
+    return jsonify(ocr_service.stats())
 
 # ======================= NOTIFICATIONS =======================
 
+if SMTP_HOST == 'stub':
+    # Demo: SMTP giả lập chạy trong tiến trình
+    smtp_stub_server, SMTP_HOST, SMTP_PORT = smtp_stub.start_in_thread()
+
+email_sender = EmailSender(
+    SMTP_HOST, SMTP_PORT, SMTP_SENDER,
+    username=SMTP_USER or None,
+    password=SMTP_PASSWORD,
+    starttls=SMTP_STARTTLS,
+    timeout=ZALO_TIMEOUT
+)
+
+# Mẫu biên dịch một lần khi khởi động
+notification_templates = compile_templates()
+TEMPLATE_DEFAULTS = {
+    'ten_doanh_nghiep': BUSINESS_NAME,
+    'so_dien_thoai': BUSINESS_HOTLINE
+}
+
+def send_zalo_notification(recipient_id, subject, text):
+    return zalo_client.send_text(recipient_id, text)
+
+notification_dispatcher = NotificationDispatcher(
+    db,
+    {'zalo_oa': send_zalo_notification, 'email': email_sender.send},
+    workers=NOTIFICATION_WORKERS,
+    queue_size=NOTIFICATION_QUEUE_SIZE
+).start()
+
 @app.route('/api/notifications/templates', methods=['GET'])
 @token_required
 def get_notification_templates(current_user):
-    """Lấy mẫu thông báo tự động"""
-    templates = {
-        'chao_mung': {
-            'name': 'Chào mừng khách hàng',
-            'content': 'Chào {ten_khach_hang}, cảm ơn bạn đã quan tâm đến {ten_doanh_nghiep}! Chúng tôi luôn sẵn sàng hỗ trợ bạn.',
-            'channels': ['zalo_oa', 'email']
-        },
-        'xac_nhan_yeu_cau': {
-            'name': 'Xác nhận nhận yêu cầu',
-            'content': 'Cảm ơn bạn đã liên hệ với {ten_doanh_nghiep}. Chúng tôi đã nhận được yêu cầu và sẽ phản hồi sớm nhất.',
-            'channels': ['zalo_oa', 'email']
-        },
-        'nhac_bo_sung': {
-            'name': 'Nhắc bổ sung hồ sơ',
-            'content': 'Bạn vui lòng bổ sung {tai_lieu} để hoàn tất hồ sơ. Nếu cần hỗ trợ, liên hệ {so_dien_thoai}.',
-            'channels': ['zalo_oa', 'email']
-        },
-        'phe_duyet': {
-            'name': 'Thông báo phê duyệt',
-            'content': 'Hồ sơ của bạn đã được phê duyệt. Vui lòng kiểm tra email để nhận hợp đồng/phiếu xác nhận.',
-            'channels': ['zalo_oa', 'email']
-        },
-        'nhac_lich_hen': {
-            'name': 'Nhắc lịch hẹn',
-            'content': 'Bạn có lịch hẹn với {ten_doanh_nghiep} vào {ngay_gio}. Vui lòng đến đúng giờ để được phục vụ tốt nhất.',
-            'channels': ['zalo_oa', 'email']
-        },
-        'nhac_thanh_toan': {
-            'name': 'Nhắc thanh toán',
-            'content': 'Hóa đơn {ma_hoa_don} của bạn sẽ đến hạn vào {ngay}. Vui lòng thanh toán để tránh gián đoạn dịch vụ.',
-            'channels': ['zalo_oa', 'email']
-        }
-    }
-    return jsonify(templates)
+    """Lấy mẫu thông báo tự động (kèm danh sách biến của từng mẫu)"""
+    return jsonify({template_id: template.to_dict() for template_id, template in notification_templates.items()})
 
 @app.route('/api/notifications/send', methods=['POST'])
 @token_required
 def send_notification(current_user):
-    """Gửi thông báo"""
+    """Gửi thông báo; không có content thì render từ mẫu với variables (+ dữ liệu lead nếu có lead_id)"""
     data = request.json
     notification = {
         'id': str(uuid.uuid4())[:8],
@@ -578,44 +1501,133 @@ def send_notification(current_user):
         'sent_by': current_user['id']
     }
     
-    DATABASE['notifications'][notification['id']] = notification
+    template = notification_templates.get(notification['template'])
+    if not notification['content']:
+        if template is None:
+            return jsonify({'error': 'Cần content hoặc template hợp lệ'}), 400
+        variables = dict(TEMPLATE_DEFAULTS, **(data.get('variables') or {}))
+        lead = db.get('leads', data['lead_id']) if data.get('lead_id') else None
+        if lead is not None:
+            variables.update(lead_variables(lead))
+        try:
+            notification['content'] = template.render(variables)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    try:
+        if notification['channel'] == 'zalo_oa':
+            result = zalo_client.send_text(notification['recipient_id'], notification['content'])
+            notification['message_id'] = result.get('message_id')
+        elif notification['channel'] == 'email':
+            subject = template.name if template is not None else BUSINESS_NAME
+            email_sender.send(notification['recipient_id'], subject, notification['content'])
+    except (ZaloAPIError, EmailError) as e:
+        notification['status'] = 'failed'
+        notification['error'] = str(e)
+    
+    db.put('notifications', notification['id'], notification)
     
     return jsonify(notification), 201
 
+@app.route('/api/notifications/send-bulk', methods=['POST'])
+@token_required
+def send_bulk_notification(current_user):
+    """
+    Gửi một mẫu tới nhiều người nhận: recipients (list lead_id hoặc
+    {lead_id, recipient_id, variables}) hoặc lead_filter (status, assigned_to, ...).
+    Nội dung render riêng cho từng người, gửi nền qua worker pool của kênh.
+    """
+    data = request.get_json(silent=True) or {}
+    template = notification_templates.get(data.get('template'))
+    if template is None:
+        return jsonify({'error': 'Mẫu thông báo không tồn tại'}), 400
+    channel = data.get('channel', 'zalo_oa')
+    if channel not in CHANNELS or channel not in template.channels:
+        return jsonify({'error': f'Kênh không hợp lệ: {channel}'}), 400
+    recipients = data.get('recipients')
+    lead_filter = data.get('lead_filter')
+    if (recipients is None) == (lead_filter is None):
+        return jsonify({'error': 'Cần đúng một trong recipients hoặc lead_filter'}), 400
+    if recipients is not None and not isinstance(recipients, list):
+        return jsonify({'error': 'recipients phải là list'}), 400
+    if lead_filter is not None and not valid_filters(lead_filter, LEAD_FILTER_FIELDS, LEAD_LIST_FILTER_FIELDS):
+        return jsonify({
+            'error': f'lead_filter chỉ nhận {", ".join(LEAD_FILTER_FIELDS)}, giá trị là chuỗi '
+                     f'(list chuỗi với {", ".join(LEAD_LIST_FILTER_FIELDS)})'
+        }), 400
+    if not isinstance(data.get('variables') or {}, dict):
+        return jsonify({'error': 'variables phải là object'}), 400
+    
+    variables = dict(TEMPLATE_DEFAULTS, **(data.get('variables') or {}))
+    try:
+        jobs, skipped = render_jobs(
+            template, channel, bulk_targets(db, recipients, lead_filter), variables, NOTIFICATION_BULK_MAX
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not jobs:
+        return jsonify({'error': 'Không có người nhận hợp lệ', 'skipped': skipped[:100]}), 400
+    
+    batch = {
+        'id': str(uuid.uuid4())[:8],
+        'template': template.id,
+        'subject': template.name,
+        'channel': channel,
+        'skipped_count': len(skipped),
+        'created_by': current_user['id'],
+        'created_at': datetime.now().isoformat()
+    }
+    try:
+        batch = notification_dispatcher.submit(batch, jobs)
+    except QueueFull:
+        response = jsonify({'error': 'Hàng đợi gửi thông báo đầy, thử lại sau'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    # Chỉ trả về 100 người nhận bị bỏ qua đầu tiên
+    batch['skipped'] = skipped[:100]
+    return jsonify(batch), 202
+
+@app.route('/api/notifications/batches/<batch_id>', methods=['GET'])
+@token_required
+def get_notification_batch(current_user, batch_id):
+    """Tiến độ một đợt gửi hàng loạt"""
+    batch = notification_dispatcher.get(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Đợt gửi không tồn tại'}), 404
+    return jsonify(batch)
+
+@app.route('/api/notifications/stats', methods=['GET'])
+@token_required
+def get_notification_stats(current_user):
+    """Hàng đợi/worker từng kênh và kết nối SMTP"""
+    stats = notification_dispatcher.stats()
+    stats['email'] = email_sender.stats()
+    return jsonify(stats)
+
 # ======================= ANALYTICS =======================
 
 @app.route('/api/analytics/dashboard', methods=['GET'])
 @token_required
 def get_dashboard_analytics(current_user):
     """Lấy thống kê dashboard"""
-    # Calculate real stats
-    total_leads = len(DATABASE['leads'])
-    active_conversations = len(DATABASE['conversations'])
-    documents_processed = len(DATABASE['documents'])
-    messages_sent = DATABASE['analytics']['messages_sent']
-    
-    # Calculate lead status breakdown
-    lead_by_status = {}
-    for lead in DATABASE['leads'].values():
-        status = lead.get('status', 'unknown')
-        lead_by_status[status] = lead_by_status.get(status, 0) + 1
+    # Incrementally maintained counters - không quét leads/documents
+    stats = dashboard.snapshot(datetime.now().strftime('%Y-%m-%d'))
+    total_leads = stats['total_leads']
+    lead_by_status = stats['lead_by_status']
     
     # Recent activity
-    recent_leads = sorted(
-        DATABASE['leads'].values(),
-        key=lambda x: x.get('created_at', ''),
-        reverse=True
-    )[:5]
+    recent_leads = [db.get('leads', lead_id) for lead_id in dashboard.recent_lead_ids()]
+    recent_leads = [lead for lead in recent_leads if lead is not None]
     
     return jsonify({
         'stats': {
             'total_leads': total_leads,
-            'new_leads_today': sum(1 for l in DATABASE['leads'].values() 
-                                   if l.get('created_at', '').startswith(datetime.now().strftime('%Y-%m-%d'))),
-            'active_conversations': active_conversations,
-            'messages_sent': messages_sent,
-            'documents_processed': documents_processed,
-            'pending_documents': sum(1 for d in DATABASE['documents'].values() if d.get('status') == 'pending')
+            'new_leads_today': stats['new_leads'],
+            'active_conversations': stats['total_conversations'],
+            'messages_sent': db.counter('messages_sent'),
+            'documents_processed': stats['total_documents'],
+            'pending_documents': stats['pending_documents']
         },
         'lead_by_status': lead_by_status,
         'recent_leads': recent_leads,
@@ -633,11 +1645,11 @@ def generate_reports(current_user):
             'report_type': 'summary',
             'generated_at': datetime.now().isoformat(),
             'data': {
-                'total_leads': len(DATABASE['leads']),
-                'total_conversations': len(DATABASE['conversations']),
-                'total_documents': len(DATABASE['documents']),
-                'total_notifications': len(DATABASE['notifications']),
-                'users': len(DATABASE['users'])
+                'total_leads': db.count('leads'),
+                'total_conversations': db.count('conversations'),
+                'total_documents': db.count('documents'),
+                'total_notifications': db.count('notifications'),
+                'users': db.count('users')
             }
         })
     
@@ -653,7 +1665,7 @@ def get_users(current_user):
         return jsonify({'error': 'Không có quyền'}), 403
     
     users = []
-    for user in DATABASE['users'].values():
+    for user in db.values('users'):
         users.append({
             'id': user['id'],
             'username': user['username'],
@@ -672,20 +1684,24 @@ def update_user(current_user, user_id):
     if current_user['role'] != 'quan_tri_vien':
         return jsonify({'error': 'Không có quyền'}), 403
     
-    if user_id not in DATABASE['users']:
+    user = db.get('users', user_id)
+    if user is None:
         return jsonify({'error': 'User không tồn tại'}), 404
     
     data = request.json
-    user = DATABASE['users'][user_id]
+    # Băm trước khi sửa record: pool bận (503) thì user giữ nguyên
+    password = password_hasher.hash(data['password']) if data.get('password') else None
     
     for key in ['name', 'email', 'role']:
         if key in data:
             user[key] = data[key]
     
-    if 'password' in data and data['password']:
-        user['password'] = hashlib.sha256(data['password'].encode()).hexdigest()
+    if password:
+        user['password'] = password
     
-    DATABASE['users'][user_id] = user
+    db.put('users', user_id, user)
+    # Token đang dùng của user phải nhận vai trò/thông tin mới ở request kế tiếp
+    token_cache.invalidate(user_id)
     
     return jsonify({'message': 'Cập nhật thành công'})
 
@@ -701,11 +1717,11 @@ def get_roles(current_user):
 @token_required
 def get_workflow_status(current_user, lead_id):
     """Lấy trạng thái workflow của lead"""
-    if lead_id not in DATABASE['leads']:
+    lead = db.get('leads', lead_id)
+    if lead is None:
         return jsonify({'error': 'Lead không tồn tại'}), 404
     
-    lead = DATABASE['leads'][lead_id]
-    workflow = DATABASE['workflow_status'].get(lead_id, {
+    workflow = db.get('workflow_status', lead_id) or {
         'lead_id': lead_id,
         'steps': [
             {'step': 'tiep_nhan', 'status': 'completed', 'timestamp': lead.get('created_at')},
@@ -715,7 +1731,7 @@ def get_workflow_status(current_user, lead_id):
             {'step': 'phe_duyet', 'status': 'pending', 'timestamp': None},
             {'step': 'hoan_thanh', 'status': 'pending', 'timestamp': None}
         ]
-    })
+    }
     
     return jsonify(workflow)
 
@@ -723,14 +1739,16 @@ def get_workflow_status(current_user, lead_id):
 @token_required
 def advance_workflow(current_user, lead_id):
     """Chuyển bước workflow"""
-    if lead_id not in DATABASE['leads']:
+    lead = db.get('leads', lead_id)
+    if lead is None:
         return jsonify({'error': 'Lead không tồn tại'}), 404
     
     data = request.json
     next_step = data.get('next_step')
     
-    if lead_id not in DATABASE['workflow_status']:
-        DATABASE['workflow_status'][lead_id] = {
+    workflow = db.get('workflow_status', lead_id)
+    if workflow is None:
+        workflow = {
             'lead_id': lead_id,
             'steps': [
                 {'step': 'tiep_nhan', 'status': 'completed', 'timestamp': datetime.now().isoformat()},
@@ -742,15 +1760,13 @@ def advance_workflow(current_user, lead_id):
             ]
         }
     
-    workflow = DATABASE['workflow_status'][lead_id]
-    
     for step in workflow['steps']:
         if step['step'] == next_step:
             step['status'] = 'completed'
             step['timestamp'] = datetime.now().isoformat()
             break
     
-    DATABASE['workflow_status'][lead_id] = workflow
+    db.put('workflow_status', lead_id, workflow)
     
     # Update lead status
     status_map = {
@@ -762,8 +1778,11 @@ def advance_workflow(current_user, lead_id):
     }
     
     if next_step in status_map:
-        DATABASE['leads'][lead_id]['status'] = status_map[next_step]
-        DATABASE['leads'][lead_id]['updated_at'] = datetime.now().isoformat()
+        previous = dict(lead)
+        lead['status'] = status_map[next_step]
+        lead['updated_at'] = datetime.now().isoformat()
+        db.put('leads', lead_id, lead)
+        dashboard.lead_changed(previous, lead)
     
     return jsonify(workflow)
 
@@ -777,6 +1796,7 @@ def health_check():
         'service': 'Zalo OA Finance Workflow',
         'version': '1.0.0',
         'timestamp': datetime.now().isoformat(),
+        'storage': db.name,
         'modules': {
             'auth': 'active',
             'leads': 'active',
@@ -802,20 +1822,51 @@ def serve_static(path):
 
 # ======================= SOCKET.IO EVENTS =======================
 
+# sid -> user_id của kết nối dashboard đã xác thực
+dashboard_sessions = {}
+
 @socketio.on('connect', namespace='/dashboard')
-def handle_connect():
-    print('Client connected to dashboard')
-    emit('connected', {'status': 'ok'})
+def handle_connect(auth=None):
+    user = user_from_token((auth or {}).get('token') or request.args.get('token'))
+    if user is None:
+        # Từ chối kết nối không có JWT hợp lệ
+        return False
+    dashboard_sessions[request.sid] = user['id']
+    join_room(user_room(user['id']))
+    join_room(role_room(user['role']))
+    print(f"Client connected to dashboard: {user['id']}")
+    emit('connected', {'status': 'ok', 'rooms': [user_room(user['id']), role_room(user['role'])]})
 
 @socketio.on('disconnect', namespace='/dashboard')
 def handle_disconnect():
+    dashboard_sessions.pop(request.sid, None)
     print('Client disconnected from dashboard')
 
 @socketio.on('join_lead_room', namespace='/dashboard')
 def handle_join_lead_room(data):
+    """Theo dõi một lead: chỉ người phụ trách lead hoặc vai trò xem mọi lead"""
+    lead_id = data.get('lead_id') if isinstance(data, dict) else None
+    if not lead_id or not isinstance(lead_id, str):
+        emit('join_error', {'lead_id': lead_id, 'error': 'Thiếu lead_id'})
+        return
+    lead = db.get('leads', lead_id)
+    if lead is None:
+        emit('join_error', {'lead_id': lead_id, 'error': 'Lead không tồn tại'})
+        return
+    # Vai trò đọc lại từ storage: đổi vai trò có hiệu lực ngay cả với kết nối đang mở
+    user_id = dashboard_sessions.get(request.sid)
+    user = db.get('users', user_id) if user_id else None
+    if user is None or (user['role'] not in LEAD_SUPERVISOR_ROLES and lead.get('assigned_to') != user['id']):
+        emit('join_error', {'lead_id': lead_id, 'error': 'Không có quyền'})
+        return
+    join_room(lead_room(lead_id))
+    emit('joined', {'room': lead_room(lead_id)})
+
+@socketio.on('leave_lead_room', namespace='/dashboard')
+def handle_leave_lead_room(data):
     lead_id = data.get('lead_id')
-    join_room(f'lead_{lead_id}')
-    emit('joined', {'room': f'lead_{lead_id}'})
+    leave_room(lead_room(lead_id))
+    emit('left', {'room': lead_room(lead_id)})
 
 @socketio.on('chat_message', namespace='/dashboard')
 def handle_chat_message(data):
@@ -831,27 +1882,11 @@ def handle_chat_message(data):
     }
     
     # Simulate webhook processing
-    if user_id not in DATABASE['conversations']:
-        DATABASE['conversations'][user_id] = {
-            'user_id': user_id,
-            'messages': [],
-            'created_at': datetime.now().isoformat()
-        }
-    
-    DATABASE['conversations'][user_id]['messages'].append({
-        'sender': 'user',
-        'text': message,
-        'timestamp': datetime.now().isoformat()
-    })
+    received_at = datetime.now().isoformat()
     
     # Get bot response
     response = process_chatbot_message(message)
-    
-    DATABASE['conversations'][user_id]['messages'].append({
-        'sender': 'bot',
-        'text': response['text'],
-        'timestamp': datetime.now().isoformat()
-    })
+    save_chat_exchange(user_id, message, response, received_at)
     
     # Emit response
     emit('bot_response', {
@@ -0,0 +1,284 @@
+"""
+Zalo OA Finance Workflow - Conversation Archive
+Lịch sử của hội thoại lâu không hoạt động được nén (zlib) và ghi nối vào các
+file segment; index trong RAM giữ (segment, offset, length) của từng hội thoại.
+Đọc lại qua mmap, segment không còn bản ghi sống nào thì bị xóa; segment đã đóng
+có nhiều byte chết (bản ghi bị thay thế/đưa về RAM) được ghi lại phần còn sống.
+Khi MemoryStorage có journal, segment được giữ qua các lần restart: snapshot chỉ
+chứa index, segment bị bỏ chỉ được xóa sau khi đã có snapshot không còn trỏ tới nó.
+"""
+
+import os
+import json
+import mmap
+import zlib
+import threading
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.seg'
+# Segment đạt kích thước này thì đóng lại, ghi sang segment mới
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+# Segment đã đóng có tỉ lệ byte chết từ mức này trở lên thì được compact
+COMPACT_RATIO = 0.5
+
+
+class ConversationArchive:
+    """Kho lạnh cho tin nhắn của hội thoại: user_id -> list tin nhắn đã nén"""
+
+    def __init__(self, directory, segment_max_bytes=SEGMENT_MAX_BYTES, compact_ratio=COMPACT_RATIO,
+                 persistent=False):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.compact_ratio = compact_ratio
+        # persistent: index được lưu trong snapshot, segment cũ được nạp lại bằng load_state()
+        self.persistent = persistent
+        os.makedirs(directory, exist_ok=True)
+        if not persistent:
+            # Index chỉ sống trong RAM cùng MemoryStorage: segment của lần chạy trước là rác
+            for _, path in self._segments():
+                os.remove(path)
+        self._lock = threading.Lock()
+        # user_id -> (segment, offset, length)
+        self._index = {}
+        # segment -> user_id của các bản ghi còn được index trỏ tới
+        self._members = {}
+        # segment -> số byte đã ghi / số byte của bản ghi không còn được index trỏ tới
+        self._bytes = {}
+        self._dead = {}
+        # Segment chờ compact (ghi bản ghi sống sang segment hiện tại rồi xóa)
+        self._compact = set()
+        # Segment đã bỏ nhưng snapshot trên đĩa có thể còn trỏ tới (persistent): xóa sau snapshot
+        self._retired = set()
+        # segment -> (file, mmap) đang mở để đọc
+        self._maps = {}
+        self._segment = 0
+        self._file = None
+        self._size = 0
+        self.archived = 0
+        self.restored = 0
+        self.compacted = 0
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f'{SEGMENT_PREFIX}{segment:06d}{SEGMENT_SUFFIX}')
+
+    def _segments(self):
+        """[(số segment, path)] của các file segment trong thư mục"""
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    found.append((int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]), os.path.join(self.directory, name)))
+                except ValueError:
+                    continue
+        return sorted(found)
+
+    def _open_segment(self):
+        self._segment += 1
+        self._file = open(self._path(self._segment), 'ab')
+        self._size = 0
+        self._members[self._segment] = set()
+        self._bytes[self._segment] = 0
+        self._dead[self._segment] = 0
+
+    def __contains__(self, user_id):
+        return user_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    @staticmethod
+    def encode(messages):
+        return zlib.compress(json.dumps(messages, ensure_ascii=False).encode('utf-8'))
+
+    @staticmethod
+    def decode(payload):
+        return json.loads(zlib.decompress(payload))
+
+    def write(self, user_id, messages):
+        """Nén và ghi nối tin nhắn của một hội thoại (ghi đè bản lưu cũ nếu có)"""
+        self.write_raw(user_id, self.encode(messages))
+
+    def write_raw(self, user_id, payload):
+        with self._lock:
+            self._append(user_id, payload)
+            self.archived += 1
+            self._compact_pending()
+
+    def _append(self, user_id, payload):
+        if self._file is None or self._size + len(payload) > self.segment_max_bytes:
+            if self._file is not None:
+                self._file.close()
+                closed = self._segment
+                self._open_segment()
+                self._check(closed)
+            else:
+                self._open_segment()
+        offset = self._size
+        self._file.write(payload)
+        self._file.flush()
+        self._size += len(payload)
+        self._bytes[self._segment] += len(payload)
+        self._drop(user_id)
+        self._index[user_id] = (self._segment, offset, len(payload))
+        self._members[self._segment].add(user_id)
+
+    def read(self, user_id):
+        """Tin nhắn đã lưu của hội thoại, None nếu không có trong archive"""
+        payload = self.read_raw(user_id)
+        return self.decode(payload) if payload is not None else None
+
+    def read_raw(self, user_id):
+        with self._lock:
+            entry = self._index.get(user_id)
+            if entry is None:
+                return None
+            segment, offset, length = entry
+            view = self._map(segment, offset + length)
+            return view[offset:offset + length]
+
+    def user_ids(self):
+        with self._lock:
+            return list(self._index)
+
+    def snapshot_state(self):
+        """
+        (state, retired): index để lưu trong snapshot (không đọc dữ liệu segment) và các
+        segment đã bỏ - gọi purge(retired) sau khi snapshot đã được ghi xuống đĩa
+        """
+        with self._lock:
+            state = {'directory': self.directory, 'index': dict(self._index), 'segment': self._segment}
+            return state, sorted(self._retired)
+
+    def purge(self, segments):
+        """Xóa các segment đã bỏ mà snapshot mới nhất không còn trỏ tới"""
+        with self._lock:
+            for segment in segments:
+                self._retired.discard(segment)
+                try:
+                    os.remove(self._path(segment))
+                except FileNotFoundError:
+                    pass
+
+    def load_state(self, state):
+        """
+        Nạp index từ snapshot (None = chưa có snapshot). Byte trong segment mà index không
+        trỏ tới (ghi sau snapshot) tính là byte chết; segment không được trỏ tới bị xóa.
+        """
+        with self._lock:
+            on_disk = dict(self._segments())
+            index = {}
+            for user_id, entry in (state['index'] if state else {}).items():
+                if entry[0] in on_disk:
+                    index[user_id] = entry
+                else:
+                    print(f'Archive: thiếu segment {entry[0]} của hội thoại {user_id}')
+            self._index = index
+            live = {}
+            for user_id, (segment, _, length) in index.items():
+                self._members.setdefault(segment, set()).add(user_id)
+                live[segment] = live.get(segment, 0) + length
+            for segment, path in on_disk.items():
+                if segment in live:
+                    self._bytes[segment] = os.path.getsize(path)
+                    self._dead[segment] = self._bytes[segment] - live[segment]
+                else:
+                    os.remove(path)
+            # Không ghi tiếp vào segment cũ: lần ghi sau mở segment mới
+            self._segment = max([state['segment'] if state else 0] + list(on_disk))
+            for segment in list(self._members):
+                self._check(segment)
+            self._compact_pending()
+
+    def pop(self, user_id):
+        """Đọc rồi bỏ hội thoại khỏi archive (khi chuyển lại về bộ nhớ nóng)"""
+        messages = self.read(user_id)
+        if messages is not None:
+            with self._lock:
+                self._drop(user_id)
+                self.restored += 1
+                self._compact_pending()
+        return messages
+
+    def discard(self, user_id):
+        with self._lock:
+            self._drop(user_id)
+            self._compact_pending()
+
+    def _map(self, segment, needed):
+        opened = self._maps.get(segment)
+        if opened is not None and len(opened[1]) >= needed:
+            return opened[1]
+        if opened is not None:
+            # Segment đang ghi đã lớn hơn vùng map cũ
+            opened[1].close()
+            opened[0].close()
+        handle = open(self._path(segment), 'rb')
+        view = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[segment] = (handle, view)
+        return view
+
+    def _drop(self, user_id):
+        entry = self._index.pop(user_id, None)
+        if entry is None:
+            return
+        segment, _, length = entry
+        self._members[segment].discard(user_id)
+        self._dead[segment] += length
+        self._check(segment)
+
+    def _check(self, segment):
+        """Segment đã đóng: xóa nếu hết bản ghi sống, đánh dấu compact nếu nhiều byte chết"""
+        if segment not in self._members or (self._file is not None and segment == self._segment):
+            return
+        if not self._members[segment]:
+            self._release(segment)
+        elif self._dead[segment] >= self.compact_ratio * self._bytes[segment]:
+            self._compact.add(segment)
+
+    def _compact_pending(self):
+        # Chép bản ghi sống sang segment hiện tại; bản cuối cùng rời đi thì _drop xóa segment
+        while self._compact:
+            segment = self._compact.pop()
+            if segment not in self._members:
+                continue
+            for user_id in list(self._members[segment]):
+                _, offset, length = self._index[user_id]
+                self._append(user_id, self._map(segment, offset + length)[offset:offset + length])
+            self.compacted += 1
+
+    def _release(self, segment):
+        """Xóa segment đã đóng khi không còn bản ghi sống"""
+        self._members.pop(segment, None)
+        self._bytes.pop(segment, None)
+        self._dead.pop(segment, None)
+        self._compact.discard(segment)
+        opened = self._maps.pop(segment, None)
+        if opened is not None:
+            opened[1].close()
+            opened[0].close()
+        if self.persistent:
+            self._retired.add(segment)
+        else:
+            os.remove(self._path(segment))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'conversations': len(self._index),
+                'segments': len(self._members),
+                'bytes': sum(length for _, _, length in self._index.values()),
+                'dead_bytes': sum(self._dead.values()),
+                'archived': self.archived,
+                'restored': self.restored,
+                'compacted': self.compacted
+            }
+
+    def close(self):
+        with self._lock:
+            for handle, view in self._maps.values():
+                view.close()
+                handle.close()
+            self._maps = {}
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,226 @@
+"""
+Zalo OA Finance Workflow - Auth
+Xác thực JWT cho mỗi request mà không phải giải mã + kiểm chữ ký + tra user lại từ đầu:
+TokenCache giữ principal (user + tập quyền tính sẵn) của token đã kiểm tra,
+tới khi token hết hạn (exp) hoặc user bị sửa.
+PasswordHasher băm/kiểm tra mật khẩu bcrypt trong worker pool riêng có giới hạn,
+để loạt đăng nhập đầu ca không chiếm hết thread xử lý request.
+"""
+
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+
+# Quyền đặc biệt: bao gồm mọi quyền khác
+ALL_PERMISSIONS = 'all'
+
+
+def role_permissions(roles):
+    """{role: frozenset(quyền)} tính một lần từ bảng ROLES"""
+    return {
+        role: frozenset(info.get('permissions', ()))
+        for role, info in roles.items()
+    }
+
+
+class Principal(dict):
+    """Bản sao record user đã xác thực, kèm tập quyền của vai trò"""
+
+    __slots__ = ('permissions',)
+
+    def __init__(self, user, permissions=frozenset()):
+        super().__init__(user)
+        self.permissions = permissions
+
+    def can(self, permission):
+        return permission in self.permissions or ALL_PERMISSIONS in self.permissions
+
+
+class TokenCache:
+    """
+    Cache token -> principal có giới hạn số phần tử (LRU), mỗi phần tử sống tới exp của token.
+    invalidate(user_id) bỏ mọi token của user; generation chặn việc ghi lại principal cũ
+    được đọc trước lúc invalidate.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        # user_id -> set(token) đang trong cache
+        self._tokens = {}
+        # user_id -> số lần invalidate
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.invalidated = 0
+
+    def get(self, token):
+        """Principal của token, None nếu chưa có hoặc token đã hết hạn"""
+        now = time.time()
+        with self._lock:
+            entry = self._items.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, principal = entry
+            if expires_at <= now:
+                # Để caller giải mã lại và báo token hết hạn
+                self._remove(token)
+                self.misses += 1
+                return None
+            self._items.move_to_end(token)
+            self.hits += 1
+            return principal
+
+    def generation(self, user_id):
+        """Đọc trước khi tra user, truyền lại cho put()"""
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def put(self, token, principal, expires_at, generation=0):
+        """Ghi principal; bỏ qua nếu user đã bị invalidate kể từ lúc đọc generation"""
+        user_id = principal['id']
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+            self._remove(token)
+            self._items[token] = (float('inf') if expires_at is None else expires_at, principal)
+            self._tokens.setdefault(user_id, set()).add(token)
+            while len(self._items) > self.max_size:
+                self._remove(next(iter(self._items)))
+                self.evicted += 1
+
+    def invalidate(self, user_id):
+        """Bỏ principal của mọi token thuộc user (khi user đổi vai trò, mật khẩu, ...)"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for token in self._tokens.pop(user_id, ()):
+                self._items.pop(token, None)
+                self.invalidated += 1
+
+    def _remove(self, token):
+        entry = self._items.pop(token, None)
+        if entry is None:
+            return
+        user_id = entry[1]['id']
+        tokens = self._tokens.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[user_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evicted': self.evicted,
+                'invalidated': self.invalidated
+            }
+
+
+class HasherBusy(Exception):
+    """Pool băm mật khẩu đầy hoặc quá thời gian chờ"""
+
+
+def is_legacy_hash(stored):
+    """Hash SHA-256 không salt của phiên bản cũ (chưa chuyển sang bcrypt)"""
+    return not stored.startswith('$2')
+
+
+class PasswordHasher:
+    """
+    bcrypt trong ThreadPoolExecutor `workers` thread (bcrypt nhả GIL khi băm).
+    Tối đa `queue_size` việc đang chờ/chạy, vượt quá thì HasherBusy ngay;
+    caller chờ tối đa `timeout` giây.
+    """
+
+    def __init__(self, workers=2, queue_size=64, timeout=5.0, rounds=12):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.rounds = rounds
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hasher')
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.migrated = 0
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy('Hệ thống đang bận, vui lòng thử lại')
+        with self._lock:
+            self.pending += 1
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._done(None)
+            raise
+        # Slot chỉ được trả khi việc thật sự xong, kể cả khi caller đã hết thời gian chờ
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise HasherBusy('Hệ thống đang bận, vui lòng thử lại')
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def _hash(self, password):
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(self.rounds)).decode('ascii')
+
+    def _verify(self, password, stored):
+        if is_legacy_hash(stored):
+            legacy = hashlib.sha256(password.encode('utf-8')).hexdigest()
+            if not hmac.compare_digest(legacy, stored):
+                return False, None
+            # Đúng mật khẩu: băm lại bằng bcrypt ngay trong worker để caller lưu lại
+            return True, self._hash(password)
+        return bcrypt.checkpw(password.encode('utf-8'), stored.encode('ascii')), None
+
+    def hash(self, password):
+        """Hash bcrypt của mật khẩu (HasherBusy nếu pool đầy/quá hạn)"""
+        return self._run(self._hash, password)
+
+    def verify(self, password, stored):
+        """
+        (đúng mật khẩu?, hash mới) - hash mới khác None khi hash cũ là SHA-256
+        và cần được thay bằng bcrypt
+        """
+        ok, upgraded = self._run(self._verify, password, stored)
+        if upgraded is not None:
+            with self._lock:
+                self.migrated += 1
+        return ok, upgraded
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'migrated': self.migrated,
+                'rounds': self.rounds
+            }
@@ -0,0 +1,281 @@
+"""
+Zalo OA Finance Workflow - Broadcast Delivery
+Gửi broadcast tới người nhận qua Zalo OA API: event loop asyncio riêng (một thread),
+AsyncZaloClient dùng chung connection pool, gửi theo lô với số request đồng thời
+giới hạn và token bucket theo quota của OA. Sau mỗi lô, sent_count/failed_count của
+broadcast được ghi lại và báo về qua on_progress.
+BroadcastScheduler giữ các broadcast hẹn giờ trong heap và giao cho engine khi tới hạn.
+"""
+
+import time
+import heapq
+import asyncio
+import threading
+from datetime import datetime
+
+from zalo_client import ZaloAPIError
+
+
+def validate_audience(target_audience):
+    """
+    target_audience hợp lệ: 'all' (mọi người dùng đã có hội thoại với OA)
+    hoặc list user_id cụ thể; ValueError nếu không
+    """
+    if target_audience == 'all':
+        return target_audience
+    if isinstance(target_audience, list) and all(isinstance(u, (str, int)) for u in target_audience):
+        return target_audience
+    raise ValueError(f'target_audience không hợp lệ: {target_audience}')
+
+
+def resolve_audience(db, target_audience):
+    """target_audience -> list user_id Zalo nhận tin (không trùng)"""
+    if validate_audience(target_audience) == 'all':
+        return [conversation['user_id'] for conversation in db.values('conversations')]
+    return list(dict.fromkeys(str(user_id) for user_id in target_audience if user_id))
+
+
+def parse_scheduled_time(value):
+    """ISO 8601 -> datetime giờ địa phương không múi giờ (so được với datetime.now())"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+def broadcast_text(broadcast):
+    return broadcast.get('content') or broadcast.get('title') or ''
+
+
+class RateLimiter:
+    """Token bucket cho coroutine: tối đa `rate` request/giây, cho phép dồn `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastEngine:
+    """Bộ gửi broadcast chạy nền; submit() trả ngay, tiến độ ghi vào storage"""
+
+    def __init__(self, db, client, concurrency=50, batch_size=500, rate_limit=0, on_progress=None):
+        self.db = db
+        # AsyncZaloClient, pool kết nối nên >= concurrency
+        self.client = client
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        # Quota của OA (tin/giây), 0 = không giới hạn
+        self.rate_limit = rate_limit
+        # on_progress(broadcast) sau mỗi lô và khi kết thúc
+        self.on_progress = on_progress
+        self._loop = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self.active = set()
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='broadcast-engine', daemon=True)
+        thread.start()
+        self._ready.wait()
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._setup())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _setup(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._limiter = RateLimiter(self.rate_limit)
+
+    def submit(self, broadcast_id):
+        """Bắt đầu gửi broadcast; trả về concurrent Future của lần gửi"""
+        with self._lock:
+            if broadcast_id in self.active:
+                return None
+            self.active.add(broadcast_id)
+        return asyncio.run_coroutine_threadsafe(self._deliver(broadcast_id), self._loop)
+
+    async def _send(self, user_id, text):
+        async with self._semaphore:
+            await self._limiter.acquire()
+            try:
+                # Client tự thử lại lỗi tạm thời và refresh token
+                await self.client.send_text(user_id, text)
+                return True
+            except ZaloAPIError:
+                return False
+
+    def _save(self, broadcast):
+        self.db.put('broadcast_messages', broadcast['id'], broadcast)
+        if self.on_progress is not None:
+            try:
+                self.on_progress(broadcast)
+            except Exception as e:
+                print(f'Broadcast progress error: {e}')
+
+    async def _deliver(self, broadcast_id):
+        try:
+            stored = self.db.get('broadcast_messages', broadcast_id)
+            if stored is None or stored.get('status') != 'scheduled':
+                # Đã hủy (hoặc đã gửi) trước khi tới lượt
+                return None
+            broadcast = dict(stored)
+            try:
+                recipients = resolve_audience(self.db, broadcast.get('target_audience', 'all'))
+            except ValueError:
+                recipients = []
+            text = broadcast_text(broadcast)
+            started = time.monotonic()
+            broadcast.update({
+                'status': 'sending',
+                'recipient_count': len(recipients),
+                'sent_count': 0,
+                'failed_count': 0,
+                'started_at': datetime.now().isoformat()
+            })
+            self._save(broadcast)
+
+            for start in range(0, len(recipients), self.batch_size):
+                batch = recipients[start:start + self.batch_size]
+                results = await asyncio.gather(*(self._send(user_id, text) for user_id in batch))
+                sent = sum(results)
+                with self._lock:
+                    self.sent += sent
+                    self.failed += len(batch) - sent
+                broadcast = dict(broadcast)
+                broadcast['sent_count'] += sent
+                broadcast['failed_count'] += len(batch) - sent
+                self._save(broadcast)
+
+            elapsed = time.monotonic() - started
+            broadcast = dict(broadcast)
+            if broadcast['failed_count'] == 0:
+                broadcast['status'] = 'sent'
+            elif broadcast['sent_count'] == 0:
+                broadcast['status'] = 'failed'
+            else:
+                broadcast['status'] = 'partial'
+            broadcast['finished_at'] = datetime.now().isoformat()
+            broadcast['messages_per_second'] = round(len(recipients) / elapsed, 1) if elapsed > 0 else 0.0
+            self._save(broadcast)
+            return broadcast
+        except Exception as e:
+            print(f'Broadcast {broadcast_id} error: {e}')
+            stored = self.db.get('broadcast_messages', broadcast_id)
+            if stored is not None:
+                self._save(dict(stored, status='failed', error=str(e)))
+            return None
+        finally:
+            with self._lock:
+                self.active.discard(broadcast_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'api_url': self.client.api_url,
+                'concurrency': self.concurrency,
+                'batch_size': self.batch_size,
+                'rate_limit': self.rate_limit,
+                'active': sorted(self.active),
+                'sent': self.sent,
+                'failed': self.failed
+            }
+
+
+class BroadcastScheduler:
+    """
+    Hàng đợi ưu tiên (heap) các broadcast chờ gửi theo scheduled_time. Một thread ngủ
+    đúng tới hạn của phần tử đầu heap (hoặc tới khi có lịch sớm hơn được thêm vào)
+    rồi giao cho engine. Trạng thái gốc nằm trong storage (status 'scheduled'),
+    nên khi khởi động lại heap được nạp lại từ index status. Broadcast đang gửi dở
+    lúc server dừng ('sending') được chuyển sang 'interrupted', giữ nguyên bộ đếm.
+    Hủy/đổi lịch không xóa khỏi heap: phần tử cũ bị bỏ qua khi tới hạn vì không còn
+    khớp với record trong storage.
+    """
+
+    def __init__(self, db, engine):
+        self.db = db
+        self.engine = engine
+        self._heap = []
+        self._cond = threading.Condition()
+        self.dispatched = 0
+        self.skipped = 0
+        self.interrupted = 0
+
+    def start(self):
+        for broadcast in self.db.find('broadcast_messages', 'status', 'sending'):
+            # Không gửi tiếp: lô dở có thể đã gửi một phần, gửi lại thì người nhận bị trùng tin
+            self.db.put('broadcast_messages', broadcast['id'], dict(
+                broadcast, status='interrupted', finished_at=datetime.now().isoformat()
+            ))
+            self.interrupted += 1
+        for broadcast in self.db.find('broadcast_messages', 'status', 'scheduled'):
+            self.schedule(broadcast)
+        threading.Thread(target=self._run, name='broadcast-scheduler', daemon=True).start()
+        return self
+
+    def schedule(self, broadcast):
+        """Đưa broadcast (status 'scheduled') vào heap theo scheduled_time"""
+        with self._cond:
+            heapq.heappush(self._heap, (broadcast['scheduled_time'], broadcast['id']))
+            if self._heap[0][1] == broadcast['id']:
+                # Lịch mới sớm hơn lần thức dậy đang chờ
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due = datetime.fromisoformat(self._heap[0][0])
+                    delay = (due - datetime.now()).total_seconds()
+                    if delay <= 0:
+                        scheduled_time, broadcast_id = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(delay)
+            self._dispatch(broadcast_id, scheduled_time)
+
+    def _dispatch(self, broadcast_id, scheduled_time):
+        broadcast = self.db.get('broadcast_messages', broadcast_id)
+        if (broadcast is None or broadcast.get('status') != 'scheduled'
+                or broadcast.get('scheduled_time') != scheduled_time):
+            # Đã hủy, đổi lịch hoặc bị xóa sau khi vào heap
+            with self._cond:
+                self.skipped += 1
+            return
+        with self._cond:
+            self.dispatched += 1
+        self.engine.submit(broadcast_id)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._heap),
+                'next_due': self._heap[0][0] if self._heap else None,
+                'dispatched': self.dispatched,
+                'skipped': self.skipped,
+                'interrupted': self.interrupted
+            }
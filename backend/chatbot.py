@@ -0,0 +1,168 @@
+"""
+Zalo OA Finance Workflow - Chatbot Intent Matching
+- IntentMatcher: automaton Aho-Corasick, tìm mọi intent khớp chính xác trong một lần duyệt
+- IntentScorer: chấm điểm mờ (không dấu) bằng vector n-gram ký tự + nhân ma trận NumPy
+"""
+
+import re
+
+import numpy as np
+
+from search import fold_accents
+
+NGRAM_SIZE = 3
+# Số tin nhắn tối đa trong một ma trận khi chấm điểm theo lô
+BATCH_CHUNK = 1024
+
+
+class IntentMatcher:
+    """
+    Aho-Corasick trên pattern của CHATBOT_INTENTS.
+    Thứ tự intent trong dict là độ ưu tiên (intent khai báo trước thắng).
+    """
+
+    def __init__(self, intents):
+        self.intent_keys = list(intents)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+        for priority, key in enumerate(self.intent_keys):
+            for pattern in intents[key]['patterns']:
+                self._add(pattern.lower(), priority)
+        self._build()
+
+    def _add(self, pattern, priority):
+        if not pattern:
+            return
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+            state = nxt
+        self._out[state].add(priority)
+
+    def _build(self):
+        # BFS: fail link của mỗi node, gộp output của fail link vào node
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] |= self._out[self._fail[nxt]]
+        self._out = [tuple(sorted(out)) for out in self._out]
+        # Intent ưu tiên cao nhất khớp tại mỗi node (None nếu không có)
+        self._best = [out[0] if out else None for out in self._out]
+
+    def _states(self, text):
+        goto, fail = self._goto, self._fail
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            yield state
+
+    def match_all(self, text):
+        """Tất cả intent có pattern xuất hiện trong text, theo thứ tự ưu tiên"""
+        found = set()
+        for state in self._states(text):
+            found.update(self._out[state])
+        return [self.intent_keys[priority] for priority in sorted(found)]
+
+    def best(self, text):
+        """Intent ưu tiên cao nhất có pattern xuất hiện trong text, None nếu không khớp"""
+        best = None
+        for state in self._states(text):
+            priority = self._best[state]
+            if priority is not None and (best is None or priority < best):
+                best = priority
+                if best == 0:
+                    break
+        return self.intent_keys[best] if best is not None else None
+
+
+def char_ngrams(text, n=NGRAM_SIZE):
+    """Tập n-gram ký tự của text đã bỏ dấu, có đệm khoảng trắng ở biên từ"""
+    normalized = ' ' + re.sub(r'\s+', ' ', fold_accents(text)).strip() + ' '
+    if len(normalized) <= n:
+        return {normalized}
+    return {normalized[i:i + n] for i in range(len(normalized) - n + 1)}
+
+
+class IntentScorer:
+    """
+    Chấm điểm tất cả intent cùng lúc: mỗi pattern là một vector n-gram nhị phân,
+    điểm của pattern = trung bình (độ phủ pattern, cosine), điểm intent = max các pattern
+    """
+
+    def __init__(self, intents):
+        self.intent_keys = list(intents)
+        vocabulary = {}
+        rows = []
+        starts = []
+        for key in self.intent_keys:
+            starts.append(len(rows))
+            for pattern in intents[key]['patterns']:
+                grams = char_ngrams(pattern)
+                rows.append([vocabulary.setdefault(gram, len(vocabulary)) for gram in grams])
+        self._vocabulary = vocabulary
+        # Intent không có pattern nào được trỏ vào cột cuối cùng (điểm 0)
+        self._starts = np.array([min(start, len(rows)) for start in starts], dtype=np.intp)
+        self._empty = np.array([
+            (starts[i + 1] if i + 1 < len(starts) else len(rows)) == starts[i]
+            for i in range(len(starts))
+        ])
+
+        self._patterns = np.zeros((len(vocabulary), len(rows) + 1), dtype=np.float32)
+        for j, columns in enumerate(rows):
+            self._patterns[columns, j] = 1.0
+        self._pattern_sizes = np.maximum(self._patterns.sum(axis=0), 1.0)
+
+    def _vectorize(self, messages):
+        matrix = np.zeros((len(messages), len(self._vocabulary)), dtype=np.float32)
+        sizes = np.ones(len(messages), dtype=np.float32)
+        for i, message in enumerate(messages):
+            grams = char_ngrams(message)
+            sizes[i] = max(len(grams), 1)
+            columns = [self._vocabulary[g] for g in grams if g in self._vocabulary]
+            matrix[i, columns] = 1.0
+        return matrix, sizes
+
+    def score(self, messages):
+        """Ma trận điểm (số tin nhắn x số intent), giá trị trong [0, 1]"""
+        result = np.zeros((len(messages), len(self.intent_keys)), dtype=np.float32)
+        for lo in range(0, len(messages), BATCH_CHUNK):
+            matrix, sizes = self._vectorize(messages[lo:lo + BATCH_CHUNK])
+            overlap = matrix @ self._patterns
+            coverage = overlap / self._pattern_sizes
+            cosine = overlap / np.sqrt(sizes[:, None] * self._pattern_sizes)
+            pattern_scores = (coverage + cosine) / 2
+            intent_scores = np.maximum.reduceat(pattern_scores, self._starts, axis=1)
+            intent_scores[:, self._empty] = 0.0
+            result[lo:lo + BATCH_CHUNK] = intent_scores
+        return result
+
+    def classify(self, messages, threshold, scores=None):
+        """[(intent_key hoặc None, điểm cao nhất)] cho từng tin nhắn (scores: kết quả score() đã có)"""
+        if scores is None:
+            scores = self.score(messages)
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(messages)), best]
+        return [
+            (self.intent_keys[j] if s >= threshold else None, float(s))
+            for j, s in zip(best, best_scores)
+        ]
+
+    def index(self, intent_key):
+        return self.intent_keys.index(intent_key)
@@ -0,0 +1,114 @@
+"""
+Zalo OA Finance Workflow - Email Client
+Gửi email thông báo qua SMTP: mỗi worker thread giữ một kết nối SMTP mở sẵn
+(không bắt tay/đăng nhập lại cho từng email), tự kết nối lại khi server ngắt,
+thử lại lỗi tạm thời (4xx) với backoff và đo độ trễ gửi.
+"""
+
+import time
+import smtplib
+import threading
+from email.message import EmailMessage
+
+from metrics import LatencyHistogram
+from zalo_client import backoff_delay
+
+
+class EmailError(Exception):
+    """Không gửi được email (sau khi đã thử lại nếu lỗi tạm thời)"""
+
+
+class EmailSender:
+    def __init__(self, host, port, sender, username=None, password=None, starttls=False,
+                 timeout=10.0, max_retries=2, backoff_base=0.2, backoff_cap=5.0):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.latency = LatencyHistogram()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.sent = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _connection(self):
+        smtp = getattr(self._local, 'smtp', None)
+        if smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or '')
+            self._local.smtp = smtp
+            with self._lock:
+                self.connects += 1
+        return smtp
+
+    def _discard(self):
+        smtp = getattr(self._local, 'smtp', None)
+        self._local.smtp = None
+        if smtp is not None:
+            try:
+                smtp.close()
+            except OSError:
+                pass
+
+    def message(self, to, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = to
+        message['Subject'] = subject
+        message.set_content(body)
+        return message
+
+    def send(self, to, subject, body):
+        """Gửi một email; EmailError nếu thất bại"""
+        message = self.message(to, subject, body)
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                self._connection().send_message(message)
+                with self._lock:
+                    self.sent += 1
+                return {}
+            except smtplib.SMTPResponseException as e:
+                # 4xx: tạm thời (server bận, giới hạn tốc độ); smtplib đã RSET, giữ kết nối
+                error, transient, reconnected = e, 400 <= e.smtp_code < 500, False
+            except smtplib.SMTPRecipientsRefused as e:
+                error, transient, reconnected = e, False, False
+            except (smtplib.SMTPException, OSError) as e:
+                # Server ngắt kết nối giữ sẵn (idle timeout) hoặc lỗi mạng - kết nối lại
+                error, transient, reconnected = e, True, True
+                self._discard()
+            finally:
+                self.latency.observe(time.perf_counter() - started)
+            if not transient or attempt >= self.max_retries:
+                with self._lock:
+                    self.failures += 1
+                raise EmailError(f'Không gửi được email tới {to}: {error}')
+            with self._lock:
+                self.retries += 1
+            if not (reconnected and attempt == 0):
+                # Kết nối cũ bị đóng thì thử lại ngay trên kết nối mới
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'host': f'{self.host}:{self.port}',
+                'connects': self.connects,
+                'sent': self.sent,
+                'retries': self.retries,
+                'failures': self.failures,
+                'latency': self.latency.stats()
+            }
@@ -0,0 +1,214 @@
+"""
+Zalo OA Finance Workflow - Webhook Ingestion
+Hàng đợi có giới hạn trong tiến trình: webhook chỉ kiểm tra dữ liệu, đẩy sự kiện
+vào hàng đợi và trả 200 ngay; worker pool xử lý lưu trữ, chatbot và emit dashboard.
+DedupCache giữ response gốc của từng sự kiện để lần gửi lại không bị xử lý lần nữa.
+"""
+
+import time
+import zlib
+import threading
+from collections import OrderedDict, deque
+
+OVERFLOW_POLICIES = ('reject', 'drop_oldest', 'block')
+
+
+class QueueFull(Exception):
+    """Hàng đợi đầy và chính sách tràn không cho nhận thêm"""
+
+
+class WebhookQueue:
+    """
+    Bounded queue + worker pool cho sự kiện webhook.
+    Có shard_key thì mỗi worker có deque riêng và sự kiện cùng key (vd. cùng sender.id)
+    luôn vào cùng một worker, nên được xử lý đúng thứ tự nhận; không có thì dùng chung một deque.
+    """
+
+    def __init__(self, handler, max_size=10000, workers=4, overflow='reject', block_timeout=2.0, name='webhook',
+                 shard_key=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Chính sách tràn không hợp lệ: {overflow}')
+        self.handler = handler
+        self.max_size = max_size
+        self.workers = workers
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        # Tên thread worker/log (hàng đợi cũng dùng cho việc nền khác ngoài webhook)
+        self.name = name
+        self.shard_key = shard_key
+        self._shards = [deque() for _ in range(workers if shard_key is not None else 1)]
+        self._size = 0
+        # Một lock chung: _cond báo còn chỗ (submit chờ ở chế độ block), _ready[i] báo shard i có việc
+        self._cond = threading.Condition()
+        self._ready = [threading.Condition(self._cond) for _ in self._shards]
+        self._threads = []
+        self.accepted = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.last_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, args=(i % len(self._shards),),
+                                          name=f'{self.name}-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _shard(self, event):
+        if len(self._shards) == 1:
+            return 0
+        return zlib.crc32(str(self.shard_key(event)).encode('utf-8')) % len(self._shards)
+
+    def _oldest_shard(self):
+        return min((shard for shard in self._shards if shard), key=lambda shard: shard[0][0])
+
+    def _push(self, index, item):
+        self._shards[index].append(item)
+        self._size += 1
+        self._ready[index].notify()
+
+    def submit(self, event):
+        """Đưa sự kiện vào hàng đợi, raise QueueFull nếu không nhận được"""
+        index = self._shard(event)
+        with self._cond:
+            if self._size >= self.max_size:
+                if self.overflow == 'drop_oldest':
+                    self._oldest_shard().popleft()
+                    self._size -= 1
+                    self.dropped += 1
+                elif self.overflow == 'block':
+                    deadline = time.monotonic() + self.block_timeout
+                    while self._size >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            raise QueueFull()
+                        self._cond.wait(remaining)
+                else:
+                    self.rejected += 1
+                    raise QueueFull()
+            self._push(index, (time.monotonic(), event))
+            self.accepted += 1
+
+    def submit_many(self, events):
+        """
+        Đưa cả lô vào hàng đợi trong một lần giữ lock; không đủ chỗ cho cả lô thì
+        raise QueueFull và không nhận phần tử nào (bất kể chính sách tràn)
+        """
+        indexes = [self._shard(event) for event in events]
+        with self._cond:
+            if self._size + len(events) > self.max_size:
+                self.rejected += len(events)
+                raise QueueFull()
+            now = time.monotonic()
+            for index, event in zip(indexes, events):
+                self._push(index, (now, event))
+            self.accepted += len(events)
+
+    def _run(self, index):
+        shard, ready = self._shards[index], self._ready[index]
+        while True:
+            with self._cond:
+                while not shard:
+                    ready.wait()
+                enqueued_at, event = shard.popleft()
+                self._size -= 1
+                # Báo cho submit() đang chờ ở chế độ block
+                self._cond.notify_all()
+            wait_ms = (time.monotonic() - enqueued_at) * 1000
+            try:
+                self.handler(event)
+                ok = True
+            except Exception as e:
+                print(f'{self.name} worker error: {e}')
+                ok = False
+            with self._cond:
+                self.last_wait_ms = wait_ms
+                self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+
+    def stats(self):
+        """Độ sâu hàng đợi và độ trễ xử lý"""
+        with self._cond:
+            oldest = self._oldest_shard()[0][0] if self._size else None
+            return {
+                'depth': self._size,
+                'max_size': self.max_size,
+                'workers': self.workers,
+                'shards': len(self._shards),
+                'overflow': self.overflow,
+                'accepted': self.accepted,
+                'processed': self.processed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'rejected': self.rejected,
+                'lag_ms': round((time.monotonic() - oldest) * 1000, 1) if oldest is not None else 0.0,
+                'last_wait_ms': round(self.last_wait_ms, 1),
+                'max_wait_ms': round(self.max_wait_ms, 1)
+            }
+
+
+class DedupCache:
+    """
+    Cache chống xử lý trùng webhook (Zalo gửi lại khi timeout): key -> response gốc.
+    Giới hạn cả TTL lẫn số phần tử nên bộ nhớ không tăng theo lưu lượng.
+    """
+
+    def __init__(self, max_size=100000, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.evicted = 0
+
+    def _expire(self, now):
+        # TTL như nhau cho mọi key nên phần tử cũ nhất luôn nằm đầu OrderedDict
+        while self._items:
+            key, (expires_at, _) = next(iter(self._items.items()))
+            if expires_at > now:
+                break
+            del self._items[key]
+
+    def remember(self, key, value):
+        """
+        Ghi nhận key nếu chưa có và trả về None; nếu key đã có (chưa hết hạn)
+        trả về value gốc và không ghi đè
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._items.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[1]
+            self._items[key] = (now + self.ttl, value)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evicted += 1
+            return None
+
+    def forget(self, key):
+        """Bỏ key (ví dụ khi sự kiện không vào được hàng đợi, để lần gửi lại được xử lý)"""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'evicted': self.evicted
+            }
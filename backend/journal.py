@@ -0,0 +1,146 @@
+"""
+Zalo OA Finance Workflow - Write-Ahead Log + Snapshot
+Giúp MemoryStorage khởi động lại nhanh mà không mất dữ liệu:
+- mỗi thay đổi được ghi nối vào wal-<n>.log (khung: độ dài + CRC32 + pickle)
+- định kỳ chụp toàn bộ trạng thái vào snapshot-<n>.bin (pickle nén), log cũ bị xóa
+- khi khởi động: nạp snapshot mới nhất rồi phát lại phần log phía sau
+"""
+
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+WAL_PREFIX = 'wal-'
+WAL_SUFFIX = '.log'
+SNAPSHOT_PREFIX = 'snapshot-'
+SNAPSHOT_SUFFIX = '.bin'
+
+_FRAME = struct.Struct('<II')
+
+
+def _numbered(directory, prefix, suffix):
+    """[(n, path)] của các file prefix<n>suffix, tăng dần theo n"""
+    found = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(suffix):
+            try:
+                found.append((int(name[len(prefix):-len(suffix)]), os.path.join(directory, name)))
+            except ValueError:
+                continue
+    return sorted(found)
+
+
+class Journal:
+    """WAL chia theo thế hệ: snapshot-<n> chứa trạng thái sau khi áp dụng mọi wal-<= n"""
+
+    def __init__(self, directory, fsync=False):
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = None
+        self._generation = 0
+        self.bytes_written = 0
+        self.records_written = 0
+
+    def _path(self, prefix, generation, suffix):
+        return os.path.join(self.directory, f'{prefix}{generation:08d}{suffix}')
+
+    def load(self):
+        """
+        Trả về (state, records): state của snapshot mới nhất (None nếu chưa có)
+        và generator các bản ghi (op, args) trong log sau snapshot đó.
+        Gọi một lần trước open().
+        """
+        snapshots = _numbered(self.directory, SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX)
+        state, base = None, 0
+        if snapshots:
+            base, path = snapshots[-1]
+            with open(path, 'rb') as f:
+                state = pickle.loads(zlib.decompress(f.read()))
+        logs = [(n, path) for n, path in _numbered(self.directory, WAL_PREFIX, WAL_SUFFIX) if n > base]
+        self._generation = max([base] + [n for n, _ in logs])
+        return state, self._replay(logs)
+
+    def _replay(self, logs):
+        for _, path in logs:
+            with open(path, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset + _FRAME.size <= len(data):
+                length, crc = _FRAME.unpack_from(data, offset)
+                payload = data[offset + _FRAME.size:offset + _FRAME.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    # Bản ghi cuối bị ghi dở (crash giữa chừng): bỏ phần đuôi
+                    with open(path, 'r+b') as f:
+                        f.truncate(offset)
+                    break
+                yield pickle.loads(payload)
+                offset += _FRAME.size + length
+
+    def open(self):
+        """Mở log thế hệ mới để ghi (sau khi đã phát lại xong)"""
+        with self._lock:
+            self._rotate()
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._generation += 1
+        self._file = open(self._path(WAL_PREFIX, self._generation, WAL_SUFFIX), 'ab')
+        self.bytes_written = 0
+
+    def append(self, op, *args):
+        """Ghi một thay đổi; caller giữ lock của storage để thứ tự log khớp thứ tự áp dụng"""
+        payload = pickle.dumps((op, args), protocol=pickle.HIGHEST_PROTOCOL)
+        frame = _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            self._file.write(frame)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.bytes_written += len(frame)
+            self.records_written += 1
+
+    def cut(self):
+        """
+        Chốt thế hệ hiện tại và chuyển sang log mới; trả về số thế hệ đã chốt.
+        Gọi trong lock của storage, cùng lúc chụp trạng thái.
+        """
+        with self._lock:
+            generation = self._generation
+            self._rotate()
+            return generation
+
+    def write_snapshot(self, generation, payload):
+        """
+        Ghi snapshot (payload = trạng thái đã pickle lúc cut()) cho thế hệ đã chốt,
+        rồi xóa snapshot/log cũ hơn
+        """
+        blob = zlib.compress(payload, 1)
+        path = self._path(SNAPSHOT_PREFIX, generation, SNAPSHOT_SUFFIX)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        for n, old in _numbered(self.directory, SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX):
+            if n < generation:
+                os.remove(old)
+        for n, old in _numbered(self.directory, WAL_PREFIX, WAL_SUFFIX):
+            if n <= generation:
+                os.remove(old)
+        return len(blob)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
@@ -0,0 +1,212 @@
+"""
+Zalo OA Finance Workflow - Compact Message Log
+Lịch sử tin nhắn của một hội thoại lưu dạng cột, chỉ ghi thêm:
+sender/intent là mã số đã intern, timestamp là số nguyên (micro giây từ epoch),
+nội dung nằm liền nhau trong một buffer UTF-8 kèm mảng offset
+"""
+
+import math
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+# Mốc epoch cho timestamp không có múi giờ (datetime.now().isoformat())
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# Giá trị cột timestamp khi tin nhắn không có timestamp dạng ISO
+NO_TIMESTAMP = -(1 << 63)
+
+# Các trường có cột riêng, trường khác nằm trong dict thưa _extras
+_COLUMNS = ('sender', 'text', 'timestamp', 'intent', 'confidence')
+
+
+class Interner:
+    """Chuỗi <-> mã số nguyên, dùng chung cho mọi hội thoại (mã 0 = None)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes = {}
+        self._values = [None]
+
+    def code(self, value):
+        if value is None:
+            return 0
+        code = self._codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(value)
+                if code is None:
+                    code = len(self._values)
+                    self._values.append(value)
+                    self._codes[value] = code
+        return code
+
+    def value(self, code):
+        return self._values[code]
+
+    def values(self):
+        """Bảng mã hiện tại (vị trí = mã), lưu kèm snapshot"""
+        with self._lock:
+            return list(self._values)
+
+    def merge(self, values):
+        """Nạp bảng mã của snapshot; trả về list mã trong snapshot -> mã của tiến trình này"""
+        return [self.code(value) for value in values]
+
+
+SENDERS = Interner()
+INTENTS = Interner()
+
+
+def interned_tables():
+    return SENDERS.values(), INTENTS.values()
+
+
+def load_interned(logs, tables):
+    """
+    Nạp bảng mã (SENDERS, INTENTS) của snapshot trước khi phát lại WAL; mã trong
+    tiến trình này khác snapshot (interner đã có giá trị khác) thì đổi mã của logs
+    """
+    sender_codes, intent_codes = SENDERS.merge(tables[0]), INTENTS.merge(tables[1])
+    if sender_codes == list(range(len(sender_codes))) and intent_codes == list(range(len(intent_codes))):
+        return
+    for log in logs:
+        log.remap(sender_codes, intent_codes)
+
+
+def encode_timestamp(timestamp):
+    """ISO (không múi giờ) -> micro giây từ epoch, None nếu không chuyển được"""
+    try:
+        moment = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is not None:
+        return None
+    return (moment - EPOCH) // MICROSECOND
+
+
+def decode_timestamp(micros):
+    return (EPOCH + micros * MICROSECOND).isoformat()
+
+
+class MessageLog:
+    """Tin nhắn của một hội thoại; chỉ số (seq) của tin nhắn là vị trí trong log"""
+
+    def __init__(self, messages=()):
+        self._senders = array('H')
+        self._intents = array('H')
+        self._timestamps = array('q')
+        self._confidences = array('d')
+        self._ends = array('Q')
+        self._text = bytearray()
+        # seq -> các trường không có cột riêng (hoặc timestamp không chuẩn)
+        self._extras = {}
+        self.extend(messages)
+
+    def append(self, message):
+        seq = len(self._ends)
+        extras = {k: v for k, v in message.items() if k not in _COLUMNS}
+
+        timestamp = message.get('timestamp')
+        micros = encode_timestamp(timestamp)
+        if micros is None:
+            micros = NO_TIMESTAMP
+            if timestamp is not None:
+                extras['timestamp'] = timestamp
+
+        intent = message.get('intent')
+        if intent is not None and not isinstance(intent, str):
+            extras['intent'] = intent
+            intent = None
+        confidence = message.get('confidence')
+        if confidence is not None and not isinstance(confidence, (int, float)):
+            extras['confidence'] = confidence
+            confidence = None
+
+        self._senders.append(SENDERS.code(message.get('sender')))
+        self._intents.append(INTENTS.code(intent))
+        self._timestamps.append(micros)
+        self._confidences.append(math.nan if confidence is None else confidence)
+        self._text.extend(str(message.get('text') or '').encode('utf-8'))
+        self._ends.append(len(self._text))
+        if extras:
+            self._extras[seq] = extras
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def remap(self, sender_codes, intent_codes):
+        """Đổi mã sender/intent theo bảng mã cũ -> mã mới"""
+        self._senders = array('H', [sender_codes[code] for code in self._senders])
+        self._intents = array('H', [intent_codes[code] for code in self._intents])
+
+    def __len__(self):
+        return len(self._ends)
+
+    def message(self, seq):
+        start = self._ends[seq - 1] if seq else 0
+        message = {
+            'seq': seq,
+            'sender': SENDERS.value(self._senders[seq]),
+            'text': self._text[start:self._ends[seq]].decode('utf-8')
+        }
+        if self._timestamps[seq] != NO_TIMESTAMP:
+            message['timestamp'] = decode_timestamp(self._timestamps[seq])
+        intent = self._intents[seq]
+        if intent:
+            message['intent'] = INTENTS.value(intent)
+        confidence = self._confidences[seq]
+        if not math.isnan(confidence):
+            message['confidence'] = confidence
+        message.update(self._extras.get(seq, ()))
+        return message
+
+    def page(self, before=None, limit=50):
+        """
+        `limit` tin nhắn mới nhất có seq < before (cũ -> mới).
+        Trả về (messages, next_before) - next_before là None khi hết lịch sử.
+        """
+        end = len(self) if before is None else max(min(before, len(self)), 0)
+        start = max(end - limit, 0)
+        messages = [self.message(seq) for seq in range(start, end)]
+        return messages, (start if start > 0 else None)
+
+    def dump(self):
+        """Toàn bộ tin nhắn dạng dict (không kèm seq), để lưu trữ/khôi phục"""
+        messages = [self.message(seq) for seq in range(len(self))]
+        for message in messages:
+            del message['seq']
+        return messages
+
+    def nbytes(self):
+        """Bộ nhớ của các cột và buffer (không tính _extras)"""
+        columns = (self._senders, self._intents, self._timestamps, self._confidences, self._ends)
+        return sum(column.itemsize * len(column) for column in columns) + len(self._text)
+
+
+# Độ dài tối đa của last_message trong tóm tắt hội thoại
+PREVIEW_LENGTH = 120
+
+
+def update_summary(conversation, messages):
+    """
+    Cập nhật tóm tắt hội thoại (inbox) theo các tin nhắn vừa ghi thêm:
+    tin của khách tăng unread_count, tin của nhân viên (agent) coi như đã đọc
+    và kết thúc trạng thái chờ chuyển nhân viên
+    """
+    for message in messages:
+        sender = message.get('sender')
+        conversation['message_count'] = conversation.get('message_count', 0) + 1
+        conversation['last_message'] = str(message.get('text') or '')[:PREVIEW_LENGTH]
+        conversation['last_sender'] = sender
+        if message.get('timestamp'):
+            conversation['last_message_at'] = message['timestamp']
+        if sender == 'user':
+            conversation['unread_count'] = conversation.get('unread_count', 0) + 1
+        elif sender == 'agent':
+            conversation['unread_count'] = 0
+            conversation['transfer_to_agent'] = False
+        if message.get('action') == 'transfer_to_agent':
+            conversation['transfer_to_agent'] = True
+    return conversation
@@ -0,0 +1,59 @@
+"""
+Zalo OA Finance Workflow - Metrics
+Histogram độ trễ với bucket cố định: ghi nhận O(1), bộ nhớ không đổi theo lưu lượng,
+percentile ước lượng theo cận trên của bucket
+"""
+
+import threading
+from bisect import bisect_left
+
+# Cận trên của các bucket (ms)
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram:
+    """Đếm số lần đo theo bucket độ trễ, kèm tổng/max để tính trung bình"""
+
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        # Bucket cuối (+Inf) cho giá trị vượt cận trên lớn nhất
+        self._counts = [0] * (len(self.buckets_ms) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            self._counts[bisect_left(self.buckets_ms, ms)] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def _percentile(self, fraction):
+        # Gọi trong lock
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return float(self.buckets_ms[i]) if i < len(self.buckets_ms) else round(self.max_ms, 1)
+        return round(self.max_ms, 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'avg_ms': round(self.total_ms / self.count, 1) if self.count else 0.0,
+                'max_ms': round(self.max_ms, 1),
+                'p50_ms': self._percentile(0.5),
+                'p95_ms': self._percentile(0.95),
+                'p99_ms': self._percentile(0.99),
+                'buckets': {
+                    (f'le_{bound}' if i < len(self.buckets_ms) else 'inf'): count
+                    for i, (bound, count) in enumerate(zip(self.buckets_ms + (None,), self._counts))
+                }
+            }
@@ -0,0 +1,274 @@
+"""
+Zalo OA Finance Workflow - Notifications
+Mẫu thông báo được biên dịch một lần khi khởi động thành chuỗi %-format: render cho
+từng người nhận là một phép % (viết bằng C), không phân tích lại mẫu mỗi lần gửi.
+Gửi hàng loạt: nội dung được render theo dữ liệu lead của từng người nhận rồi đẩy vào
+hàng đợi + worker pool riêng của từng kênh (zalo_oa, email); tiến độ mỗi đợt gửi
+ghi vào notification_batches.
+"""
+
+import threading
+from string import Formatter
+from datetime import datetime
+
+from ingest import WebhookQueue, QueueFull
+from storage import decode_cursor
+
+TEMPLATES = {
+    'chao_mung': {
+        'name': 'Chào mừng khách hàng',
+        'content': 'Chào {ten_khach_hang}, cảm ơn bạn đã quan tâm đến {ten_doanh_nghiep}! Chúng tôi luôn sẵn sàng hỗ trợ bạn.',
+        'channels': ['zalo_oa', 'email']
+    },
+    'xac_nhan_yeu_cau': {
+        'name': 'Xác nhận nhận yêu cầu',
+        'content': 'Cảm ơn bạn đã liên hệ với {ten_doanh_nghiep}. Chúng tôi đã nhận được yêu cầu và sẽ phản hồi sớm nhất.',
+        'channels': ['zalo_oa', 'email']
+    },
+    'nhac_bo_sung': {
+        'name': 'Nhắc bổ sung hồ sơ',
+        'content': 'Bạn vui lòng bổ sung {tai_lieu} để hoàn tất hồ sơ. Nếu cần hỗ trợ, liên hệ {so_dien_thoai}.',
+        'channels': ['zalo_oa', 'email']
+    },
+    'phe_duyet': {
+        'name': 'Thông báo phê duyệt',
+        'content': 'Hồ sơ của bạn đã được phê duyệt. Vui lòng kiểm tra email để nhận hợp đồng/phiếu xác nhận.',
+        'channels': ['zalo_oa', 'email']
+    },
+    'nhac_lich_hen': {
+        'name': 'Nhắc lịch hẹn',
+        'content': 'Bạn có lịch hẹn với {ten_doanh_nghiep} vào {ngay_gio}. Vui lòng đến đúng giờ để được phục vụ tốt nhất.',
+        'channels': ['zalo_oa', 'email']
+    },
+    'nhac_thanh_toan': {
+        'name': 'Nhắc thanh toán',
+        'content': 'Hóa đơn {ma_hoa_don} của bạn sẽ đến hạn vào {ngay}. Vui lòng thanh toán để tránh gián đoạn dịch vụ.',
+        'channels': ['zalo_oa', 'email']
+    }
+}
+
+CHANNELS = ('zalo_oa', 'email')
+
+# Ghi tiến độ đợt gửi xuống storage sau mỗi chừng này người nhận
+PROGRESS_EVERY = 500
+
+
+class CompiledTemplate:
+    """Mẫu đã biên dịch: các biến cần có + chuỗi %-format tương đương"""
+
+    __slots__ = ('id', 'name', 'content', 'channels', 'fields', '_format')
+
+    def __init__(self, template_id, spec):
+        self.id = template_id
+        self.name = spec['name']
+        self.content = spec['content']
+        self.channels = tuple(spec['channels'])
+        parts, fields = [], []
+        for literal, field, format_spec, conversion in Formatter().parse(self.content):
+            parts.append(literal.replace('%', '%%'))
+            if field is None:
+                continue
+            if not field.isidentifier() or format_spec or conversion:
+                raise ValueError(f'Biến không hợp lệ trong mẫu {template_id}: {{{field}}}')
+            parts.append(f'%({field})s')
+            if field not in fields:
+                fields.append(field)
+        self.fields = tuple(fields)
+        self._format = ''.join(parts)
+
+    def render(self, variables):
+        """Nội dung cho một người nhận; ValueError nếu thiếu biến"""
+        try:
+            return self._format % variables
+        except KeyError as e:
+            raise ValueError(f'Thiếu biến {e.args[0]}') from None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'content': self.content,
+            'channels': list(self.channels),
+            'variables': list(self.fields)
+        }
+
+
+def compile_templates(templates=TEMPLATES):
+    return {template_id: CompiledTemplate(template_id, spec) for template_id, spec in templates.items()}
+
+
+def lead_variables(lead):
+    """Biến mẫu lấy từ dữ liệu lead"""
+    return {
+        'ten_khach_hang': lead.get('name') or 'Quý khách',
+        'ma_ho_so': lead['id'],
+        'san_pham': lead.get('product_interest', '')
+    }
+
+
+def recipient_address(channel, lead):
+    """Địa chỉ nhận của lead trên kênh: Zalo user_id hoặc email"""
+    return lead.get('email') if channel == 'email' else lead.get('zalo_user_id')
+
+
+def matching_leads(db, filters, page_size=500):
+    """Duyệt mọi lead khớp filters (theo index) từng trang, không nạp cả collection"""
+    after = None
+    while True:
+        leads, cursor = db.page('leads', page_size, after=after, filters=filters)
+        yield from leads
+        if not cursor:
+            return
+        after = decode_cursor(cursor)
+
+
+def bulk_targets(db, recipients=None, lead_filters=None):
+    """
+    (lead hoặc None, thông tin người nhận) cho từng người nhận của đợt gửi.
+    recipients: list lead_id hoặc {'lead_id', 'recipient_id', 'variables'};
+    không có recipients thì lấy các lead khớp lead_filters.
+    """
+    if recipients is None:
+        for lead in matching_leads(db, lead_filters or {}):
+            yield lead, {}
+        return
+    for entry in recipients:
+        if isinstance(entry, str):
+            entry = {'lead_id': entry}
+        if (not isinstance(entry, dict) or not isinstance(entry.get('variables', {}), dict)
+                or not isinstance(entry.get('lead_id', ''), str)):
+            raise ValueError(f'Người nhận không hợp lệ: {entry}')
+        lead = db.get('leads', entry['lead_id']) if entry.get('lead_id') else None
+        yield lead, entry
+
+
+def render_jobs(template, channel, targets, variables, limit):
+    """
+    Render nội dung cho từng người nhận. Trả về (jobs, skipped): người nhận thiếu
+    địa chỉ hoặc thiếu biến bị bỏ qua kèm lý do; ValueError nếu vượt quá `limit`.
+    """
+    jobs, skipped = [], []
+    for lead, entry in targets:
+        if len(jobs) + len(skipped) >= limit:
+            raise ValueError(f'Tối đa {limit} người nhận mỗi lần gửi')
+        lead_id = entry.get('lead_id') or (lead['id'] if lead else None)
+        if entry.get('lead_id') and lead is None:
+            skipped.append({'lead_id': lead_id, 'error': 'Lead không tồn tại'})
+            continue
+        address = entry.get('recipient_id') or (recipient_address(channel, lead) if lead else None)
+        if not address:
+            missing = 'email' if channel == 'email' else 'Zalo user_id'
+            skipped.append({'lead_id': lead_id, 'error': f'Thiếu {missing} người nhận'})
+            continue
+        values = dict(variables)
+        if lead is not None:
+            values.update(lead_variables(lead))
+        values.update(entry.get('variables') or {})
+        try:
+            content = template.render(values)
+        except ValueError as e:
+            skipped.append({'lead_id': lead_id, 'recipient_id': address, 'error': str(e)})
+            continue
+        jobs.append({'lead_id': lead_id, 'recipient_id': address, 'content': content})
+    return jobs, skipped
+
+
+class NotificationDispatcher:
+    """
+    Một hàng đợi + worker pool cho mỗi kênh. senders[channel](address, subject, text)
+    gửi một thông báo (trả về dict, có thể kèm message_id) hoặc raise nếu thất bại.
+    """
+
+    def __init__(self, db, senders, workers=8, queue_size=200000):
+        self.db = db
+        self.senders = senders
+        self.queues = {
+            channel: WebhookQueue(self._deliver, max_size=queue_size, workers=workers,
+                                  name=f'notify-{channel}')
+            for channel in senders
+        }
+        # Đợt gửi đang chạy: batch_id -> record (bộ đếm cập nhật trong RAM)
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        for queue in self.queues.values():
+            queue.start()
+        return self
+
+    def submit(self, batch, jobs):
+        """Lưu đợt gửi và đưa cả đợt vào hàng đợi của kênh; QueueFull nếu không đủ chỗ"""
+        batch = dict(batch, total=len(jobs), sent_count=0, failed_count=0, status='sending')
+        with self._lock:
+            self._batches[batch['id']] = batch
+            self.db.put('notification_batches', batch['id'], dict(batch))
+        try:
+            self.queues[batch['channel']].submit_many([
+                dict(job, batch_id=batch['id'], index=i) for i, job in enumerate(jobs)
+            ])
+        except QueueFull:
+            with self._lock:
+                del self._batches[batch['id']]
+                self.db.delete('notification_batches', batch['id'])
+            raise
+        return dict(batch)
+
+    def _deliver(self, job):
+        with self._lock:
+            batch = self._batches[job['batch_id']]
+        notification = {
+            'id': f"{batch['id']}-{job['index']}",
+            'batch_id': batch['id'],
+            'template': batch['template'],
+            'lead_id': job['lead_id'],
+            'recipient_id': job['recipient_id'],
+            'channel': batch['channel'],
+            'content': job['content'],
+            'status': 'sent',
+            'sent_at': datetime.now().isoformat(),
+            'sent_by': batch['created_by']
+        }
+        try:
+            result = self.senders[batch['channel']](job['recipient_id'], batch['subject'], job['content'])
+            if result.get('message_id'):
+                notification['message_id'] = result['message_id']
+        except Exception as e:
+            # Lỗi riêng của từng kênh (ZaloAPIError, EmailError, ...) sau khi client đã thử lại
+            notification['status'] = 'failed'
+            notification['error'] = str(e)
+        self.db.put('notifications', notification['id'], notification)
+        self._progress(batch['id'], notification['status'] == 'sent')
+
+    def _progress(self, batch_id, ok):
+        with self._lock:
+            batch = self._batches[batch_id]
+            batch['sent_count' if ok else 'failed_count'] += 1
+            done = batch['sent_count'] + batch['failed_count']
+            if done == batch['total']:
+                if batch['failed_count'] == 0:
+                    batch['status'] = 'sent'
+                elif batch['sent_count'] == 0:
+                    batch['status'] = 'failed'
+                else:
+                    batch['status'] = 'partial'
+                batch['finished_at'] = datetime.now().isoformat()
+                del self._batches[batch_id]
+            elif done % PROGRESS_EVERY:
+                return
+            # Ghi trong lock để bản tiến độ cũ không đè lên bản mới hơn
+            self.db.put('notification_batches', batch_id, dict(batch))
+
+    def get(self, batch_id):
+        """Đợt gửi kèm bộ đếm mới nhất (đang chạy thì lấy từ RAM)"""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is not None:
+                return dict(batch)
+        return self.db.get('notification_batches', batch_id)
+
+    def stats(self):
+        with self._lock:
+            active = len(self._batches)
+        return {
+            'active_batches': active,
+            'channels': {channel: queue.stats() for channel, queue in self.queues.items()}
+        }
@@ -0,0 +1,306 @@
+"""
+Zalo OA Finance Workflow - OCR Jobs
+OCR chạy như job nền: API chỉ tạo job (ocr_jobs) và trả job id ngay. Mỗi worker
+thread của hàng đợi giữ một slot của process pool: đánh dấu hồ sơ 'processing',
+chờ tiến trình con nhận dạng xong rồi ghi kết quả và chuyển hồ sơ sang 'verified'.
+Nhận dạng ảnh nặng CPU nên chạy trong tiến trình riêng (không bị GIL giới hạn),
+số tiến trình mặc định bằng số core. Trước khi nhận dạng, ảnh hồ sơ được tiền xử lý
+(preprocess.py) ngay trong tiến trình con. Pool được fork sẵn (start_pool) trước khi
+server chạy thread nào khác.
+"""
+
+import os
+import re
+import time
+import uuid
+import hashlib
+import threading
+import weakref
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ingest import WebhookQueue, QueueFull
+from metrics import LatencyHistogram
+from preprocess import preprocess, load_image
+
+# demo: kết quả giả lập (mặc định) | tesseract: pytesseract + tesseract-ocr (cài thêm)
+ENGINES = ('demo', 'tesseract')
+# Job dở dang lúc restart được đưa lại vào hàng đợi
+PENDING_STATUSES = ('queued', 'running')
+
+# Trích trường từ văn bản OCR của CCCD / giấy chứng nhận đăng ký doanh nghiệp
+FIELD_PATTERNS = {
+    'cccd': {
+        'so_cccd': r'(?:Số|No)[^0-9\n]{0,20}(\d{12})',
+        'ho_ten': r'(?:Họ và tên|Full name)[^:\n]*:?\s*([^\n]+)',
+        'ngay_sinh': r'(?:Ngày sinh|Date of birth)[^0-9\n]*(\d{2}/\d{2}/\d{4})',
+        'gioi_tinh': r'(?:Giới tính|Sex)[^:\n]*:?\s*(Nam|Nữ)',
+        'dia_chi': r'(?:Nơi thường trú|Place of residence)[^:\n]*:?\s*([^\n]+)'
+    },
+    'dkkd': {
+        'ten_doanh_nghiep': r'Tên công ty viết bằng tiếng Việt[^:\n]*:?\s*([^\n]+)',
+        'mst': r'Mã số doanh nghiệp[^0-9\n]*(\d{10}(?:-\d{3})?)',
+        'dia_chi': r'Địa chỉ trụ sở chính[^:\n]*:?\s*([^\n]+)',
+        'nguoi_dai_dien': r'Họ và tên[^:\n]*:?\s*([^\n]+)',
+        'ngay_cap': r'Đăng ký lần đầu[^0-9\n]*(\d{2}/\d{2}/\d{4})'
+    }
+}
+
+
+def parse_fields(text, patterns):
+    fields = {}
+    for field, pattern in patterns.items():
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            fields[field] = match.group(1).strip()
+    return fields
+
+
+def _burn_cpu(work_ms):
+    # Giả lập chi phí CPU của engine thật (đo hiệu năng pool)
+    deadline = time.process_time() + work_ms / 1000
+    digest = b''
+    while time.process_time() < deadline:
+        digest = hashlib.sha256(digest).digest()
+
+
+def demo_extract(document, work_ms=0):
+    """Kết quả giả lập, cố định theo id hồ sơ"""
+    if work_ms:
+        _burn_cpu(work_ms)
+    seed = int(hashlib.sha256(document['id'].encode()).hexdigest(), 16)
+    if document['type'] == 'cccd':
+        return {
+            'ho_ten': 'NGUYỄN VĂN DEMO',
+            'so_cccd': f'001{seed % 10 ** 9:09d}',
+            'ngay_sinh': '15/06/1985',
+            'gioi_tinh': 'Nam',
+            'dia_chi': '456 Đường Demo, Quận Test, TP.HCM',
+            'ngay_cap': '01/01/2020',
+            'noi_cap': 'Cục QLHC về TTXH'
+        }
+    if document['type'] == 'dkkd':
+        return {
+            'ten_doanh_nghiep': 'CÔNG TY TNHH DEMO',
+            'mst': f'0312{seed % 10 ** 6:06d}',
+            'dia_chi': '789 Đường Test, Quận ABC, TP.HCM',
+            'nguoi_dai_dien': 'NGUYỄN VĂN DEMO',
+            'ngay_cap': '01/01/2022'
+        }
+    return {}
+
+
+def tesseract_extract(document, image=None, lang='vie'):
+    try:
+        import pytesseract
+    except ImportError:
+        raise RuntimeError('OCR_ENGINE=tesseract cần cài pytesseract và tesseract-ocr')
+    if image is None and not document.get('file_path'):
+        raise ValueError('Hồ sơ chưa có file')
+    # Ưu tiên ảnh đã tiền xử lý (nhỏ, đã chỉnh nghiêng và nhị phân hóa)
+    text = pytesseract.image_to_string(image if image is not None else document['file_path'], lang=lang)
+    fields = parse_fields(text, FIELD_PATTERNS.get(document['type'], {}))
+    fields['raw_text'] = text
+    return fields
+
+
+def run_ocr(engine, document, options, preprocess_options=None):
+    """
+    Chạy trong tiến trình con của pool: tiền xử lý ảnh của hồ sơ (nếu có file và
+    preprocess_options khác None) rồi nhận dạng; trả về {'fields', 'preprocess'}
+    """
+    image = info = None
+    if preprocess_options is not None and document.get('file_path'):
+        try:
+            image, info = preprocess(load_image(document['file_path']), **preprocess_options)
+        except (ValueError, TypeError, OSError) as e:
+            # Định dạng không đọc được (PDF, ảnh hỏng, mảng .npy sai dạng): nhận dạng trên file gốc
+            info = {'skipped': str(e)}
+    if engine == 'tesseract':
+        fields = tesseract_extract(document, image, **options)
+    else:
+        fields = demo_extract(document, **options)
+    return {'fields': fields, 'preprocess': info}
+
+
+def start_pool(workers):
+    """
+    Process pool OCR đã fork đủ `workers` tiến trình con. Gọi trước khi khởi động các
+    thread khác: fork lúc thread khác đang giữ lock thì lock đó kẹt mãi trong tiến trình con
+    """
+    # fork: tiến trình con không import lại app.py (spawn/forkserver chạy lại toàn bộ khởi tạo server)
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+    # Job đầu tiên fork tất cả tiến trình con, trước cả thread quản lý của pool
+    pool.submit(int).result()
+    return pool
+
+
+class OCRService:
+    """
+    Hàng đợi job OCR có giới hạn + process pool (pool: kết quả start_pool(), None thì tạo
+    khi start). on_document_change(before, after) sau mỗi lần đổi trạng thái hồ sơ,
+    on_done(job, document) khi job kết thúc.
+    """
+
+    def __init__(self, db, engine='demo', workers=None, queue_size=1000, timeout=120.0,
+                 options=None, preprocess_options=None, on_document_change=None, on_done=None,
+                 pool=None):
+        if engine not in ENGINES:
+            raise ValueError(f'OCR engine không hợp lệ: {engine}')
+        self.db = db
+        self.engine = engine
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.options = options or {}
+        # None = không tiền xử lý ảnh trước khi OCR
+        self.preprocess_options = preprocess_options
+        self.on_document_change = on_document_change
+        self.on_done = on_done
+        # Một worker thread cho mỗi tiến trình: thread chờ kết quả, tiến trình làm OCR
+        self.queue = WebhookQueue(self._process, max_size=queue_size, workers=self.workers, name='ocr')
+        self.latency = LatencyHistogram()
+        self._pool = pool
+        # Pool bị dừng vì job quá hạn: job khác đang chạy trên pool đó được chạy lại
+        self._terminated = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._document_lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # Chỉ xảy ra sau khi pool cũ hỏng/bị dừng: lúc này buộc phải fork khi các thread
+                # khác đang chạy, tiến trình con chỉ chạy run_ocr nên không đụng tới lock của server
+                self._pool = start_pool(self.workers)
+            return self._pool
+
+    def _discard_pool(self, pool, terminate=False):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+            if terminate:
+                self._terminated.add(pool)
+        if terminate:
+            # shutdown() không dừng được tiến trình con đang chạy: kill để pool mới không chạy chồng
+            for process in list((pool._processes or {}).values()):
+                process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        self._executor()
+        self.queue.start()
+        for status in PENDING_STATUSES:
+            for job in self.db.find('ocr_jobs', 'status', status):
+                try:
+                    self.queue.submit(job['id'])
+                except QueueFull:
+                    break
+        return self
+
+    def submit(self, document, created_by):
+        """Tạo job OCR cho hồ sơ và đưa vào hàng đợi; QueueFull nếu hàng đợi đầy"""
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'document_id': document['id'],
+            'engine': self.engine,
+            'status': 'queued',
+            'created_at': datetime.now().isoformat(),
+            'created_by': created_by
+        }
+        self.db.put('ocr_jobs', job['id'], job)
+        # Cập nhật hồ sơ trước khi vào hàng đợi để không đè trạng thái 'processing' của worker
+        self._update_document(document['id'], status='pending', ocr_job_id=job['id'])
+        try:
+            self.queue.submit(job['id'])
+        except QueueFull:
+            self._update_document(document['id'], status=document['status'], ocr_job_id=document.get('ocr_job_id'))
+            self.db.delete('ocr_jobs', job['id'])
+            raise
+        return job
+
+    def _update_document(self, document_id, **changes):
+        # Đọc-sửa-ghi trong lock: job xong và job mới cho cùng hồ sơ không ghi đè lẫn nhau
+        with self._document_lock:
+            previous = self.db.get('documents', document_id)
+            if previous is None:
+                return None
+            document = dict(previous, **changes)
+            self.db.put('documents', document_id, document)
+            if self.on_document_change is not None:
+                self.on_document_change(previous, document)
+        return document
+
+    def _process(self, job_id):
+        job = self.db.get('ocr_jobs', job_id)
+        if job is None or job['status'] not in PENDING_STATUSES:
+            return
+        job = dict(job, status='running', started_at=datetime.now().isoformat())
+        self.db.put('ocr_jobs', job_id, job)
+        document = self._update_document(job['document_id'], status='processing')
+        if document is None:
+            self._finish(job, None, 'Hồ sơ không tồn tại')
+            return
+
+        started = time.perf_counter()
+        try:
+            result, error = self._run(document)
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+        self._finish(job, result, error)
+
+    def _run(self, document):
+        """(kết quả, None) hoặc (None, lỗi)"""
+        while True:
+            pool = self._executor()
+            try:
+                result = pool.submit(
+                    run_ocr, self.engine, document, self.options, self.preprocess_options
+                ).result(timeout=self.timeout)
+                return result, None
+            except BrokenProcessPool:
+                # Pool bị dừng vì job khác quá hạn: chạy lại job này trên pool mới
+                if pool in self._terminated:
+                    continue
+                # Tiến trình con chết (hết bộ nhớ, engine crash): tạo pool mới cho job sau
+                self._discard_pool(pool)
+                return None, 'Tiến trình OCR dừng đột ngột'
+            except TimeoutError:
+                # Tiến trình con vẫn chạy sau timeout: dừng cả pool, job sau chạy trên pool mới
+                self._discard_pool(pool, terminate=True)
+                return None, f'OCR quá {self.timeout:g} giây'
+            except Exception as e:
+                return None, str(e)
+
+    def _finish(self, job, result, error):
+        job = dict(job, status='failed' if error else 'done', finished_at=datetime.now().isoformat())
+        if error:
+            job['error'] = error
+            document = self._update_document(job['document_id'], status='pending', ocr_error=error)
+        else:
+            job['result'] = result['fields']
+            job['preprocess'] = result['preprocess']
+            document = self._update_document(
+                job['document_id'], status='verified', ocr_data=result['fields'], ocr_error=None
+            )
+        self.db.put('ocr_jobs', job['id'], job)
+        with self._lock:
+            if error:
+                self.failed += 1
+            else:
+                self.completed += 1
+        if self.on_done is not None:
+            self.on_done(job, document)
+
+    def stats(self):
+        with self._lock:
+            counters = {'completed': self.completed, 'failed': self.failed}
+        return dict(
+            counters,
+            engine=self.engine,
+            workers=self.workers,
+            queue=self.queue.stats(),
+            latency=self.latency.stats()
+        )
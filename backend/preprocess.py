@@ -0,0 +1,252 @@
+"""
+Zalo OA Finance Workflow - Document Image Preprocessing
+Làm sạch ảnh CCCD / giấy phép trước khi OCR, toàn bộ bằng phép toán mảng NumPy:
+thu nhỏ (trung bình khối) -> xám -> chỉnh nghiêng (chiếu profile các điểm biên
+theo nhiều góc) -> cắt theo thẻ -> nhị phân hóa (Otsu). Ảnh cùng kích thước được
+xếp thành một mảng (B, H, W) và xử lý cùng lúc - chỉ có lợi khi xử lý hàng loạt
+ngoài server (scripts/bench_preprocess.py); job OCR xử lý từng ảnh trong tiến trình riêng.
+"""
+
+import os
+
+import numpy as np
+
+# Hệ số xám ITU-R BT.601
+GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+# Cạnh dài tối đa sau khi thu nhỏ (px)
+MAX_SIDE = 1200
+# Dải góc nghiêng dò tìm (độ) và bước
+SKEW_RANGE = 10.0
+SKEW_STEP = 0.5
+# Số điểm biên tối đa dùng để ước lượng góc
+SKEW_SAMPLES = 20000
+# Chỉ xoay khi lệch ít nhất chừng này độ
+MIN_ROTATION = 0.25
+# Chữ ký đầu file của ảnh đọc qua Pillow (cài thêm): JPEG, PNG, BMP, TIFF, WebP (RIFF)
+IMAGE_MAGIC = (b'\xff\xd8\xff', b'\x89PNG', b'BM', b'II*\x00', b'MM\x00*', b'RIFF')
+
+
+def to_uint8(image):
+    """
+    Ảnh (H, W) hoặc (H, W, C) kiểu số bất kỳ -> uint8 0-255: float trong [0, 1] được
+    nhân 255, số nguyên nhiều byte (ảnh 16 bit) được co về 8 bit
+    """
+    if image.ndim not in (2, 3) or (image.ndim == 3 and image.shape[2] not in (3, 4)):
+        raise ValueError(f'Ảnh phải có dạng (H, W) hoặc (H, W, 3/4), nhận {image.shape}')
+    if image.dtype == np.uint8:
+        return image
+    if image.dtype.kind not in 'biuf':
+        raise ValueError(f'Không xử lý được ảnh kiểu {image.dtype}')
+    values = np.nan_to_num(image.astype(np.float32))
+    if image.dtype.kind == 'b' or (image.dtype.kind == 'f' and values.size and values.max() <= 1.0):
+        values *= 255
+    elif image.dtype.kind in 'iu' and image.dtype.itemsize > 1 and values.size and values.max() > 255:
+        values *= 255 / np.iinfo(image.dtype).max
+    return np.clip(np.rint(values), 0, 255).astype(np.uint8)
+
+
+def downscale(batch, max_side=MAX_SIDE):
+    """(B, H, W[, C]) uint8 -> thu nhỏ theo hệ số nguyên bằng trung bình khối; trả về (ảnh, hệ số)"""
+    h, w = batch.shape[1:3]
+    factor = int(np.ceil(max(h, w) / max_side))
+    if factor <= 1:
+        return batch.astype(np.float32), 1
+    h2, w2 = h // factor, w // factor
+    # Cộng factor^2 lát cắt bước nhảy (mỗi lát một phép cộng mảng liên tục) thay vì
+    # reshape + mean trên trục không liên tục - nhanh hơn ~6 lần với ảnh uint8
+    total = np.zeros((batch.shape[0], h2, w2) + batch.shape[3:],
+                     dtype=np.uint16 if factor <= 16 else np.uint32)
+    for dy in range(factor):
+        for dx in range(factor):
+            total += batch[:, dy:h2 * factor:factor, dx:w2 * factor:factor]
+    return total.astype(np.float32) / (factor * factor), factor
+
+
+def grayscale(batch):
+    """(B, H, W, C) -> (B, H, W); ảnh đã xám thì giữ nguyên"""
+    if batch.ndim == 3:
+        return batch.astype(np.float32, copy=False)
+    return batch[..., :3] @ GRAY_WEIGHTS
+
+
+def otsu_thresholds(batch):
+    """Ngưỡng Otsu cho từng ảnh (B, H, W), một lần bincount cho cả lô"""
+    b = batch.shape[0]
+    levels = np.clip(batch, 0, 255).astype(np.int64).reshape(b, -1)
+    hist = np.bincount((levels + np.arange(b)[:, None] * 256).ravel(), minlength=b * 256)
+    hist = hist.reshape(b, 256) / levels.shape[1]
+    omega = np.cumsum(hist, axis=1)
+    mu = np.cumsum(hist * np.arange(256), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mu[:, -1:] * omega - mu) ** 2 / (omega * (1 - omega))
+    return np.nan_to_num(between).argmax(axis=1)
+
+
+def estimate_skew(gray, max_angle=SKEW_RANGE, step=SKEW_STEP):
+    """
+    Góc nghiêng (độ) của một ảnh xám: lấy các điểm biên ngang (mép thẻ, dòng chữ),
+    chiếu lên trục y ở mọi góc thử cùng lúc; góc đúng cho histogram nhọn nhất
+    """
+    edges = np.abs(np.diff(gray, axis=0))
+    threshold = max(edges.mean() + 2 * edges.std(), 1.0)
+    ys, xs = np.nonzero(edges > threshold)
+    if len(ys) < 50:
+        return 0.0
+    if len(ys) > SKEW_SAMPLES:
+        pick = np.linspace(0, len(ys) - 1, SKEW_SAMPLES).astype(np.int64)
+        ys, xs = ys[pick], xs[pick]
+    angles = np.deg2rad(np.arange(-max_angle, max_angle + step / 2, step))
+    # (A, N): toạ độ y của mọi điểm sau khi xoay ngược từng góc
+    projected = ys[None, :] * np.cos(angles)[:, None] - xs[None, :] * np.sin(angles)[:, None]
+    bins = np.rint(projected - projected.min()).astype(np.int64)
+    width = int(bins.max()) + 1
+    hist = np.bincount((bins + np.arange(len(angles))[:, None] * width).ravel(), minlength=len(angles) * width)
+    sharpness = (hist.reshape(len(angles), width).astype(np.float64) ** 2).sum(axis=1)
+    return float(np.rad2deg(angles[sharpness.argmax()]))
+
+
+def rotate(gray, degrees, fill):
+    """Xoay quanh tâm (nearest neighbour, ánh xạ ngược), giữ nguyên kích thước"""
+    h, w = gray.shape
+    theta = np.deg2rad(degrees)
+    cy, cx = (h - 1) / 2, (w - 1) / 2
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    y -= cy
+    x -= cx
+    cos, sin = np.float32(np.cos(theta)), np.float32(np.sin(theta))
+    src_y = np.rint(y * cos - x * sin + cy).astype(np.int64)
+    src_x = np.rint(y * sin + x * cos + cx).astype(np.int64)
+    inside = (src_y >= 0) & (src_y < h) & (src_x >= 0) & (src_x < w)
+    out = np.full_like(gray, fill)
+    out[inside] = gray[src_y[inside], src_x[inside]]
+    return out
+
+
+def card_bounds(gray, threshold):
+    """
+    (top, bottom, left, right) của thẻ sáng trên nền tối: các hàng/cột có tỉ lệ điểm
+    sáng >= nửa mức cao nhất; không tách được nền thì giữ cả ảnh
+    """
+    h, w = gray.shape
+    bright = gray > threshold
+    rows, cols = bright.mean(axis=1), bright.mean(axis=0)
+    row_idx = np.nonzero(rows >= rows.max() / 2)[0]
+    col_idx = np.nonzero(cols >= cols.max() / 2)[0]
+    if not len(row_idx) or not len(col_idx):
+        return 0, h, 0, w
+    top, bottom, left, right = row_idx[0], row_idx[-1] + 1, col_idx[0], col_idx[-1] + 1
+    if (bottom - top) * (right - left) < 0.2 * h * w:
+        return 0, h, 0, w
+    return int(top), int(bottom), int(left), int(right)
+
+
+def binarize(gray):
+    """Nhị phân hóa Otsu: chữ 0, nền 255 (uint8)"""
+    threshold = otsu_thresholds(gray[None])[0]
+    return np.where(gray > threshold, 255, 0).astype(np.uint8), int(threshold)
+
+
+def _preprocess_group(batch, max_side):
+    small, factor = downscale(batch, max_side)
+    gray = grayscale(small)
+    card_thresholds = otsu_thresholds(gray)
+    results = []
+    for image, card_threshold in zip(gray, card_thresholds):
+        skew = estimate_skew(image)
+        if abs(skew) >= MIN_ROTATION:
+            # Nền ngoài ảnh gốc: lấy mức tối của ảnh để không thành "thẻ" khi cắt
+            image = rotate(image, -skew, fill=np.percentile(image, 5))
+        top, bottom, left, right = card_bounds(image, card_threshold)
+        binary, threshold = binarize(image[top:bottom, left:right])
+        results.append((binary, {
+            'input_shape': list(batch.shape[1:3]),
+            'scale': factor,
+            'skew_deg': round(skew, 2),
+            'crop': [top, bottom, left, right],
+            'threshold': threshold,
+            'output_shape': list(binary.shape)
+        }))
+    return results
+
+
+def preprocess_batch(images, max_side=MAX_SIDE):
+    """
+    List ảnh (H, W) hoặc (H, W, C) -> list (ảnh nhị phân uint8, thông tin xử lý),
+    cùng thứ tự đầu vào; ảnh cùng kích thước được xử lý chung một mảng.
+    ValueError nếu ảnh sai dạng
+    """
+    images = [to_uint8(np.asarray(image)) for image in images]
+    groups = {}
+    for i, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(i)
+    results = [None] * len(images)
+    for indices in groups.values():
+        batch = np.stack([images[i] for i in indices])
+        for i, result in zip(indices, _preprocess_group(batch, max_side)):
+            results[i] = result
+    return results
+
+
+def preprocess(image, max_side=MAX_SIDE):
+    """Một ảnh -> (ảnh nhị phân uint8, thông tin xử lý)"""
+    return preprocess_batch([image], max_side)[0]
+
+
+def _read_netpbm(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    tokens, pos = [], 0
+    # Header: magic, width, height, maxval (bỏ qua comment); dừng ở cuối file nếu header bị cắt
+    while len(tokens) < 4 and pos < len(data):
+        while pos < len(data) and data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b'#':
+            pos = data.find(b'\n', pos)
+            if pos < 0:
+                break
+            continue
+        end = pos
+        while end < len(data) and not data[end:end + 1].isspace():
+            end += 1
+        if end > pos:
+            tokens.append(data[pos:end])
+        pos = end
+    if len(tokens) < 4 or not all(token.isdigit() for token in tokens[1:]):
+        raise ValueError('Header PGM/PPM không hợp lệ')
+    magic, width, height, maxval = tokens[0], int(tokens[1]), int(tokens[2]), int(tokens[3])
+    if magic not in (b'P5', b'P6') or maxval > 255:
+        raise ValueError('Chỉ hỗ trợ PGM/PPM nhị phân 8 bit')
+    channels = 3 if magic == b'P6' else 1
+    count = width * height * channels
+    if not count or pos + 1 + count > len(data):
+        raise ValueError('File PGM/PPM bị cắt: thiếu dữ liệu điểm ảnh')
+    pixels = np.frombuffer(data, dtype=np.uint8, count=count, offset=pos + 1)
+    return pixels.reshape((height, width, 3) if channels == 3 else (height, width))
+
+
+def load_image(path):
+    """
+    Đọc ảnh thành mảng theo nội dung file (file upload lưu theo hash, không có đuôi):
+    PGM/PPM và .npy đọc trực tiếp, định dạng ảnh khác cần Pillow
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(8)
+    if magic[:2] in (b'P5', b'P6'):
+        return _read_netpbm(path)
+    if magic[:6] == b'\x93NUMPY':
+        return np.load(path, allow_pickle=False)
+    if not magic.startswith(IMAGE_MAGIC):
+        raise ValueError(f'Không tiền xử lý được định dạng {os.path.basename(path)}')
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ValueError('Cần cài Pillow để đọc ảnh JPEG/PNG/BMP/TIFF/WebP')
+    with Image.open(path) as image:
+        return np.asarray(image.convert('RGB'))
+
+
+def save_pgm(path, gray):
+    """Ghi ảnh xám uint8 dạng PGM (tesseract đọc được trực tiếp)"""
+    with open(path, 'wb') as f:
+        f.write(f'P5 {gray.shape[1]} {gray.shape[0]} 255\n'.encode())
+        f.write(np.ascontiguousarray(gray, dtype=np.uint8).tobytes())
@@ -0,0 +1,89 @@
+"""
+Zalo OA Finance Workflow - Realtime Routing
+Định tuyến event Socket.IO tới đúng room (theo lead, người phụ trách, vai trò)
+thay vì broadcast cho mọi dashboard, và gộp loạt lead_updated của cùng một lead
+trong một khoảng ngắn thành một event delta chỉ chứa các trường đã đổi
+"""
+
+import threading
+
+# Khoảng gộp lead_updated (giây)
+LEAD_COALESCE_WINDOW = 0.2
+
+
+def lead_room(lead_id):
+    return f'lead_{lead_id}'
+
+
+def user_room(user_id):
+    return f'user_{user_id}'
+
+
+def role_room(role):
+    return f'role_{role}'
+
+
+def lead_delta(before, after):
+    """Các trường có giá trị khác nhau giữa hai bản chụp lead"""
+    return {
+        field: value
+        for field, value in after.items()
+        if before.get(field) != value
+    }
+
+
+class LeadUpdateCoalescer:
+    """
+    Gom các cập nhật của một lead: lần cập nhật đầu mở cửa sổ `window` giây,
+    hết cửa sổ thì emit một event với delta giữa bản chụp đầu tiên và cuối cùng,
+    gửi tới hợp của mọi room liên quan trong cửa sổ (ví dụ cả người phụ trách cũ và mới)
+    """
+
+    def __init__(self, emit, window=LEAD_COALESCE_WINDOW):
+        # emit(payload, rooms)
+        self._emit = emit
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.received = 0
+        self.emitted = 0
+
+    def lead_updated(self, before, after, rooms):
+        lead_id = after['id']
+        with self._lock:
+            self.received += 1
+            pending = self._pending.get(lead_id)
+            if pending is not None:
+                pending['after'] = dict(after)
+                pending['rooms'].update(rooms)
+                return
+            self._pending[lead_id] = {
+                'before': dict(before),
+                'after': dict(after),
+                'rooms': set(rooms)
+            }
+        timer = threading.Timer(self.window, self.flush, args=(lead_id,))
+        timer.daemon = True
+        timer.start()
+
+    def flush(self, lead_id):
+        with self._lock:
+            pending = self._pending.pop(lead_id, None)
+        if pending is None:
+            return
+        changes = lead_delta(pending['before'], pending['after'])
+        changes.pop('updated_at', None)
+        if not changes:
+            return
+        with self._lock:
+            self.emitted += 1
+        self._emit({
+            'id': lead_id,
+            'changes': changes,
+            'updated_at': pending['after'].get('updated_at')
+        }, sorted(pending['rooms']))
+
+    def discard(self, lead_id):
+        """Bỏ cập nhật đang chờ (ví dụ lead vừa bị xóa)"""
+        with self._lock:
+            self._pending.pop(lead_id, None)
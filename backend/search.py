@@ -0,0 +1,244 @@
+"""
+Zalo OA Finance Workflow - Lead Search Index
+Chỉ mục tìm kiếm lead theo tên (bỏ dấu tiếng Việt), số điện thoại và ID,
+cập nhật tăng dần khi lead được tạo/sửa/xóa; kèm tra cứu chính xác theo số điện
+thoại / email đã chuẩn hóa để chống tạo trùng lead
+"""
+
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+_TOKEN_RE = re.compile(r'[0-9a-z]+')
+_PHONE_QUERY_RE = re.compile(r'^[\d\s+().-]+$')
+_NON_DIGIT_RE = re.compile(r'\D')
+# Di động 9 số bị Excel bỏ mất số 0 đầu (912345678 -> 0912345678)
+_MISSING_ZERO_RE = re.compile(r'^[35789]\d{8}$')
+# Dấu tiếng Việt sau NFD đều nằm trong khối Combining Diacritical Marks
+_MARKS_RE = re.compile('[\u0300-\u036f]')
+
+# Tiền tố khớp tối đa chừng này token thì được mở rộng thành tập token cụ thể
+EXPAND_LIMIT = 64
+
+
+def fold_accents(text):
+    """Bỏ dấu tiếng Việt và chuyển về chữ thường: 'Nguyễn Văn' -> 'nguyen van'"""
+    stripped = _MARKS_RE.sub('', unicodedata.normalize('NFD', text or '')).replace('đ', 'd').replace('Đ', 'D')
+    if not stripped.isascii():
+        # Dấu ngoài khối trên (chữ khác tiếng Việt): lọc từng ký tự như cũ
+        stripped = ''.join(ch for ch in stripped if unicodedata.category(ch) != 'Mn')
+    return stripped.lower()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(fold_accents(text))
+
+
+def normalize_phone(phone):
+    """Chỉ giữ chữ số, đổi đầu số quốc tế 84 về 0, thêm số 0 đầu bị Excel bỏ mất"""
+    digits = _NON_DIGIT_RE.sub('', phone or '')
+    if digits.startswith('84') and len(digits) >= 11:
+        digits = '0' + digits[2:]
+    elif _MISSING_ZERO_RE.match(digits):
+        digits = '0' + digits
+    return digits
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+class LeadSearchIndex:
+    """
+    Inverted index: token -> set(lead_id), cộng với vocabulary đã sắp xếp
+    để tìm theo tiền tố bằng bisect thay vì quét toàn bộ lead
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._vocabulary = []
+        self._docs = {}
+        # ('phone' | 'email', giá trị chuẩn hóa) -> set(lead_id)
+        self._contacts = {}
+        self._doc_contacts = {}
+
+    @staticmethod
+    def _terms(lead):
+        terms = set(tokenize(lead.get('name', '')))
+        phone = normalize_phone(lead.get('phone', ''))
+        if phone:
+            terms.add(phone)
+        if lead.get('id'):
+            terms.add(str(lead['id']).lower())
+        return terms
+
+    @staticmethod
+    def _contact_keys(lead):
+        keys = []
+        phone = normalize_phone(lead.get('phone', ''))
+        if phone:
+            keys.append(('phone', phone))
+        email = normalize_email(lead.get('email', ''))
+        if email:
+            keys.append(('email', email))
+        return tuple(keys)
+
+    def add(self, lead):
+        """Thêm hoặc cập nhật một lead trong index"""
+        with self._lock:
+            for term in self._add(lead):
+                insort(self._vocabulary, term)
+
+    def add_many(self, leads):
+        """Thêm nhiều lead (import): vocabulary được trộn một lần thay vì insort từng token"""
+        with self._lock:
+            new_terms = set()
+            for lead in leads:
+                new_terms.update(self._add(lead))
+            pending = sorted(term for term in new_terms if term in self._postings)
+            if pending:
+                # timsort nhận ra hai dãy đã sắp xếp và trộn tuyến tính
+                self._vocabulary += pending
+                self._vocabulary.sort()
+
+    def _add(self, lead):
+        """Cập nhật posting của một lead (caller giữ lock), trả về các token mới"""
+        lead_id = lead['id']
+        terms = self._terms(lead)
+        old_terms = self._docs.get(lead_id, set())
+        for term in old_terms - terms:
+            self._discard(term, lead_id)
+        new_terms = []
+        for term in terms - old_terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = set()
+                new_terms.append(term)
+            postings.add(lead_id)
+        self._docs[lead_id] = terms
+        self._remove_contacts(lead_id)
+        keys = self._contact_keys(lead)
+        for key in keys:
+            self._contacts.setdefault(key, set()).add(lead_id)
+        self._doc_contacts[lead_id] = keys
+        return new_terms
+
+    def _remove_contacts(self, lead_id):
+        for key in self._doc_contacts.pop(lead_id, ()):
+            ids = self._contacts.get(key)
+            if ids is not None:
+                ids.discard(lead_id)
+                if not ids:
+                    del self._contacts[key]
+
+    def remove(self, lead_id):
+        with self._lock:
+            for term in self._docs.pop(lead_id, ()):
+                self._discard(term, lead_id)
+            self._remove_contacts(lead_id)
+
+    def rebuild(self, leads):
+        with self._lock:
+            self._postings, self._vocabulary, self._docs = {}, [], {}
+            self._contacts, self._doc_contacts = {}, {}
+            for lead in leads:
+                lead_id = lead['id']
+                terms = self._terms(lead)
+                for term in terms:
+                    self._postings.setdefault(term, set()).add(lead_id)
+                self._docs[lead_id] = terms
+                keys = self._contact_keys(lead)
+                for key in keys:
+                    self._contacts.setdefault(key, set()).add(lead_id)
+                self._doc_contacts[lead_id] = keys
+            self._vocabulary = sorted(self._postings)
+
+    def find_contacts(self, phone=None, email=None):
+        """Lead có cùng số điện thoại hoặc email (so sánh sau chuẩn hóa)"""
+        found = set()
+        with self._lock:
+            if phone:
+                found |= self._contacts.get(('phone', normalize_phone(phone)), set())
+            if email:
+                found |= self._contacts.get(('email', normalize_email(email)), set())
+        return found
+
+    def _discard(self, term, lead_id):
+        postings = self._postings.get(term)
+        if postings is None:
+            return
+        postings.discard(lead_id)
+        if not postings:
+            del self._postings[term]
+            i = bisect_left(self._vocabulary, term)
+            # Token thêm trong add_many có thể chưa được trộn vào vocabulary
+            if i < len(self._vocabulary) and self._vocabulary[i] == term:
+                del self._vocabulary[i]
+
+    def _prefix_range(self, prefix):
+        lo = bisect_left(self._vocabulary, prefix)
+        hi = bisect_left(self._vocabulary, prefix + '\uffff', lo)
+        return lo, hi
+
+    def search(self, query, limit=20):
+        """
+        Trả về tối đa `limit` lead_id khớp mọi từ khóa của query (so khớp tiền tố).
+        Query chỉ gồm chữ số được xem là số điện thoại.
+        """
+        if _PHONE_QUERY_RE.match(query or '') and re.search(r'\d', query):
+            terms = [normalize_phone(query)]
+        else:
+            terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            ranges = []
+            for term in terms:
+                lo, hi = self._prefix_range(term)
+                if lo == hi:
+                    return []
+                if hi - lo <= EXPAND_LIMIT:
+                    # Ít token khớp: ước lượng theo tổng posting, kiểm tra bằng phép giao tập hợp
+                    matched = self._vocabulary[lo:hi]
+                    cost = (0, sum(len(self._postings[t]) for t in matched))
+                    check = set(matched)
+                else:
+                    cost = (1, hi - lo)
+                    check = term
+                ranges.append((cost, term, lo, hi, check))
+            # Dẫn bằng từ khóa có ít lead khớp nhất, các từ còn lại kiểm tra trên token của lead
+            ranges.sort(key=lambda r: r[0])
+            _, _, lo, hi, _ = ranges[0]
+            others = [check for _, _, _, _, check in ranges[1:]]
+
+            results = []
+            seen = set()
+            for i in range(lo, hi):
+                for lead_id in self._postings[self._vocabulary[i]]:
+                    if lead_id in seen:
+                        continue
+                    seen.add(lead_id)
+                    if self._matches(self._docs[lead_id], others):
+                        results.append(lead_id)
+                        if len(results) >= limit:
+                            return results
+            return results
+
+    @staticmethod
+    def _matches(lead_terms, checks):
+        for check in checks:
+            if isinstance(check, set):
+                if check.isdisjoint(lead_terms):
+                    return False
+            elif not any(t.startswith(check) for t in lead_terms):
+                return False
+        return True
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, lead_id):
+        return lead_id in self._docs
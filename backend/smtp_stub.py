@@ -0,0 +1,128 @@
+"""
+Zalo OA Finance Workflow - SMTP Stub
+Server SMTP tối giản (asyncio) nhận và đếm email thay cho SMTP thật, dùng cho chế độ
+demo, test và đo hiệu năng gửi thông báo qua kênh email.
+Hỗ trợ EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT; không xác thực, không TLS.
+
+Chạy riêng: python smtp_stub.py --port 2525 --latency-ms 5
+"""
+
+import asyncio
+import argparse
+import threading
+
+
+class SMTPStub:
+    def __init__(self, latency_ms=0.0, keep=100):
+        self.latency_ms = latency_ms
+        # Giữ lại `keep` email gần nhất để kiểm tra nội dung
+        self.keep = keep
+        self.received = 0
+        self.connections = 0
+        self.messages = []
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        envelope = {'from': None, 'to': []}
+
+        async def reply(line):
+            writer.write(f'{line}\r\n'.encode())
+            await writer.drain()
+
+        await reply('220 smtp-stub ESMTP')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8', 'replace').strip()
+                verb = command[:4].upper()
+                if verb == 'EHLO':
+                    writer.write(b'250-smtp-stub\r\n250-8BITMIME\r\n')
+                    await reply('250 SMTPUTF8')
+                elif verb == 'HELO':
+                    await reply('250 smtp-stub')
+                elif verb == 'MAIL':
+                    envelope = {'from': command[10:].strip(), 'to': []}
+                    await reply('250 OK')
+                elif verb == 'RCPT':
+                    envelope['to'].append(command[8:].strip())
+                    await reply('250 OK')
+                elif verb == 'DATA':
+                    if not envelope['to']:
+                        await reply('503 RCPT first')
+                        continue
+                    await reply('354 End data with <CR><LF>.<CR><LF>')
+                    body = []
+                    while True:
+                        data = await reader.readline()
+                        if not data or data in (b'.\r\n', b'.\n'):
+                            break
+                        body.append(data)
+                    if self.latency_ms:
+                        await asyncio.sleep(self.latency_ms / 1000)
+                    self.received += 1
+                    self.messages.append(dict(envelope, data=b''.join(body).decode('utf-8', 'replace')))
+                    del self.messages[:-self.keep]
+                    await reply('250 OK queued')
+                elif verb == 'RSET':
+                    envelope = {'from': None, 'to': []}
+                    await reply('250 OK')
+                elif verb == 'NOOP':
+                    await reply('250 OK')
+                elif verb == 'QUIT':
+                    await reply('221 Bye')
+                    break
+                else:
+                    await reply('502 Command not implemented')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def stats(self):
+        return {'received': self.received, 'connections': self.connections}
+
+
+async def start(host='127.0.0.1', port=0, **options):
+    """Chạy stub trong event loop hiện tại; trả về (stub, server, port)"""
+    stub = SMTPStub(**options)
+    server = await asyncio.start_server(stub.handle, host, port)
+    return stub, server, server.sockets[0].getsockname()[1]
+
+
+def start_in_thread(host='127.0.0.1', **options):
+    """Chạy stub trong event loop của một thread nền; trả về (stub, host, port)"""
+    started = {}
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        started['stub'], started['server'], started['port'] = loop.run_until_complete(start(host, **options))
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name='smtp-stub', daemon=True).start()
+    ready.wait()
+    return started['stub'], host, started['port']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SMTP stub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    async def serve():
+        _, server, port = await start(args.host, args.port, latency_ms=args.latency_ms)
+        print(f'SMTP stub listening on {args.host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
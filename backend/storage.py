@@ -0,0 +1,744 @@
+"""
+Zalo OA Finance Workflow - Storage Layer
+Repository API dùng chung cho mọi route, với hai backend:
+- MemoryStorage: dict trong RAM; thêm Journal (WAL + snapshot) để giữ dữ liệu qua
+  các lần restart, hội thoại lâu không hoạt động có thể chuyển xuống archive trên đĩa
+- SQLiteStorage: SQLite ở chế độ WAL, có index cho các truy vấn thường dùng
+"""
+
+import gc
+import os
+import json
+import base64
+import heapq
+import pickle
+import sqlite3
+import threading
+from bisect import bisect_left, insort
+
+from messages import MessageLog, update_summary, interned_tables, load_interned
+from archive import ConversationArchive
+from journal import Journal
+
+COLLECTIONS = (
+    'users',
+    'leads',
+    'conversations',
+    'documents',
+    'notifications',
+    'workflow_status',
+    'broadcast_messages',
+    'notification_batches',
+    'ocr_jobs',
+    'uploads',
+    'lead_imports',
+)
+
+# Các trường được đánh index (truy vấn bằng find()/page() không quét toàn bảng)
+INDEXED_FIELDS = {
+    'leads': ('status', 'created_at', 'assigned_to', 'source', 'product_interest', 'labels'),
+    'documents': ('lead_id', 'created_at', 'status', 'type', 'sha256'),
+    'conversations': ('created_at', 'last_message_at'),
+    'broadcast_messages': ('status', 'created_by', 'scheduled_time'),
+    'ocr_jobs': ('status', 'document_id'),
+    'uploads': ('status',),
+    'lead_imports': ('status',),
+}
+
+# Trường dạng list - mỗi phần tử là một khóa index
+MULTI_VALUED_FIELDS = {
+    'leads': ('labels',),
+}
+
+# Collection có index sắp xếp theo (trường thứ tự, key) để phân trang keyset
+ORDER_FIELDS = {
+    'leads': 'created_at',
+    'documents': 'created_at',
+    # Inbox: hội thoại có hoạt động gần nhất lên đầu
+    'conversations': 'last_message_at',
+    # Lịch gửi broadcast: chiến dịch xa nhất lên đầu
+    'broadcast_messages': 'scheduled_time',
+}
+
+
+# Số tin nhắn mặc định mỗi trang lịch sử hội thoại
+MESSAGE_PAGE_SIZE = 50
+
+
+def new_conversation(user_id, created_at):
+    """Metadata + tóm tắt hội thoại - tin nhắn lưu riêng, đọc qua messages()"""
+    return {
+        'user_id': user_id,
+        'created_at': created_at,
+        'last_message': None,
+        'last_sender': None,
+        'last_message_at': created_at,
+        'message_count': 0,
+        'unread_count': 0,
+        'transfer_to_agent': False
+    }
+
+
+def order_key(collection, key, record):
+    return (record.get(ORDER_FIELDS[collection]) or '', key)
+
+
+def encode_cursor(position):
+    """Mã hóa vị trí (giá trị trường thứ tự, key) thành cursor dạng chuỗi"""
+    raw = json.dumps(list(position), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Giải mã cursor, ValueError nếu không hợp lệ"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    if (not isinstance(position, list) or len(position) != 2
+            or not all(isinstance(part, str) for part in position)):
+        raise ValueError('cursor không hợp lệ')
+    return tuple(position)
+
+
+def _filter_items(collection, filters):
+    """Chuẩn hóa filters thành list (field, value), trường list nhận nhiều giá trị (AND)"""
+    items = []
+    for field, value in (filters or {}).items():
+        if field not in INDEXED_FIELDS.get(collection, ()):
+            raise KeyError(f'{collection}.{field} không có index')
+        if field in MULTI_VALUED_FIELDS.get(collection, ()) and isinstance(value, (list, tuple)):
+            items.extend((field, v) for v in value)
+        else:
+            items.append((field, value))
+    return items
+
+
+class MemoryStorage:
+    """Backend trong RAM - giữ nguyên cấu trúc DATABASE dict cũ"""
+
+    name = 'memory'
+
+    def __init__(self, archive=None, journal=None):
+        self.data = {collection: {} for collection in COLLECTIONS}
+        self.counters = {}
+        self._lock = threading.RLock()
+        # index[collection][field][value] -> set(key)
+        self._indexes = {
+            collection: {field: {} for field in fields}
+            for collection, fields in INDEXED_FIELDS.items()
+        }
+        # Giá trị đã index của từng record, để gỡ index khi record bị sửa tại chỗ
+        self._indexed_values = {collection: {} for collection in INDEXED_FIELDS}
+        # List (trường thứ tự, key) đã sắp xếp và vị trí hiện tại của từng key
+        self._order = {collection: [] for collection in ORDER_FIELDS}
+        self._order_keys = {collection: {} for collection in ORDER_FIELDS}
+        # user_id -> MessageLog (lịch sử dạng cột, chỉ ghi thêm)
+        self._messages = {}
+        # ConversationArchive cho lịch sử của hội thoại nguội (None = giữ hết trong RAM)
+        self.archive = archive
+        # Journal: mọi thay đổi ghi vào WAL; None = không lưu bền
+        self.journal = None
+        self._snapshot_lock = threading.Lock()
+        self._bulk = False
+        if journal is not None:
+            self._restore(journal)
+            journal.open()
+            self.journal = journal
+
+    # ----- WAL / snapshot -----
+
+    def _log(self, op, *args):
+        if self.journal is not None:
+            self.journal.append(op, *args)
+
+    def _restore(self, journal):
+        """Nạp snapshot mới nhất rồi phát lại log (self.journal chưa gắn nên không ghi lại)"""
+        # Nạp hàng triệu object nhỏ: tắt GC theo thế hệ trong lúc nạp, bật lại sau
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._load(journal)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _load(self, journal):
+        state, records = journal.load()
+        # Nạp hàng loạt: bỏ qua duy trì list thứ tự từng bước, sắp một lần ở cuối
+        self._bulk = True
+        try:
+            if state is not None:
+                self.data = state['data']
+                # Collection thêm sau khi snapshot được chụp
+                for collection in COLLECTIONS:
+                    self.data.setdefault(collection, {})
+                self.counters = state['counters']
+                self._messages = state['messages']
+                # MessageLog lưu sender/intent dạng mã: nạp bảng mã trước khi phát lại WAL
+                if 'interned' in state:
+                    load_interned(self._messages.values(), state['interned'])
+                if state.get('indexed_fields') == INDEXED_FIELDS:
+                    self._indexes, self._indexed_values, self._order_keys = state['indexes']
+                else:
+                    # Snapshot của phiên bản có bộ index khác: dựng lại từ dữ liệu
+                    for collection in INDEXED_FIELDS:
+                        for key, record in self.data[collection].items():
+                            self._index(collection, key, record)
+            # Segment được giữ qua restart: nạp index trước khi phát lại WAL (WAL có thể đưa
+            # hội thoại đã lưu trữ về RAM); không có snapshot thì segment cũ là rác
+            if self.archive is not None:
+                self.archive.load_state(state.get('archive') if state is not None else None)
+            elif state is not None and state.get('archive'):
+                # Archive bị tắt sau khi snapshot được chụp: đưa lịch sử từ segment về RAM
+                archive = ConversationArchive(state['archive']['directory'], persistent=True)
+                archive.load_state(state['archive'])
+                for user_id in archive.user_ids():
+                    self._messages[user_id] = MessageLog(archive.read(user_id))
+                archive.close()
+            if state is not None:
+                # Snapshot của phiên bản cũ chứa luôn bản nén của archive
+                for user_id, payload in state.get('archived', {}).items():
+                    if self.archive is not None:
+                        self.archive.write_raw(user_id, payload)
+                    else:
+                        self._messages[user_id] = MessageLog(ConversationArchive.decode(payload))
+            for op, args in records:
+                getattr(self, op)(*args)
+        finally:
+            self._bulk = False
+        for collection in ORDER_FIELDS:
+            self._order[collection] = sorted(self._order_keys[collection].values())
+
+    def snapshot(self):
+        """
+        Chụp toàn bộ trạng thái: chốt WAL và pickle trong lock, ghi file ngoài lock.
+        Trả về kích thước snapshot (byte), None nếu không có journal.
+        """
+        if self.journal is None:
+            return None
+        with self._snapshot_lock:
+            with self._lock:
+                generation = self.journal.cut()
+                # Archive chỉ góp index (segment nằm sẵn trên đĩa), không đọc lại lịch sử đã nén
+                archive, retired = self.archive.snapshot_state() if self.archive is not None else (None, [])
+                payload = pickle.dumps({
+                    'data': self.data,
+                    'counters': self.counters,
+                    'messages': self._messages,
+                    'interned': interned_tables(),
+                    # Index đi kèm snapshot: nạp lại nhanh hơn dựng lại từng record
+                    'indexed_fields': INDEXED_FIELDS,
+                    'indexes': (self._indexes, self._indexed_values, self._order_keys),
+                    'archive': archive
+                }, protocol=pickle.HIGHEST_PROTOCOL)
+            size = self.journal.write_snapshot(generation, payload)
+            if retired:
+                # Snapshot mới không còn trỏ tới các segment đã bỏ trước lúc chụp
+                self.archive.purge(retired)
+            return size
+
+    # ----- records -----
+
+    def _index(self, collection, key, record):
+        fields = INDEXED_FIELDS.get(collection)
+        if not fields:
+            return
+        multi = MULTI_VALUED_FIELDS.get(collection, ())
+        values = {}
+        for field in fields:
+            value = record.get(field)
+            values[field] = tuple(set(value or ())) if field in multi else (value,)
+            for v in values[field]:
+                self._indexes[collection][field].setdefault(v, set()).add(key)
+        self._indexed_values[collection][key] = values
+        if collection in self._order:
+            position = order_key(collection, key, record)
+            if not self._bulk:
+                insort(self._order[collection], position)
+            self._order_keys[collection][key] = position
+
+    def _unindex(self, collection, key):
+        values = self._indexed_values.get(collection, {}).pop(key, None)
+        if not values:
+            return
+        for field, field_values in values.items():
+            for value in field_values:
+                keys = self._indexes[collection][field].get(value)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._indexes[collection][field][value]
+        position = self._order_keys.get(collection, {}).pop(key, None)
+        if position is not None and not self._bulk:
+            order = self._order[collection]
+            del order[bisect_left(order, position)]
+
+    def get(self, collection, key):
+        return self.data[collection].get(key)
+
+    def put(self, collection, key, record):
+        with self._lock:
+            self._log('put', collection, key, record)
+            self._put(collection, key, record)
+        return record
+
+    def put_many(self, collection, records):
+        """
+        records: {key: record} - ghi nhiều record một lần (một bản ghi WAL); list thứ
+        tự được sắp lại một lần ở cuối thay vì insort từng record
+        """
+        with self._lock:
+            self._log('put_many', collection, records)
+            bulk, self._bulk = self._bulk, True
+            try:
+                for key, record in records.items():
+                    self._put(collection, key, record)
+            finally:
+                self._bulk = bulk
+            if not bulk and collection in self._order:
+                # Record mới thường có created_at tăng dần: timsort gần như tuyến tính
+                self._order[collection] = sorted(self._order_keys[collection].values())
+        return len(records)
+
+    def _put(self, collection, key, record):
+        self._unindex(collection, key)
+        self.data[collection][key] = record
+        self._index(collection, key, record)
+
+    def delete(self, collection, key):
+        with self._lock:
+            if key not in self.data[collection]:
+                return False
+            self._log('delete', collection, key)
+            self._unindex(collection, key)
+            del self.data[collection][key]
+            if collection == 'conversations':
+                self._messages.pop(key, None)
+                if self.archive is not None:
+                    self.archive.discard(key)
+        return True
+
+    def values(self, collection):
+        return list(self.data[collection].values())
+
+    def count(self, collection):
+        return len(self.data[collection])
+
+    def find(self, collection, field, value):
+        """Tra cứu theo trường đã index"""
+        keys = self._indexes[collection][field].get(value, ())
+        return [self.data[collection][key] for key in list(keys)]
+
+    def page(self, collection, limit, after=None, filters=None):
+        """
+        Một trang record theo trường thứ tự (ORDER_FIELDS) giảm dần (keyset pagination).
+        Trả về (records, next_cursor) - next_cursor là None ở trang cuối.
+        """
+        with self._lock:
+            order = self._order[collection]
+            end = bisect_left(order, after) if after else len(order)
+            candidates = None
+            for field, value in _filter_items(collection, filters):
+                keys = self._indexes[collection][field].get(value, set())
+                candidates = keys if candidates is None else candidates & keys
+
+            if candidates is None:
+                positions = order[max(end - limit - 1, 0):end][::-1]
+            elif len(candidates) ** 2 <= limit * max(end, 1):
+                # Tập lọc nhỏ: chọn top-k trực tiếp từ index phụ
+                positions_of = self._order_keys[collection]
+                positions = heapq.nlargest(
+                    limit + 1,
+                    (p for p in (positions_of[k] for k in candidates) if not after or p < after)
+                )
+            else:
+                # Tập lọc lớn: duyệt ngược index thứ tự, gặp đủ trang là dừng
+                positions = []
+                for i in range(end - 1, -1, -1):
+                    if order[i][1] in candidates:
+                        positions.append(order[i])
+                        if len(positions) > limit:
+                            break
+
+            records = [self.data[collection][key] for _, key in positions[:limit]]
+            next_cursor = encode_cursor(positions[limit - 1]) if len(positions) > limit else None
+        return records, next_cursor
+
+    def append_messages(self, user_id, messages, created_at):
+        """Thêm tin nhắn vào hội thoại, trả về True nếu hội thoại vừa được tạo"""
+        with self._lock:
+            self._log('append_messages', user_id, messages, created_at)
+            conversation = self.data['conversations'].get(user_id)
+            created = conversation is None
+            if created:
+                conversation = new_conversation(user_id, created_at)
+            log = self._messages.get(user_id)
+            if log is None:
+                # Hội thoại đã lưu trữ có tin mới: đưa lịch sử về lại RAM
+                archived = self.archive.pop(user_id) if self.archive is not None else None
+                log = self._messages[user_id] = MessageLog(archived or ())
+            log.extend(messages)
+            # Ghi lại record để cập nhật index thứ tự theo last_message_at
+            self._put('conversations', user_id, update_summary(conversation, messages))
+        return created
+
+    def mark_conversation_read(self, user_id):
+        """Đặt unread_count về 0, trả về hội thoại (None nếu không tồn tại)"""
+        with self._lock:
+            conversation = self.data['conversations'].get(user_id)
+            if conversation is not None:
+                self._log('mark_conversation_read', user_id)
+                conversation['unread_count'] = 0
+            return conversation
+
+    def messages(self, user_id, before=None, limit=MESSAGE_PAGE_SIZE):
+        """
+        Trang tin nhắn mới nhất có seq < before (cũ -> mới), limit=None là toàn bộ.
+        Trả về (messages, next_before) - next_before là None khi hết lịch sử.
+        """
+        with self._lock:
+            # Tra RAM và archive trong cùng lock: archive_idle / append_messages chuyển hội thoại
+            # giữa hai nơi trong lock nên luôn thấy đúng một bản
+            log = self._messages.get(user_id)
+            if log is not None:
+                return log.page(before, len(log) if limit is None else limit)
+            payload = self.archive.read_raw(user_id) if self.archive is not None else None
+        if payload is None:
+            return [], None
+        # Giải nén ngoài lock, lịch sử đọc từ archive (mmap) không đưa về RAM
+        log = MessageLog(self.archive.decode(payload))
+        return log.page(before, len(log) if limit is None else limit)
+
+    def archive_idle(self, cutoff):
+        """
+        Chuyển lịch sử của hội thoại có last_message_at < cutoff (ISO) xuống archive,
+        trả về số hội thoại đã chuyển
+        """
+        if self.archive is None:
+            return 0
+        with self._lock:
+            idle = [
+                user_id for user_id in self._messages
+                if (self.data['conversations'][user_id].get('last_message_at') or '') < cutoff
+            ]
+            for user_id in idle:
+                # Ghi xong mới bỏ khỏi RAM: ghi lỗi (đầy đĩa) không làm mất lịch sử
+                self.archive.write(user_id, self._messages[user_id].dump())
+                del self._messages[user_id]
+        return len(idle)
+
+    def append_conversations(self, batches):
+        """
+        batches: {user_id: (created_at, [messages])} - ghi nhiều hội thoại một lần,
+        trả về số hội thoại mới được tạo
+        """
+        with self._lock:
+            return sum(
+                self.append_messages(user_id, messages, created_at)
+                for user_id, (created_at, messages) in batches.items()
+            )
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._log('incr', name, amount)
+            self.counters[name] = self.counters.get(name, 0) + amount
+            return self.counters[name]
+
+    def counter(self, name):
+        return self.counters.get(name, 0)
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+        if self.archive is not None:
+            self.archive.close()
+
+
+class SQLiteStorage:
+    """Backend SQLite (WAL) - mỗi collection là một bảng JSON + cột index"""
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._init_schema()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _columns(collection):
+        multi = MULTI_VALUED_FIELDS.get(collection, ())
+        return tuple(f for f in INDEXED_FIELDS.get(collection, ()) if f not in multi)
+
+    def _init_schema(self):
+        conn = self._conn()
+        with self._write_lock, conn:
+            for collection in COLLECTIONS:
+                fields = self._columns(collection)
+                columns = ''.join(f', {field} TEXT' for field in fields)
+                conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {collection} '
+                    f'(key TEXT PRIMARY KEY{columns}, data TEXT NOT NULL)'
+                )
+                # Bổ sung cột index mới cho database tạo từ phiên bản trước
+                existing = {row[1] for row in conn.execute(f'PRAGMA table_info({collection})')}
+                for field in fields:
+                    if field not in existing:
+                        conn.execute(f'ALTER TABLE {collection} ADD COLUMN {field} TEXT')
+                        conn.execute(f"UPDATE {collection} SET {field} = json_extract(data, '$.{field}')")
+                order_field = ORDER_FIELDS.get(collection)
+                for field in fields:
+                    # Index ghép với trường thứ tự để lọc + sắp xếp chỉ đọc trên index
+                    if order_field and field != order_field:
+                        target = f'{field}, {order_field}, key'
+                    elif order_field:
+                        target = f'{order_field}, key'
+                    else:
+                        target = field
+                    conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS idx_{collection}_{field} ON {collection}({target})'
+                    )
+                for field in MULTI_VALUED_FIELDS.get(collection, ()):
+                    conn.execute(
+                        f'CREATE TABLE IF NOT EXISTS {collection}_{field} '
+                        f'(key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (value, key))'
+                    )
+                    conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS idx_{collection}_{field}_key ON {collection}_{field}(key)'
+                    )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS messages '
+                '(seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, data TEXT NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages(user_id, seq)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)'
+            )
+            # Hội thoại tạo từ phiên bản chưa có tóm tắt inbox: tính lại từ bảng messages
+            stale = conn.execute(
+                "SELECT key, data FROM conversations WHERE json_extract(data, '$.message_count') IS NULL"
+            ).fetchall()
+            for key, data in stale:
+                record = json.loads(data)
+                conversation = new_conversation(key, record.get('created_at'))
+                conversation.update(record)
+                rows = conn.execute('SELECT data FROM messages WHERE user_id = ? ORDER BY seq', (key,))
+                self._write(conn, 'conversations', key, update_summary(
+                    conversation, (json.loads(message) for (message,) in rows)
+                ))
+
+    def _decode(self, collection, key, data):
+        return json.loads(data)
+
+    def _where(self, collection, filters):
+        clauses, params = [], []
+        for field, value in _filter_items(collection, filters):
+            if field in MULTI_VALUED_FIELDS.get(collection, ()):
+                clauses.append(f'key IN (SELECT key FROM {collection}_{field} WHERE value = ?)')
+            else:
+                clauses.append(f'{field} = ?')
+            params.append(value)
+        return clauses, params
+
+    def get(self, collection, key):
+        row = self._conn().execute(
+            f'SELECT data FROM {collection} WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._decode(collection, key, row[0])
+
+    def _write(self, conn, collection, key, record):
+        """Ghi một record trong transaction đang mở (caller giữ _write_lock)"""
+        fields = self._columns(collection)
+        stored = record
+        if collection == 'conversations':
+            # Tin nhắn nằm ở bảng messages, chỉ lưu metadata
+            stored = {k: v for k, v in record.items() if k != 'messages'}
+        columns = ', '.join(('key',) + fields + ('data',))
+        placeholders = ', '.join('?' * (len(fields) + 2))
+        params = [key] + [record.get(field) for field in fields] + [json.dumps(stored, ensure_ascii=False)]
+        conn.execute(
+            f'INSERT OR REPLACE INTO {collection} ({columns}) VALUES ({placeholders})', params
+        )
+        for field in MULTI_VALUED_FIELDS.get(collection, ()):
+            conn.execute(f'DELETE FROM {collection}_{field} WHERE key = ?', (key,))
+            conn.executemany(
+                f'INSERT OR IGNORE INTO {collection}_{field} (key, value) VALUES (?, ?)',
+                [(key, value) for value in record.get(field) or ()]
+            )
+
+    def put(self, collection, key, record):
+        conn = self._conn()
+        with self._write_lock, conn:
+            self._write(conn, collection, key, record)
+        return record
+
+    def put_many(self, collection, records):
+        """records: {key: record} - ghi nhiều record trong một transaction"""
+        conn = self._conn()
+        with self._write_lock, conn:
+            for key, record in records.items():
+                self._write(conn, collection, key, record)
+        return len(records)
+
+    def delete(self, collection, key):
+        conn = self._conn()
+        with self._write_lock, conn:
+            cursor = conn.execute(f'DELETE FROM {collection} WHERE key = ?', (key,))
+            for field in MULTI_VALUED_FIELDS.get(collection, ()):
+                conn.execute(f'DELETE FROM {collection}_{field} WHERE key = ?', (key,))
+            if collection == 'conversations':
+                conn.execute('DELETE FROM messages WHERE user_id = ?', (key,))
+        return cursor.rowcount > 0
+
+    def values(self, collection):
+        rows = self._conn().execute(f'SELECT key, data FROM {collection} ORDER BY rowid')
+        return [self._decode(collection, key, data) for key, data in rows.fetchall()]
+
+    def count(self, collection):
+        return self._conn().execute(f'SELECT COUNT(*) FROM {collection}').fetchone()[0]
+
+    def find(self, collection, field, value):
+        """Tra cứu theo trường đã index"""
+        clauses, params = self._where(collection, {field: value})
+        rows = self._conn().execute(
+            f'SELECT key, data FROM {collection} WHERE {clauses[0]}', params
+        )
+        return [self._decode(collection, key, data) for key, data in rows.fetchall()]
+
+    def page(self, collection, limit, after=None, filters=None):
+        """
+        Một trang record theo trường thứ tự (ORDER_FIELDS) giảm dần (keyset pagination).
+        Trả về (records, next_cursor) - next_cursor là None ở trang cuối.
+        """
+        order_field = ORDER_FIELDS[collection]
+        clauses, params = self._where(collection, filters)
+        if after:
+            clauses.append(f'({order_field}, key) < (?, ?)')
+            params.extend(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._conn().execute(
+            f'SELECT key, {order_field}, data FROM {collection} {where} '
+            f'ORDER BY {order_field} DESC, key DESC LIMIT ?',
+            params + [limit + 1]
+        ).fetchall()
+        records = [self._decode(collection, key, data) for key, _, data in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            key, position, _ = rows[limit - 1]
+            next_cursor = encode_cursor((position or '', key))
+        return records, next_cursor
+
+    def append_messages(self, user_id, messages, created_at):
+        """Thêm tin nhắn vào hội thoại, trả về True nếu hội thoại vừa được tạo"""
+        conn = self._conn()
+        with self._write_lock, conn:
+            created = self._append(conn, user_id, messages, created_at)
+        return created
+
+    def _append(self, conn, user_id, messages, created_at):
+        row = conn.execute('SELECT data FROM conversations WHERE key = ?', (user_id,)).fetchone()
+        conversation = json.loads(row[0]) if row else new_conversation(user_id, created_at)
+        self._write(conn, 'conversations', user_id, update_summary(conversation, messages))
+        conn.executemany(
+            'INSERT INTO messages (user_id, data) VALUES (?, ?)',
+            [(user_id, json.dumps(message, ensure_ascii=False)) for message in messages]
+        )
+        return row is None
+
+    def mark_conversation_read(self, user_id):
+        """Đặt unread_count về 0, trả về hội thoại (None nếu không tồn tại)"""
+        conn = self._conn()
+        with self._write_lock, conn:
+            row = conn.execute('SELECT data FROM conversations WHERE key = ?', (user_id,)).fetchone()
+            if row is None:
+                return None
+            conversation = json.loads(row[0])
+            conversation['unread_count'] = 0
+            self._write(conn, 'conversations', user_id, conversation)
+        return conversation
+
+    def messages(self, user_id, before=None, limit=MESSAGE_PAGE_SIZE):
+        """
+        Trang tin nhắn mới nhất có seq < before (cũ -> mới), limit=None là toàn bộ.
+        seq là khóa của bảng messages. Trả về (messages, next_before).
+        """
+        sql = 'SELECT seq, data FROM messages WHERE user_id = ?'
+        params = [user_id]
+        if before is not None:
+            sql += ' AND seq < ?'
+            params.append(before)
+        sql += ' ORDER BY seq DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+        rows = self._conn().execute(sql, params).fetchall()
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        messages = [dict(json.loads(data), seq=seq) for seq, data in reversed(rows)]
+        return messages, (messages[0]['seq'] if has_more else None)
+
+    def archive_idle(self, cutoff):
+        """Dữ liệu SQLite đã nằm trên đĩa, không có gì để lưu trữ"""
+        return 0
+
+    def append_conversations(self, batches):
+        """
+        batches: {user_id: (created_at, [messages])} - ghi nhiều hội thoại trong một
+        transaction, trả về số hội thoại mới được tạo
+        """
+        conn = self._conn()
+        with self._write_lock, conn:
+            return sum(
+                self._append(conn, user_id, messages, created_at)
+                for user_id, (created_at, messages) in batches.items()
+            )
+
+    def incr(self, name, amount=1):
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.execute(
+                'INSERT INTO counters (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                (name, amount)
+            )
+            return conn.execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()[0]
+
+    def counter(self, name):
+        row = self._conn().execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def open_storage(url=None, archive_dir=None, journal_dir=None, journal_fsync=False):
+    """
+    Tạo storage từ DATABASE_URL (sqlite:///path/to.db hoặc memory://).
+    Chỉ dùng với memory://
+    - archive_dir: thư mục segment cho hội thoại nguội (giữ qua restart khi có journal_dir)
+    - journal_dir: thư mục WAL + snapshot (khôi phục dữ liệu khi khởi động)
+    """
+    if not url or url.startswith('memory:'):
+        return MemoryStorage(
+            archive=ConversationArchive(archive_dir, persistent=bool(journal_dir)) if archive_dir else None,
+            journal=Journal(journal_dir, fsync=journal_fsync) if journal_dir else None
+        )
+    if url.startswith('sqlite:///'):
+        return SQLiteStorage(url[len('sqlite:///'):])
+    raise ValueError(f'DATABASE_URL không được hỗ trợ: {url}')
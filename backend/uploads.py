@@ -0,0 +1,210 @@
+"""
+Zalo OA Finance Workflow - Chunked Document Uploads
+Upload file hồ sơ theo từng phần, tiếp tục được khi mất kết nối: mỗi phần được ghi
+thẳng xuống file tạm (.part) tại offset hiện tại và băm SHA-256 ngay khi đọc từ
+request, không giữ cả file trong bộ nhớ. Nhận đủ thì file được chuyển vào kho theo
+nội dung (blobs/ab/abcd...): cùng một ảnh CCCD gửi lại nhiều lần, ở nhiều lead,
+chỉ lưu một bản trên đĩa.
+"""
+
+import os
+import uuid
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+# Kích thước mỗi lần đọc từ request / ghi xuống đĩa
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Lỗi upload kèm HTTP status; offset = số byte server đã nhận (để client gửi tiếp)"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class UploadStore:
+    """Phiên upload lưu ở collection 'uploads', dữ liệu ở root/tmp và root/blobs"""
+
+    def __init__(self, db, root, max_bytes=50 * 1024 * 1024, chunk_max=8 * 1024 * 1024):
+        self.db = db
+        self.root = root
+        self.max_bytes = max_bytes
+        self.chunk_max = chunk_max
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.blob_dir = os.path.join(root, 'blobs')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(self.blob_dir, exist_ok=True)
+        # upload_id -> (sha256 của phần đã nhận, số byte đã băm)
+        self._hashers = {}
+        self._receiving = set()
+        self._lock = threading.Lock()
+        self.bytes_received = 0
+        self.completed = 0
+        self.deduplicated = 0
+        self.bytes_deduplicated = 0
+
+    def part_path(self, upload_id):
+        return os.path.join(self.tmp_dir, f'{upload_id}.part')
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def create(self, size, metadata, created_by):
+        """Mở phiên upload cho file `size` byte; metadata được giữ tới khi tạo hồ sơ"""
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError('file_size phải là số nguyên dương')
+        if size > self.max_bytes:
+            raise UploadError(f'File vượt quá {self.max_bytes} byte', 413)
+        upload = {
+            'id': uuid.uuid4().hex[:12],
+            'size': size,
+            'metadata': metadata,
+            'status': 'uploading',
+            'created_at': datetime.now().isoformat(),
+            'created_by': created_by
+        }
+        open(self.part_path(upload['id']), 'wb').close()
+        self.db.put('uploads', upload['id'], upload)
+        return upload
+
+    def offset(self, upload):
+        """Số byte đã nhận: kích thước file .part là nguồn sự thật (không ghi db mỗi phần)"""
+        if upload['status'] != 'uploading':
+            return upload['size']
+        try:
+            return os.path.getsize(self.part_path(upload['id']))
+        except FileNotFoundError:
+            return 0
+
+    def _hasher(self, upload_id, offset):
+        cached = self._hashers.get(upload_id)
+        if cached is not None and cached[1] == offset:
+            return cached[0].copy()
+        # Sau restart (hoặc phần trước bị ngắt giữa chừng): băm lại phần đã có trên đĩa
+        hasher = hashlib.sha256()
+        with open(self.part_path(upload_id), 'rb') as f:
+            remaining = offset
+            while remaining:
+                data = f.read(min(READ_SIZE, remaining))
+                if not data:
+                    break
+                hasher.update(data)
+                remaining -= len(data)
+        return hasher
+
+    def write(self, upload_id, offset, stream, length=None):
+        """
+        Ghi một phần bắt đầu tại `offset` từ stream (đọc từng READ_SIZE byte);
+        trả về (upload, số byte đã nhận). Nhận đủ thì upload có status 'complete'.
+        Phần bị ngắt giữa chừng vẫn được giữ, client hỏi lại offset rồi gửi tiếp.
+        """
+        upload = self.db.get('uploads', upload_id)
+        if upload is None:
+            raise UploadError('Phiên upload không tồn tại', 404)
+        if upload['status'] != 'uploading':
+            raise UploadError('Upload đã hoàn tất', 409, offset=upload['size'])
+        if length is not None and length > self.chunk_max:
+            raise UploadError(f'Mỗi phần tối đa {self.chunk_max} byte', 413)
+        with self._lock:
+            if upload_id in self._receiving:
+                raise UploadError('Đang nhận một phần khác của upload này', 409)
+            self._receiving.add(upload_id)
+        try:
+            current = self.offset(upload)
+            if offset != current:
+                raise UploadError('Offset không khớp', 409, offset=current)
+            remaining = upload['size'] - current
+            if length is not None and length > remaining:
+                raise UploadError('Phần gửi lên vượt quá kích thước file', 413, offset=current)
+            hasher = self._hasher(upload_id, current)
+            written = 0
+            with open(self.part_path(upload_id), 'r+b') as f:
+                f.seek(current)
+                try:
+                    while True:
+                        data = stream.read(READ_SIZE)
+                        if not data:
+                            break
+                        if written + len(data) > remaining or written + len(data) > self.chunk_max:
+                            # Bỏ cả phần vượt quá, giữ nguyên dữ liệu đã nhận trước đó
+                            f.truncate(current)
+                            written = 0
+                            hasher = None
+                            raise UploadError('Phần gửi lên vượt quá kích thước cho phép', 413, offset=current)
+                        f.write(data)
+                        hasher.update(data)
+                        written += len(data)
+                finally:
+                    if hasher is not None:
+                        self._hashers[upload_id] = (hasher, current + written)
+                    with self._lock:
+                        self.bytes_received += written
+            if current + written == upload['size']:
+                upload = self._complete(upload, self._hashers.pop(upload_id)[0])
+            return upload, current + written
+        finally:
+            with self._lock:
+                self._receiving.discard(upload_id)
+
+    def _complete(self, upload, hasher):
+        digest = hasher.hexdigest()
+        blob = self.blob_path(digest)
+        deduplicated = os.path.exists(blob)
+        if deduplicated:
+            os.remove(self.part_path(upload['id']))
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            # Cùng nội dung hoàn tất song song thì file sau ghi đè file trước - nội dung như nhau
+            os.replace(self.part_path(upload['id']), blob)
+        upload = dict(
+            upload,
+            status='complete',
+            sha256=digest,
+            file_path=blob,
+            deduplicated=deduplicated,
+            completed_at=datetime.now().isoformat()
+        )
+        self.db.put('uploads', upload['id'], upload)
+        with self._lock:
+            self.completed += 1
+            if deduplicated:
+                self.deduplicated += 1
+                self.bytes_deduplicated += upload['size']
+        return upload
+
+    def attach(self, upload, document_id):
+        """Ghi nhận hồ sơ tạo từ upload (gửi lại phần cuối thì trả về hồ sơ đã tạo)"""
+        upload = dict(upload, document_id=document_id)
+        self.db.put('uploads', upload['id'], upload)
+        return upload
+
+    def expire(self, max_age_seconds):
+        """Xóa phiên upload dở dang quá hạn cùng file tạm; trả về số phiên đã xóa"""
+        cutoff = (datetime.now() - timedelta(seconds=max_age_seconds)).isoformat()
+        expired = 0
+        for upload in self.db.find('uploads', 'status', 'uploading'):
+            if upload['created_at'] >= cutoff or upload['id'] in self._receiving:
+                continue
+            try:
+                os.remove(self.part_path(upload['id']))
+            except FileNotFoundError:
+                pass
+            self._hashers.pop(upload['id'], None)
+            self.db.delete('uploads', upload['id'])
+            expired += 1
+        return expired
+
+    def stats(self):
+        with self._lock:
+            return {
+                'uploading': len(self.db.find('uploads', 'status', 'uploading')),
+                'receiving': len(self._receiving),
+                'completed': self.completed,
+                'deduplicated': self.deduplicated,
+                'bytes_received': self.bytes_received,
+                'bytes_deduplicated': self.bytes_deduplicated
+            }
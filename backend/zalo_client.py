@@ -0,0 +1,332 @@
+"""
+Zalo OA Finance Workflow - Zalo OA API Client
+Client gọi Zalo OA API dùng chung cho gửi tin, broadcast và thông báo:
+- connection pool keep-alive (requests.Session cho code đồng bộ, aiohttp cho asyncio)
+- thử lại với exponential backoff + jitter khi gặp 5xx, 429, lỗi mạng hoặc lỗi quota
+- tự refresh access token khi hết hạn (mã lỗi -216/-124) hoặc sắp hết hạn
+- histogram độ trễ theo từng endpoint
+"""
+
+import time
+import random
+import asyncio
+import threading
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import LatencyHistogram
+
+DEFAULT_API_URL = 'https://openapi.zalo.me/v3.0/oa'
+DEFAULT_OAUTH_URL = 'https://oauth.zaloapp.com/v4/oa/access_token'
+# Mã lỗi Zalo: access token không hợp lệ / hết hạn -> refresh rồi gọi lại
+TOKEN_ERRORS = (-216, -124)
+# Mã lỗi Zalo khi vượt quota (HTTP 200) - xử lý như 429
+RATE_LIMIT_ERRORS = (-32,)
+# Refresh trước khi token hết hạn (giây)
+REFRESH_MARGIN = 60
+
+
+class ZaloAPIError(Exception):
+    """Zalo OA API trả lỗi (sau khi đã thử lại nếu lỗi tạm thời)"""
+
+    def __init__(self, message, code=None, status=None):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+
+def classify(status, body):
+    """
+    Cách xử lý một response: 'ok' | 'refresh' | 'retry' | 'error'.
+    status None = lỗi mạng/timeout.
+    """
+    if status is None or status == 429 or status >= 500:
+        return 'retry'
+    if not isinstance(body, dict):
+        return 'error'
+    code = body.get('error', 0)
+    if code in TOKEN_ERRORS:
+        return 'refresh'
+    if code in RATE_LIMIT_ERRORS:
+        return 'retry'
+    if status != 200 or code != 0:
+        return 'error'
+    return 'ok'
+
+
+def backoff_delay(attempt, base, cap, retry_after=None):
+    """Exponential backoff, full jitter; tôn trọng Retry-After của server nếu có"""
+    if retry_after is not None:
+        return min(retry_after, cap)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _retry_after(headers):
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _error(status, body, exception=None):
+    if exception is not None:
+        return ZaloAPIError(f'Không kết nối được Zalo OA: {exception}')
+    if isinstance(body, dict):
+        return ZaloAPIError(body.get('message') or f'Zalo OA lỗi {body.get("error")}', body.get('error'), status)
+    return ZaloAPIError(f'Zalo OA trả HTTP {status}', status=status)
+
+
+class ClientMetrics:
+    """Histogram độ trễ từng endpoint + bộ đếm gọi/thử lại/lỗi, dùng chung cho các client"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    def observe(self, endpoint, seconds):
+        histogram = self._latency.get(endpoint)
+        if histogram is None:
+            with self._lock:
+                histogram = self._latency.setdefault(endpoint, LatencyHistogram())
+        histogram.observe(seconds)
+        with self._lock:
+            self.calls += 1
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+
+    def stats(self):
+        with self._lock:
+            latency = dict(self._latency)
+            counters = {'calls': self.calls, 'retries': self.retries, 'failures': self.failures}
+        counters['latency'] = {endpoint: histogram.stats() for endpoint, histogram in latency.items()}
+        return counters
+
+
+class TokenManager:
+    """Access token của OA; refresh bằng refresh token, một thread refresh tại một thời điểm"""
+
+    def __init__(self, access_token, refresh_token=None, app_id=None, app_secret=None,
+                 oauth_url=DEFAULT_OAUTH_URL, timeout=10.0, metrics=None):
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.oauth_url = oauth_url
+        self.timeout = timeout
+        self.metrics = metrics or ClientMetrics()
+        # None = không biết thời điểm hết hạn (token cấu hình sẵn)
+        self.expires_at = None
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    def needs_refresh(self):
+        return (self.refresh_token is not None and self.expires_at is not None
+                and self.expires_at - time.time() < REFRESH_MARGIN)
+
+    def current(self):
+        """Token hiện tại, refresh trước nếu sắp hết hạn"""
+        if self.needs_refresh():
+            return self.refresh(self.access_token)
+        return self.access_token
+
+    def refresh(self, stale):
+        """
+        Lấy access token mới thay cho `stale`; nếu thread khác đã refresh
+        trong lúc chờ lock thì dùng luôn token đó
+        """
+        with self._lock:
+            if self.access_token != stale and not self.needs_refresh():
+                return self.access_token
+            if not self.refresh_token:
+                raise ZaloAPIError('Access token hết hạn và chưa cấu hình refresh token', code=TOKEN_ERRORS[0])
+            started = time.perf_counter()
+            try:
+                response = self._session.post(self.oauth_url, data={
+                    'refresh_token': self.refresh_token,
+                    'app_id': self.app_id,
+                    'grant_type': 'refresh_token'
+                }, headers={'secret_key': self.app_secret or ''}, timeout=self.timeout)
+                body = response.json()
+            except (requests.RequestException, ValueError) as e:
+                raise ZaloAPIError(f'Không refresh được access token: {e}')
+            finally:
+                self.metrics.observe('oauth/access_token', time.perf_counter() - started)
+            if not isinstance(body, dict) or not body.get('access_token'):
+                message = body.get('error_description') or body.get('message') if isinstance(body, dict) else None
+                raise ZaloAPIError(message or 'Không refresh được access token', status=response.status_code)
+            self.access_token = body['access_token']
+            self.refresh_token = body.get('refresh_token') or self.refresh_token
+            expires_in = body.get('expires_in')
+            self.expires_at = time.time() + float(expires_in) if expires_in else None
+            self.refreshes += 1
+            return self.access_token
+
+    def stats(self):
+        return {
+            'refreshes': self.refreshes,
+            'expires_at': self.expires_at,
+            'can_refresh': self.refresh_token is not None
+        }
+
+
+class _BaseClient:
+    def __init__(self, tokens, api_url=DEFAULT_API_URL, pool_size=10, timeout=10.0,
+                 max_retries=3, backoff_base=0.2, backoff_cap=5.0):
+        self.tokens = tokens
+        self.api_url = api_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.metrics = tokens.metrics
+
+    def _url(self, path):
+        return f'{self.api_url}/{path.strip("/")}'
+
+    def _next_step(self, action, attempt, refreshed):
+        """'refresh' | 'retry' | None (dừng, báo lỗi)"""
+        if action == 'refresh' and not refreshed:
+            return 'refresh'
+        if action == 'retry' and attempt < self.max_retries:
+            self.metrics.retried()
+            return 'retry'
+        self.metrics.failed()
+        return None
+
+    @staticmethod
+    def text_message(user_id, text):
+        return {'recipient': {'user_id': user_id}, 'message': {'text': text}}
+
+
+class ZaloClient(_BaseClient):
+    """Client đồng bộ (thread request của Flask), keep-alive qua pool của requests.Session"""
+
+    def __init__(self, tokens, **options):
+        super().__init__(tokens, **options)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def call(self, method, path, json=None, params=None):
+        """Gọi API, trả về trường data của response; ZaloAPIError nếu thất bại"""
+        endpoint = path.strip('/')
+        attempt, refreshed = 0, False
+        while True:
+            token = self.tokens.current()
+            status = body = retry_after = exception = None
+            started = time.perf_counter()
+            try:
+                response = self._session.request(
+                    method, self._url(path), json=json, params=params,
+                    headers={'access_token': token}, timeout=self.timeout
+                )
+                status, retry_after = response.status_code, _retry_after(response.headers)
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = None
+            except requests.RequestException as e:
+                exception = e
+            finally:
+                self.metrics.observe(endpoint, time.perf_counter() - started)
+
+            action = classify(status, body)
+            if action == 'ok':
+                return body.get('data') or {}
+            step = self._next_step(action, attempt, refreshed)
+            if step == 'refresh':
+                refreshed = True
+                self.tokens.refresh(token)
+            elif step == 'retry':
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap, retry_after))
+                attempt += 1
+            else:
+                raise _error(status, body, exception)
+
+    def send_text(self, user_id, text):
+        """Gửi tin nhắn văn bản (tin tư vấn) tới user, trả về {'message_id', ...}"""
+        return self.call('POST', 'message/cs', json=self.text_message(user_id, text))
+
+
+class AsyncZaloClient(_BaseClient):
+    """Client asyncio; aiohttp session (pool `pool_size` kết nối) tạo trong event loop dùng nó"""
+
+    def __init__(self, tokens, **options):
+        super().__init__(tokens, **options)
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def _token(self, refresh_from=None):
+        # Refresh dùng HTTP đồng bộ: chạy trong executor để không chặn event loop
+        loop = asyncio.get_running_loop()
+        if refresh_from is not None:
+            return await loop.run_in_executor(None, self.tokens.refresh, refresh_from)
+        if self.tokens.needs_refresh():
+            return await loop.run_in_executor(None, self.tokens.current)
+        return self.tokens.access_token
+
+    async def call(self, method, path, json=None, params=None):
+        endpoint = path.strip('/')
+        session = self._get_session()
+        attempt, refreshed = 0, False
+        token = await self._token()
+        while True:
+            status = body = retry_after = exception = None
+            started = time.perf_counter()
+            try:
+                async with session.request(
+                    method, self._url(path), json=json, params=params,
+                    headers={'access_token': token}
+                ) as response:
+                    status, retry_after = response.status, _retry_after(response.headers)
+                    try:
+                        body = await response.json(content_type=None)
+                    except ValueError:
+                        body = None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                exception = e
+            finally:
+                self.metrics.observe(endpoint, time.perf_counter() - started)
+
+            action = classify(status, body)
+            if action == 'ok':
+                return body.get('data') or {}
+            step = self._next_step(action, attempt, refreshed)
+            if step == 'refresh':
+                refreshed = True
+                token = await self._token(refresh_from=token)
+            elif step == 'retry':
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap, retry_after))
+                attempt += 1
+                token = await self._token()
+            else:
+                raise _error(status, body, exception)
+
+    async def send_text(self, user_id, text):
+        return await self.call('POST', 'message/cs', json=self.text_message(user_id, text))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,133 @@
+"""
+Zalo OA Finance Workflow - Zalo OA API Stub
+Server aiohttp giả lập các endpoint Zalo OA mà backend gọi ra (gửi tin nhắn CS,
+refresh access token), dùng cho chế độ demo, test và đo hiệu năng mà không cần OA thật.
+Có thể bơm lỗi để kiểm tra client: POST /faults {"status": 503, "count": 2} làm
+2 request kế tiếp trả 503; POST /expire làm access token hiện tại hết hạn.
+
+Chạy riêng: python zalo_stub.py --port 5055 --latency-ms 20
+"""
+
+import uuid
+import random
+import asyncio
+import argparse
+import threading
+
+from aiohttp import web
+
+API_PREFIX = '/v3.0/oa'
+OAUTH_PATH = '/v4/oa/access_token'
+
+
+def create_app(latency_ms=0.0, error_rate=0.0, token_ttl=90000):
+    """
+    App aiohttp của stub; latency_ms giả lập độ trễ mạng, error_rate tỉ lệ trả 503.
+    Trước lần refresh đầu tiên mọi access token khác rỗng đều hợp lệ.
+    """
+    stats = {'received': 0, 'failed': 0, 'refreshes': 0}
+    state = {'access_token': None, 'faults': []}
+
+    def injected_fault():
+        if state['faults']:
+            return state['faults'].pop(0)
+        if error_rate and random.random() < error_rate:
+            return 503
+        return None
+
+    async def send_message(request):
+        stats['received'] += 1
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        fault = injected_fault()
+        if fault is not None:
+            stats['failed'] += 1
+            return web.json_response({'error': -1, 'message': 'Injected fault'}, status=fault)
+        token = request.headers.get('access_token')
+        if not token or (state['access_token'] is not None and token != state['access_token']):
+            return web.json_response({'error': -216, 'message': 'Access token is invalid'})
+        body = await request.json()
+        user_id = (body.get('recipient') or {}).get('user_id')
+        if not user_id or not (body.get('message') or {}).get('text'):
+            return web.json_response({'error': -201, 'message': 'Parameters are invalid'})
+        return web.json_response({
+            'error': 0,
+            'message': 'Success',
+            'data': {'message_id': uuid.uuid4().hex, 'user_id': user_id}
+        })
+
+    async def refresh_token(request):
+        form = await request.post()
+        if not form.get('refresh_token') or form.get('grant_type') != 'refresh_token':
+            return web.json_response({'error': -14014, 'error_description': 'Invalid refresh token'}, status=400)
+        stats['refreshes'] += 1
+        state['access_token'] = f'stub_{uuid.uuid4().hex}'
+        return web.json_response({
+            'access_token': state['access_token'],
+            'refresh_token': f'stub_refresh_{uuid.uuid4().hex}',
+            'expires_in': str(token_ttl)
+        })
+
+    async def expire(request):
+        state['access_token'] = f'expired_{uuid.uuid4().hex}'
+        return web.json_response({'status': 'expired'})
+
+    async def faults(request):
+        body = await request.json()
+        state['faults'].extend([int(body.get('status', 503))] * int(body.get('count', 1)))
+        return web.json_response({'pending': len(state['faults'])})
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post(f'{API_PREFIX}/message/cs', send_message)
+    app.router.add_post(OAUTH_PATH, refresh_token)
+    app.router.add_post('/expire', expire)
+    app.router.add_post('/faults', faults)
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+async def start(host='127.0.0.1', port=0, **options):
+    """Chạy stub trong event loop hiện tại; trả về (runner, địa chỉ gốc http://host:port)"""
+    runner = web.AppRunner(create_app(**options), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{port}'
+
+
+def start_in_thread(**options):
+    """Chạy stub trong event loop của một thread nền; trả về địa chỉ gốc"""
+    started = {}
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        started['runner'], started['root'] = loop.run_until_complete(start(**options))
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name='zalo-stub', daemon=True).start()
+    ready.wait()
+    return started['root']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Zalo OA API stub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(
+        create_app(latency_ms=args.latency_ms, error_rate=args.error_rate),
+        host=args.host, port=args.port, access_log=None
+    )
+
+
+if __name__ == '__main__':
+    main()
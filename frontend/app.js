@@ -9,9 +9,12 @@ const AppState = {
     user: null,
     currentPage: 'dashboard',
     leads: [],
+    leadsCursor: null,
     documents: [],
+    documentsCursor: null,
     users: [],
     socket: null,
+    leadRooms: new Set(),
     chatUserId: 'test_user_' + Math.random().toString(36).substr(2, 9),
     chatStartTime: new Date(),
     messageCount: 1
@@ -113,6 +116,31 @@ async function apiCall(endpoint, method = 'GET', data = null) {
     }
 }
 
+// Paginated API Helper - cursor của trang sau nằm trong header X-Next-Cursor
+async function apiPage(endpoint, cursor = null) {
+    const separator = endpoint.includes('?') ? '&' : '?';
+    const url = cursor ? `${endpoint}${separator}after=${encodeURIComponent(cursor)}` : endpoint;
+    const headers = {};
+    
+    if (AppState.token) {
+        headers['Authorization'] = `Bearer ${AppState.token}`;
+    }
+    
+    const response = await fetch(`${API_URL}${url}`, { headers });
+    const result = await response.json();
+    
+    if (!response.ok) {
+        throw new Error(result.error || 'API Error');
+    }
+    
+    return { items: result, nextCursor: response.headers.get('X-Next-Cursor') };
+}
+
+function toggleLoadMore(buttonId, cursor) {
+    const button = document.getElementById(buttonId);
+    if (button) button.style.display = cursor ? 'block' : 'none';
+}
+
 // Auth Functions
 async function handleLogin(e) {
     e.preventDefault();
@@ -321,11 +349,14 @@ function getStatusName(status) {
 }
 
 // Leads Management
-async function loadLeads() {
+async function loadLeads(append = false) {
     try {
-        const leads = await apiCall('/leads');
-        AppState.leads = leads;
-        renderLeadsTable(leads);
+        const page = await apiPage('/leads', append ? AppState.leadsCursor : null);
+        AppState.leads = append ? AppState.leads.concat(page.items) : page.items;
+        AppState.leadsCursor = page.nextCursor;
+        renderLeadsTable(AppState.leads);
+        syncLeadRooms(AppState.leads);
+        toggleLoadMore('leads-load-more', page.nextCursor);
     } catch (error) {
         console.error('Failed to load leads:', error);
     }
@@ -371,13 +402,26 @@ function renderLeadsTable(leads) {
     `).join('');
 }
 
+// Server-side search (tên không dấu, số điện thoại, ID) - debounce theo từng lần gõ
+let leadSearchTimer = null;
+
 function filterLeads(searchTerm) {
-    const filtered = AppState.leads.filter(lead => 
-        lead.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        lead.phone.includes(searchTerm) ||
-        lead.id.includes(searchTerm)
-    );
-    renderLeadsTable(filtered);
+    clearTimeout(leadSearchTimer);
+    leadSearchTimer = setTimeout(async () => {
+        const term = searchTerm.trim();
+        if (!term) {
+            loadLeads();
+            return;
+        }
+        
+        try {
+            const leads = await apiCall(`/leads/search?q=${encodeURIComponent(term)}`);
+            renderLeadsTable(leads);
+            toggleLoadMore('leads-load-more', null);
+        } catch (error) {
+            console.error('Failed to search leads:', error);
+        }
+    }, 250);
 }
 
 function showCreateLeadModal() {
@@ -594,11 +638,13 @@ function getStepName(step) {
 }
 
 // Documents Management
-async function loadDocuments() {
+async function loadDocuments(append = false) {
     try {
-        const docs = await apiCall('/documents');
-        AppState.documents = docs;
-        renderDocumentsTable(docs);
+        const page = await apiPage('/documents', append ? AppState.documentsCursor : null);
+        AppState.documents = append ? AppState.documents.concat(page.items) : page.items;
+        AppState.documentsCursor = page.nextCursor;
+        renderDocumentsTable(AppState.documents);
+        toggleLoadMore('documents-load-more', page.nextCursor);
     } catch (error) {
         console.error('Failed to load documents:', error);
     }
@@ -729,8 +775,9 @@ async function uploadDocument() {
 
 async function processOCR(docId) {
     try {
+        // Job chạy nền, kết quả về qua event ocr_completed
         await apiCall(`/documents/${docId}/ocr`, 'POST');
-        showToast('Xử lý OCR thành công!', 'success');
+        showToast('Đã đưa hồ sơ vào hàng đợi OCR', 'success');
         loadDocuments();
     } catch (error) {
         showToast('OCR thất bại: ' + error.message, 'error');
@@ -1002,7 +1049,8 @@ setInterval(() => {
 // Socket.IO Connection
 function connectSocket() {
     try {
-        AppState.socket = io('/dashboard');
+        AppState.socket = io('/dashboard', { auth: { token: AppState.token } });
+        AppState.leadRooms = new Set();
         
         AppState.socket.on('connect', () => {
             console.log('Connected to dashboard socket');
@@ -1018,18 +1066,49 @@ function connectSocket() {
             }
         });
         
-        AppState.socket.on('lead_updated', (lead) => {
+        // Một event cho mỗi khối lead nhập từ file, status done/failed khi kết thúc
+        AppState.socket.on('leads_imported', (data) => {
+            if (data.status === 'done') {
+                showToast(`Đã nhập ${data.inserted} lead (${data.duplicates} trùng, ${data.invalid} lỗi)`, 'success');
+            } else if (data.status === 'failed') {
+                showToast('Nhập lead thất bại: ' + data.error, 'error');
+            }
+            if (data.count === 0 && data.status === 'running') return;
+            if (AppState.currentPage === 'dashboard') {
+                loadDashboardData();
+            }
             if (AppState.currentPage === 'leads') {
                 loadLeads();
             }
         });
         
+        // Delta: { id, changes: {field: value}, updated_at }
+        AppState.socket.on('lead_updated', (delta) => {
+            const lead = AppState.leads.find(l => l.id === delta.id);
+            if (!lead) return;
+            Object.assign(lead, delta.changes, { updated_at: delta.updated_at });
+            if (AppState.currentPage === 'leads') {
+                renderLeadsTable(AppState.leads);
+            }
+        });
+        
         AppState.socket.on('bot_response', (data) => {
             addChatMessage('bot', data.response.text);
             AppState.messageCount++;
             document.getElementById('chat-message-count').textContent = AppState.messageCount;
         });
         
+        AppState.socket.on('ocr_completed', (data) => {
+            if (data.status === 'done') {
+                showToast('Xử lý OCR thành công!', 'success');
+            } else {
+                showToast('OCR thất bại: ' + data.error, 'error');
+            }
+            if (AppState.currentPage === 'documents') {
+                loadDocuments();
+            }
+        });
+        
         AppState.socket.on('new_message', (data) => {
             const count = parseInt(document.getElementById('notification-count').textContent) + 1;
             document.getElementById('notification-count').textContent = count;
@@ -1040,6 +1119,19 @@ function connectSocket() {
     }
 }
 
+// Join rooms of the leads on screen, leave the ones no longer shown
+function syncLeadRooms(leads) {
+    if (!AppState.socket) return;
+    const wanted = new Set(leads.map(l => l.id));
+    AppState.leadRooms.forEach(id => {
+        if (!wanted.has(id)) AppState.socket.emit('leave_lead_room', { lead_id: id });
+    });
+    wanted.forEach(id => {
+        if (!AppState.leadRooms.has(id)) AppState.socket.emit('join_lead_room', { lead_id: id });
+    });
+    AppState.leadRooms = wanted;
+}
+
 // Utility Functions
 function closeModal() {
     document.getElementById('modal-overlay').style.display = 'none';
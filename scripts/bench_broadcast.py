@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Zalo OA Finance Workflow - Broadcast Throughput Benchmark
+Đo tốc độ gửi broadcast (tin/giây) tới stub Zalo OA chạy ở tiến trình riêng,
+theo số request đồng thời và quota OA
+
+Dùng: python scripts/bench_broadcast.py --recipients 20000 --concurrency 10,50,200 --latency-ms 20
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import zalo_stub  # noqa: E402
+from storage import open_storage  # noqa: E402
+from broadcast import BroadcastEngine  # noqa: E402
+from zalo_client import TokenManager, AsyncZaloClient  # noqa: E402
+
+STUB_PORT = 5055
+
+
+def run_stub(port, latency_ms):
+    from aiohttp import web
+    web.run_app(zalo_stub.create_app(latency_ms=latency_ms), host='127.0.0.1', port=port,
+                access_log=None, print=None)
+
+
+def populate(db, recipients):
+    for i in range(recipients):
+        db.append_messages(f'U{i:08d}', [
+            {'sender': 'user', 'text': 'Xin chào', 'timestamp': '2025-01-01T08:00:00'}
+        ], created_at='2025-01-01T08:00:00')
+
+
+def run(db, api_url, concurrency, batch_size, rate_limit):
+    client = AsyncZaloClient(TokenManager('bench_token'), api_url=api_url, pool_size=concurrency)
+    engine = BroadcastEngine(
+        db, client, concurrency=concurrency, batch_size=batch_size, rate_limit=rate_limit
+    ).start()
+    broadcast_id = f'bench-{concurrency}-{rate_limit}'
+    db.put('broadcast_messages', broadcast_id, {
+        'id': broadcast_id,
+        'content': 'Ưu đãi lãi suất 0% cho khoản vay đầu tiên',
+        'target_audience': 'all',
+        'status': 'scheduled',
+        'sent_count': 0,
+        'created_by': 'bench'
+    })
+    started = time.perf_counter()
+    result = engine.submit(broadcast_id).result()
+    elapsed = time.perf_counter() - started
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark broadcast delivery')
+    parser.add_argument('--recipients', type=int, default=20000)
+    parser.add_argument('--concurrency', default='10,50,200', help='Phân tách bằng dấu phẩy')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--rate-limit', type=float, default=0, help='Quota OA (tin/giây), 0 = không giới hạn')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Độ trễ giả lập của stub')
+    args = parser.parse_args()
+
+    stub = multiprocessing.Process(target=run_stub, args=(STUB_PORT, args.latency_ms), daemon=True)
+    stub.start()
+    time.sleep(1)
+    api_url = f'http://127.0.0.1:{STUB_PORT}{zalo_stub.API_PREFIX}'
+
+    db = open_storage('memory://')
+    populate(db, args.recipients)
+
+    print(f"{'concurrency':>11} {'rate limit':>10} {'sent':>8} {'failed':>7} {'seconds':>8} {'msg/s':>9}")
+    try:
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            result, elapsed = run(db, api_url, concurrency, args.batch_size, args.rate_limit)
+            print(f"{concurrency:>11} {args.rate_limit or '-':>10} {result['sent_count']:>8} "
+                  f"{result['failed_count']:>7} {elapsed:>8.2f} {result['sent_count'] / elapsed:>9.1f}")
+    finally:
+        stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Zalo OA Finance Workflow - Lead Import Benchmark
+Sinh file lead (CSV, tùy chọn XLSX) với tỉ lệ dòng trùng / lỗi cho trước, đo thời gian
+chỉ đọc file bằng pandas so với toàn bộ job nhập (chuẩn hóa, chống trùng, ghi theo khối,
+một event mỗi khối) và so với tạo từng lead như POST /api/leads (ghi + index + event
+cho mỗi lead, chưa tính HTTP)
+
+Dùng: python scripts/bench_lead_import.py --rows 100000 --storage memory://,sqlite
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from storage import open_storage  # noqa: E402
+from search import LeadSearchIndex  # noqa: E402
+from aggregates import DashboardAggregates  # noqa: E402
+from lead_import import LeadImporter, read_chunks  # noqa: E402
+
+SURNAMES = ('Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Võ', 'Đặng', 'Bùi')
+GIVEN = ('Văn An', 'Thị Bình', 'Minh Cường', 'Thu Dung', 'Quốc Hùng', 'Ngọc Lan')
+
+
+def generate_rows(count, duplicate_rate, invalid_rate, seed):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        roll = rng.random()
+        if rows and roll < duplicate_rate:
+            # Cùng số, khác cách viết (+84, khoảng trắng)
+            phone = '+84 ' + rng.choice(rows)[1][1:]
+        elif roll < duplicate_rate + invalid_rate:
+            phone = str(rng.randint(1000, 99999))
+        else:
+            phone = f'09{i:08d}'
+        rows.append((f'{rng.choice(SURNAMES)} {rng.choice(GIVEN)}', phone, f'kh{i}@demo.vn' if i % 3 == 0 else '',
+                     rng.choice(('vay_tin_chap', 'the_tin_dung', 'bao_hiem')), 'hoi_cho_2025'))
+    return rows
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8-sig') as f:
+        f.write('Họ và tên,Số điện thoại,Email,Sản phẩm quan tâm,Nhãn\n')
+        for row in rows:
+            f.write(','.join(row) + '\n')
+
+
+def write_xlsx(path, rows):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Họ và tên', 'Số điện thoại', 'Email', 'Sản phẩm quan tâm', 'Nhãn'])
+    for row in rows:
+        sheet.append(list(row))
+    workbook.save(path)
+
+
+def parse_only(path, fmt, chunk_rows):
+    started = time.perf_counter()
+    rows = sum(len(frame) for frame, _ in read_chunks(path, fmt, chunk_rows))
+    return time.perf_counter() - started, rows
+
+
+def batched_import(url, path, fmt, chunk_rows, work_dir):
+    db = open_storage(url)
+    index = LeadSearchIndex()
+    dashboard = DashboardAggregates(refill_recent=lambda n: db.page('leads', n)[0])
+    done = threading.Event()
+    events = []
+
+    def on_batch(job, leads):
+        for lead in leads:
+            dashboard.lead_changed(None, lead)
+        events.append(json.dumps({'import_id': job['id'], 'count': len(leads), 'progress': job['progress']}))
+
+    importer = LeadImporter(db, index, work_dir, chunk_rows=chunk_rows, on_batch=on_batch,
+                            on_done=lambda job: done.set()).start()
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        job = importer.submit(f, os.path.basename(path), 'bench')
+    done.wait()
+    elapsed = time.perf_counter() - started
+    job = db.get('lead_imports', job['id'])
+    db.close()
+    return elapsed, job, len(events)
+
+
+def per_row(url, rows):
+    # Đường cũ: mỗi lead một lần ghi, cập nhật index, một event new_lead
+    db = open_storage(url)
+    index = LeadSearchIndex()
+    dashboard = DashboardAggregates(refill_recent=lambda n: db.page('leads', n)[0])
+    started = time.perf_counter()
+    for name, phone, email, product, label in rows:
+        # Bản ghi giống POST /api/leads
+        now = datetime.now().isoformat()
+        lead = {
+            'id': str(uuid.uuid4())[:8], 'name': name, 'phone': phone, 'email': email, 'zalo_user_id': '',
+            'source': 'zalo_oa', 'product_interest': product, 'status': 'tiep_nhan', 'assigned_to': '',
+            'labels': [label], 'notes': '', 'created_at': now, 'updated_at': now, 'created_by': 'bench'
+        }
+        db.put('leads', lead['id'], lead)
+        db.incr('total_leads')
+        index.add(lead)
+        dashboard.lead_changed(None, lead)
+        json.dumps(lead, ensure_ascii=False)
+    elapsed = time.perf_counter() - started
+    db.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark streaming lead import')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk-rows', type=int, default=5000)
+    parser.add_argument('--duplicates', type=float, default=0.05, help='Tỉ lệ dòng trùng số điện thoại')
+    parser.add_argument('--invalid', type=float, default=0.02, help='Tỉ lệ dòng số điện thoại sai')
+    parser.add_argument('--storage', default='memory://,sqlite', help='memory:// và/hoặc sqlite')
+    parser.add_argument('--per-row-sample', type=int, default=0,
+                        help='Chỉ chạy kiểu từng lead cho chừng này dòng rồi ngoại suy (0 = cả file)')
+    parser.add_argument('--xlsx', action='store_true', help='Đo thêm file XLSX (cần openpyxl)')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_import_')
+    try:
+        rows = generate_rows(args.rows, args.duplicates, args.invalid, seed=11)
+        files = [('csv', os.path.join(work_dir, 'leads.csv'))]
+        write_csv(files[0][1], rows)
+        if args.xlsx:
+            files.append(('xlsx', os.path.join(work_dir, 'leads.xlsx')))
+            write_xlsx(files[1][1], rows)
+
+        print(f'{args.rows} dòng, khối {args.chunk_rows} dòng')
+        print(f"{'storage':<8} {'file':<5} {'parse s':>8} {'import s':>9} {'rows/s':>9} "
+              f"{'inserted':>9} {'dup':>6} {'invalid':>7} {'events':>7}")
+        for storage in args.storage.split(','):
+            for fmt, path in files:
+                url = 'memory://' if storage.startswith('memory') else f'sqlite:///{work_dir}/{fmt}.db'
+                parse_seconds, _ = parse_only(path, fmt, args.chunk_rows)
+                elapsed, job, events = batched_import(url, path, fmt, args.chunk_rows,
+                                                      os.path.join(work_dir, 'jobs'))
+                print(f"{storage[:8]:<8} {fmt:<5} {parse_seconds:>8.2f} {elapsed:>9.2f} "
+                      f"{args.rows / elapsed:>9.0f} {job['inserted']:>9} {job['duplicates']:>6} "
+                      f"{job['invalid']:>7} {events:>7}")
+            url = 'memory://' if storage.startswith('memory') else f'sqlite:///{work_dir}/per_row.db'
+            sample = rows[:args.per_row_sample or None]
+            seconds = per_row(url, sample) * args.rows / len(sample)
+            label = 'từng lead' + (' (ngoại suy)' if len(sample) < len(rows) else '')
+            print(f"{storage[:8]:<8} {label:<24} {seconds:>8.2f} {args.rows / seconds:>9.0f}")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
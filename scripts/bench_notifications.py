@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Zalo OA Finance Workflow - Bulk Notification Benchmark
+Đo tốc độ render mẫu (biên dịch sẵn so với str.format mỗi lần) và thông lượng gửi
+hàng loạt qua worker pool từng kênh tới stub Zalo OA / SMTP chạy ở tiến trình riêng
+
+Dùng: python scripts/bench_notifications.py --recipients 20000 --workers 4,8,16 --latency-ms 5
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import zalo_stub  # noqa: E402
+import smtp_stub  # noqa: E402
+from storage import open_storage  # noqa: E402
+from email_client import EmailSender  # noqa: E402
+from zalo_client import TokenManager, ZaloClient  # noqa: E402
+from notifications import (  # noqa: E402
+    TEMPLATES, NotificationDispatcher, compile_templates, bulk_targets, render_jobs
+)
+
+ZALO_PORT = 5057
+SMTP_PORT = 2526
+VARIABLES = {'ten_doanh_nghiep': 'Tư Vấn Tài Chính Demo', 'ngay_gio': '09:00 ngày 20/10'}
+
+
+def run_zalo_stub(port, latency_ms):
+    from aiohttp import web
+    web.run_app(zalo_stub.create_app(latency_ms=latency_ms), host='127.0.0.1', port=port,
+                access_log=None, print=None)
+
+
+def run_smtp_stub(port, latency_ms):
+    async def serve():
+        _, server, _ = await smtp_stub.start('127.0.0.1', port, latency_ms=latency_ms)
+        async with server:
+            await server.serve_forever()
+    asyncio.run(serve())
+
+
+def populate(db, recipients):
+    for i in range(recipients):
+        db.put('leads', f'L{i:07d}', {
+            'id': f'L{i:07d}',
+            'name': f'Khách hàng {i}',
+            'email': f'khach{i}@demo.vn',
+            'zalo_user_id': f'U{i:08d}',
+            'status': 'tiep_nhan',
+            'labels': ['nhac_lich'],
+            'created_at': f'2025-01-01T08:{i // 60 % 60:02d}:{i % 60:02d}'
+        })
+
+
+def bench_render(count):
+    template = compile_templates()['nhac_lich_hen']
+    content = TEMPLATES['nhac_lich_hen']['content']
+    rows = [dict(VARIABLES, ten_khach_hang=f'Khách hàng {i}') for i in range(count)]
+    started = time.perf_counter()
+    for row in rows:
+        content.format_map(row)
+    formatted = time.perf_counter() - started
+    started = time.perf_counter()
+    for row in rows:
+        template.render(row)
+    compiled = time.perf_counter() - started
+    return formatted, compiled
+
+
+def wait(dispatcher, batch_id):
+    while True:
+        batch = dispatcher.get(batch_id)
+        if batch['status'] != 'sending':
+            return batch
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bulk notifications')
+    parser.add_argument('--recipients', type=int, default=20000)
+    parser.add_argument('--workers', default='4,8,16', help='Số worker mỗi kênh, phân tách bằng dấu phẩy')
+    parser.add_argument('--latency-ms', type=float, default=5, help='Độ trễ giả lập của stub')
+    args = parser.parse_args()
+
+    formatted, compiled = bench_render(200000)
+    print(f'render 200000 lần: str.format_map {formatted:.3f}s, biên dịch sẵn {compiled:.3f}s')
+
+    stubs = [
+        multiprocessing.Process(target=run_zalo_stub, args=(ZALO_PORT, args.latency_ms), daemon=True),
+        multiprocessing.Process(target=run_smtp_stub, args=(SMTP_PORT, args.latency_ms), daemon=True)
+    ]
+    for stub in stubs:
+        stub.start()
+    time.sleep(1)
+
+    db = open_storage('memory://')
+    populate(db, args.recipients)
+    template = compile_templates()['nhac_lich_hen']
+
+    print(f"{'channel':>8} {'workers':>7} {'render s':>8} {'sent':>7} {'failed':>7} {'seconds':>8} {'msg/s':>8}")
+    try:
+        for workers in (int(w) for w in args.workers.split(',')):
+            zalo = ZaloClient(TokenManager('bench_token'), api_url=f'http://127.0.0.1:{ZALO_PORT}{zalo_stub.API_PREFIX}',
+                              pool_size=workers)
+            email = EmailSender('127.0.0.1', SMTP_PORT, 'no-reply@demo.vn')
+            dispatcher = NotificationDispatcher(db, {
+                'zalo_oa': lambda address, subject, text: zalo.send_text(address, text),
+                'email': email.send
+            }, workers=workers).start()
+            for channel in ('zalo_oa', 'email'):
+                started = time.perf_counter()
+                jobs, _ = render_jobs(template, channel, bulk_targets(db, lead_filters={'labels': 'nhac_lich'}),
+                                      VARIABLES, args.recipients)
+                rendered = time.perf_counter() - started
+                batch = dispatcher.submit({
+                    'id': f'{channel}-{workers}', 'template': template.id, 'subject': template.name,
+                    'channel': channel, 'created_by': 'bench'
+                }, jobs)
+                batch = wait(dispatcher, batch['id'])
+                elapsed = time.perf_counter() - started
+                print(f"{channel:>8} {workers:>7} {rendered:>8.2f} {batch['sent_count']:>7} "
+                      f"{batch['failed_count']:>7} {elapsed:>8.2f} {batch['sent_count'] / elapsed:>8.1f}")
+    finally:
+        for stub in stubs:
+            stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Zalo OA Finance Workflow - OCR Job Throughput Benchmark
+Đo thông lượng job OCR (hồ sơ/giây) theo số tiến trình của pool với engine demo
+tốn CPU giả lập, và độ trễ của thread "API" chạy song song (pool tiến trình không
+giữ GIL nên API không bị chặn)
+
+Dùng: python scripts/bench_ocr.py --documents 64 --work-ms 200 --workers 1,2,4
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from storage import open_storage  # noqa: E402
+from metrics import LatencyHistogram  # noqa: E402
+from ocr import OCRService  # noqa: E402
+
+
+def api_probe(db, stop, histogram):
+    # Giả lập request nhẹ của API trong lúc OCR chạy
+    while not stop.is_set():
+        started = time.perf_counter()
+        db.page('documents', 20)
+        histogram.observe(time.perf_counter() - started)
+        time.sleep(0.005)
+
+
+def run(documents, workers, work_ms):
+    db = open_storage('memory://')
+    done = threading.Semaphore(0)
+    # start() fork sẵn các tiến trình của pool trước khi đo
+    service = OCRService(db, workers=workers, queue_size=documents,
+                         options={'work_ms': work_ms}, on_done=lambda job, document: done.release()).start()
+    for i in range(documents):
+        db.put('documents', f'D{i:05d}', {
+            'id': f'D{i:05d}', 'type': 'cccd', 'status': 'pending', 'created_at': f'2025-01-01T08:00:{i % 60:02d}'
+        })
+
+    stop = threading.Event()
+    probe = LatencyHistogram(range(1, 1001))
+    threading.Thread(target=api_probe, args=(db, stop, probe), daemon=True).start()
+    started = time.perf_counter()
+    for i in range(documents):
+        service.submit(db.get('documents', f'D{i:05d}'), 'bench')
+    for _ in range(documents):
+        done.acquire()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return service.stats(), elapsed, probe.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark OCR job pipeline')
+    parser.add_argument('--documents', type=int, default=64)
+    parser.add_argument('--work-ms', type=float, default=200, help='Thời gian CPU giả lập mỗi hồ sơ')
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})),
+                        help='Số tiến trình, phân tách bằng dấu phẩy')
+    args = parser.parse_args()
+
+    print(f'{os.cpu_count()} CPU, {args.work_ms:g} ms CPU mỗi hồ sơ')
+    print(f"{'workers':>7} {'done':>6} {'seconds':>8} {'docs/s':>8} {'ocr p50 ms':>10} {'api p99 ms':>10}")
+    for workers in (int(w) for w in args.workers.split(',')):
+        stats, elapsed, probe = run(args.documents, workers, args.work_ms)
+        print(f"{workers:>7} {stats['completed']:>6} {elapsed:>8.2f} {args.documents / elapsed:>8.1f} "
+              f"{stats['latency']['p50_ms']:>10} {probe['p99_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Zalo OA Finance Workflow - Restore Benchmark
+Đo thời gian khởi động lại MemoryStorage (nạp snapshot + phát lại WAL) theo kích thước dữ liệu.
+Khôi phục chạy trong tiến trình con (như khi restart thật) và so cả số lượng lẫn nội dung tin nhắn
+
+Dùng: python scripts/bench_restore.py --sizes 100000,1000000 --tail 20000
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import subprocess
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from storage import open_storage  # noqa: E402
+
+STATUSES = ['tiep_nhan', 'dang_xu_ly', 'cho_bo_sung', 'hoan_thanh']
+PRODUCTS = ['vay_tieu_dung', 'bao_hiem', 'dau_tu', 'tiet_kiem']
+
+
+def populate(db, leads):
+    """leads lead + leads/5 hồ sơ + leads/10 hội thoại (4 tin nhắn mỗi hội thoại)"""
+    start = datetime(2025, 1, 1)
+    for i in range(leads):
+        created_at = (start + timedelta(seconds=i)).isoformat()
+        db.put('leads', f'L{i:08d}', {
+            'id': f'L{i:08d}',
+            'name': f'Nguyễn Văn {i}',
+            'phone': f'09{i:08d}',
+            'email': f'lead{i}@demo.vn',
+            'source': 'zalo_oa',
+            'product_interest': PRODUCTS[i % len(PRODUCTS)],
+            'status': STATUSES[i % len(STATUSES)],
+            'assigned_to': f'agent{i % 50}',
+            'labels': ['vip'] if i % 7 == 0 else [],
+            'notes': '',
+            'created_at': created_at,
+            'updated_at': created_at,
+            'created_by': 'admin'
+        })
+    for i in range(leads // 5):
+        db.put('documents', f'D{i:08d}', {
+            'id': f'D{i:08d}',
+            'lead_id': f'L{i:08d}',
+            'type': 'cccd',
+            'status': 'pending',
+            'created_at': (start + timedelta(seconds=i)).isoformat()
+        })
+    for i in range(leads // 10):
+        at = (start + timedelta(seconds=i)).isoformat()
+        db.append_messages(f'U{i:08d}', [
+            {'sender': 'user', 'text': 'Tôi muốn đăng ký tư vấn', 'timestamp': at},
+            {'sender': 'bot', 'text': 'Vui lòng cung cấp họ tên và số điện thoại', 'timestamp': at,
+             'intent': 'dang_ky_tu_van', 'confidence': 0.9},
+            {'sender': 'user', 'text': 'Nguyễn Văn A 0901234567', 'timestamp': at},
+            {'sender': 'agent', 'text': 'Em sẽ gọi lại ngay', 'timestamp': at}
+        ], created_at=at)
+        db.incr('total_leads')
+
+
+def apply_tail(db, count):
+    """Thay đổi sau snapshot - phải được phát lại từ WAL (kèm intent chưa có trong snapshot)"""
+    for i in range(count):
+        lead = db.get('leads', f'L{i:08d}')
+        lead['status'] = 'hoan_thanh'
+        db.put('leads', lead['id'], lead)
+    for i in range(min(count, db.count('conversations'))):
+        at = datetime(2025, 2, 1).isoformat()
+        db.append_messages(f'U{i:08d}', [
+            {'sender': 'user', 'text': 'Cảm ơn em', 'timestamp': at},
+            {'sender': 'bot', 'text': 'Rất vui được hỗ trợ bạn', 'timestamp': at, 'intent': 'cam_on', 'confidence': 0.8}
+        ], created_at=at)
+
+
+def fingerprint(db):
+    """Số record theo collection, số lead đã chuyển trạng thái, bộ đếm và hash toàn bộ tin nhắn"""
+    digest = hashlib.sha256()
+    for conversation in sorted(db.values('conversations'), key=lambda c: c['user_id']):
+        messages, _ = db.messages(conversation['user_id'], limit=None)
+        digest.update(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    return [db.count('leads'), db.count('documents'), db.count('conversations'),
+            len(db.find('leads', 'status', 'hoan_thanh')), db.counter('total_leads'), digest.hexdigest()]
+
+
+def restore_child(directory):
+    """Tiến trình con: khôi phục từ journal, in thời gian + fingerprint (JSON)"""
+    started = time.perf_counter()
+    restored = open_storage('memory://', journal_dir=directory)
+    restore_seconds = time.perf_counter() - started
+    print(json.dumps({'restore_s': restore_seconds, 'fingerprint': fingerprint(restored)}))
+    restored.close()
+
+
+def run(leads, tail):
+    directory = tempfile.mkdtemp(prefix='journal-')
+    try:
+        db = open_storage('memory://', journal_dir=directory)
+        started = time.perf_counter()
+        populate(db, leads)
+        write_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        snapshot_bytes = db.snapshot()
+        snapshot_seconds = time.perf_counter() - started
+
+        apply_tail(db, tail)
+        expected = fingerprint(db)
+        wal_bytes = db.journal.bytes_written
+        db.close()
+        del db
+
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--restore-child', directory],
+            capture_output=True, text=True, check=True
+        )
+        result = json.loads(child.stdout)
+        restore_seconds, actual = result['restore_s'], result['fingerprint']
+        return {
+            'records': sum(expected[:3]),
+            'write_s': write_seconds,
+            'snapshot_s': snapshot_seconds,
+            'snapshot_mb': snapshot_bytes / 1e6,
+            'wal_mb': wal_bytes / 1e6,
+            'restore_s': restore_seconds,
+            'ok': actual == expected
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark snapshot + WAL restore')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='Số lead, phân tách bằng dấu phẩy')
+    parser.add_argument('--tail', type=int, default=20000, help='Số cập nhật sau snapshot (phát lại từ WAL)')
+    parser.add_argument('--restore-child', metavar='DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.restore_child:
+        restore_child(args.restore_child)
+        return
+
+    print(f"{'leads':>10} {'records':>10} {'write s':>8} {'snap s':>7} {'snap MB':>8} "
+          f"{'wal MB':>7} {'restore s':>9}  ok")
+    for size in (int(s) for s in args.sizes.split(',')):
+        result = run(size, min(args.tail, size))
+        print(f"{size:>10} {result['records']:>10} {result['write_s']:>8.2f} {result['snapshot_s']:>7.2f} "
+              f"{result['snapshot_mb']:>8.1f} {result['wal_mb']:>7.1f} {result['restore_s']:>9.2f}  "
+              f"{'✅' if result['ok'] else '❌'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Zalo OA Finance Workflow - Zalo Client Latency Benchmark
+So sánh độ trễ gửi tin (p50/p99) giữa client dùng connection pool keep-alive
+và mở kết nối mới cho mỗi lần gọi, với stub Zalo OA chạy ở tiến trình riêng
+
+Dùng: python scripts/bench_zalo_client.py --calls 2000 --threads 8 --latency-ms 5
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import requests  # noqa: E402
+import aiohttp  # noqa: E402
+
+import zalo_stub  # noqa: E402
+from metrics import LatencyHistogram  # noqa: E402
+from zalo_client import TokenManager, ZaloClient, AsyncZaloClient  # noqa: E402
+
+STUB_PORT = 5056
+TEXT = 'Hồ sơ của bạn đã được duyệt'
+# Bucket 1 ms để phân biệt được p50/p99
+BUCKETS_MS = range(1, 1001)
+
+
+def run_stub(port, latency_ms):
+    from aiohttp import web
+    web.run_app(zalo_stub.create_app(latency_ms=latency_ms), host='127.0.0.1', port=port,
+                access_log=None, print=None)
+
+
+def timed(histogram, send, i):
+    started = time.perf_counter()
+    send(f'U{i:08d}', TEXT)
+    histogram.observe(time.perf_counter() - started)
+
+
+def bench_sync(api_url, calls, threads, pooled):
+    histogram = LatencyHistogram(BUCKETS_MS)
+    if pooled:
+        send = ZaloClient(TokenManager('bench_token'), api_url=api_url, pool_size=threads).send_text
+    else:
+        def send(user_id, text):
+            # Không giữ kết nối: mỗi lần gọi một TCP connection mới
+            response = requests.post(f'{api_url}/message/cs', json=ZaloClient.text_message(user_id, text),
+                                     headers={'access_token': 'bench_token', 'Connection': 'close'}, timeout=10)
+            response.json()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda i: timed(histogram, send, i), range(calls)))
+    return histogram.stats(), time.perf_counter() - started
+
+
+async def bench_async(api_url, calls, concurrency, pooled):
+    histogram = LatencyHistogram(BUCKETS_MS)
+    semaphore = asyncio.Semaphore(concurrency)
+    client = AsyncZaloClient(TokenManager('bench_token'), api_url=api_url, pool_size=concurrency)
+
+    async def send(i):
+        async with semaphore:
+            started = time.perf_counter()
+            if pooled:
+                await client.send_text(f'U{i:08d}', TEXT)
+            else:
+                async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as session:
+                    async with session.post(f'{api_url}/message/cs', headers={'access_token': 'bench_token'},
+                                            json=client.text_message(f'U{i:08d}', TEXT)) as response:
+                        await response.json()
+            histogram.observe(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(calls)))
+    elapsed = time.perf_counter() - started
+    await client.close()
+    return histogram.stats(), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Zalo OA client latency')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8, help='Số thread (sync) / coroutine đồng thời (async)')
+    parser.add_argument('--latency-ms', type=float, default=5, help='Độ trễ giả lập của stub')
+    args = parser.parse_args()
+
+    stub = multiprocessing.Process(target=run_stub, args=(STUB_PORT, args.latency_ms), daemon=True)
+    stub.start()
+    time.sleep(1)
+    api_url = f'http://127.0.0.1:{STUB_PORT}{zalo_stub.API_PREFIX}'
+
+    print(f"{'client':>6} {'connection':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'calls/s':>9}")
+    try:
+        for pooled in (False, True):
+            for kind in ('sync', 'async'):
+                if kind == 'sync':
+                    stats, elapsed = bench_sync(api_url, args.calls, args.threads, pooled)
+                else:
+                    stats, elapsed = asyncio.run(bench_async(api_url, args.calls, args.threads, pooled))
+                print(f"{kind:>6} {'pooled' if pooled else 'per-call':>10} {stats['p50_ms']:>8} "
+                      f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['max_ms']:>8} "
+                      f"{args.calls / elapsed:>9.1f}")
+    finally:
+        stub.terminate()
+
+
+if __name__ == '__main__':
+    main()